@@ -0,0 +1,121 @@
+import threading
+
+
+# Confirmed transactions by address and by id, blocks by hash
+'''
+    addresses: address -> [(height, position), ...] in chain order, as sender or recipient
+    transactions: tx id -> [(height, position), ...], identical transactions such as the rewards of
+    one miner are confirmed more than once
+    blocks: block hash -> height
+    The writer adds every appended block and removes blocks from the top when the chain switches to
+    another fork. Lookups hold the lock only while copying the requested entries, so their cost
+    depends on the size of the result and not on the length of the chain.
+    Every change is also kept as a journal record until it is taken for saving: [height, block hash,
+    [[tx id, [address, ...]], ...]] for an added block, replacing that height and everything above,
+    or [height] for a removed one. The saved journal is replayed on startup instead of reading blocks.
+'''
+
+
+class AddressIndex:
+    def __init__(self):
+        # Height and hash of the last indexed block
+        self.height = -1
+        self.hash = None
+        self.__addresses = {}
+        self.__transactions = {}
+        self.__blocks = {}
+        # Journal records not taken for saving yet
+        self.__journal = []
+        self.__lock = threading.Lock()
+
+    def add_block(self, block, block_hash):
+        entries = []
+        for tx in block.transactions:
+            addresses = [tx.sender] if tx.recipient == tx.sender else [tx.sender, tx.recipient]
+            entries.append([tx.tx_id, addresses])
+        self.add_entries(block.index, block_hash, entries)
+
+    # Indexes the block at height from its entries, [tx id, [address, ...]] per transaction in block order
+    def add_entries(self, height, block_hash, entries):
+        with self.__lock:
+            for position, (tx_id, addresses) in enumerate(entries):
+                location = (height, position)
+                for address in addresses:
+                    self.__addresses.setdefault(address, []).append(location)
+                self.__transactions.setdefault(tx_id, []).append(location)
+            self.__blocks[block_hash] = height
+            self.height = height
+            self.hash = block_hash
+            self.__journal.append([height, block_hash, entries])
+
+    # Removes the last indexed block, used when the chain switches to another fork
+    def remove_block(self, block, block_hash):
+        with self.__lock:
+            for position in reversed(range(len(block.transactions))):
+                tx = block.transactions[position]
+                location = (block.index, position)
+                self.__pop(self.__addresses, tx.sender, location)
+                self.__pop(self.__addresses, tx.recipient, location)
+                self.__pop(self.__transactions, tx.tx_id, location)
+            self.__blocks.pop(block_hash, None)
+            self.height = block.index - 1
+            self.hash = block.previous_hash
+            self.__journal.append([block.index])
+
+    @staticmethod
+    def __pop(index, key, location):
+        locations = index.get(key)
+        if locations and locations[-1] == location:
+            locations.pop()
+            if not locations:
+                del index[key]
+
+    # Number of transactions of address and their locations start..end-1
+    def get_history(self, address, start, end):
+        with self.__lock:
+            locations = self.__addresses.get(address, [])
+            return len(locations), locations[start:end]
+
+    def get_locations(self, tx_id):
+        with self.__lock:
+            return list(self.__transactions.get(tx_id, []))
+
+    def get_height(self, block_hash):
+        with self.__lock:
+            return self.__blocks.get(block_hash)
+
+    # Journal records since the last call, with full a record per indexed block instead
+    '''
+        Called by the saving thread, the full journal replaces the saved one once it grew much
+        longer than the chain.
+    '''
+
+    def take_journal(self, full=False):
+        with self.__lock:
+            journal = self.__journal
+            self.__journal = []
+            if not full:
+                return journal
+            entries = {}
+            for tx_id, locations in self.__transactions.items():
+                for location in locations:
+                    entries[location] = [tx_id, []]
+            for address, locations in self.__addresses.items():
+                for location in locations:
+                    entries[location][1].append(address)
+            heights = {height: block_hash for block_hash, height in self.__blocks.items()}
+        blocks = {}
+        for (height, position), entry in sorted(entries.items()):
+            blocks.setdefault(height, []).append(entry)
+        return [[height, heights[height], blocks.get(height, [])] for height in sorted(heights)]
+
+    # Added block records left after applying the removals and replacements of a saved journal, by height
+    @staticmethod
+    def replay_journal(records):
+        blocks = []
+        for record in records:
+            while blocks and blocks[-1][0] >= record[0]:
+                blocks.pop()
+            if len(record) > 1:
+                blocks.append(record)
+        return blocks
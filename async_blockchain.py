@@ -0,0 +1,112 @@
+import asyncio
+from concurrent.futures import ThreadPoolExecutor
+
+import chain_stream
+from blockchain_settings import ASYNC_EXECUTOR_WORKERS
+
+
+# Awaitable facade over Blockchain for the async node
+'''
+    Cheap reads of the published state (tip, balance, outstanding transactions, nodes) are answered
+    directly on the event loop. Anything that reads block bodies, verifies signatures, writes to
+    disk or talks to peers runs on a thread executor, proof of work already runs on the miner
+    processes. Both nodes share the same Blockchain core.
+'''
+
+
+class AsyncBlockchain:
+    def __init__(self, blockchain, executor=None):
+        self.blockchain = blockchain
+        self.__executor = executor if executor is not None else ThreadPoolExecutor(max_workers=ASYNC_EXECUTOR_WORKERS)
+
+    # Runs a blocking call on the executor
+    async def run(self, fn, *args):
+        return await asyncio.get_running_loop().run_in_executor(self.__executor, fn, *args)
+
+    @property
+    def wallet(self):
+        return self.blockchain.wallet
+
+    @wallet.setter
+    def wallet(self, wallet):
+        self.blockchain.wallet = wallet
+
+    @property
+    def resolve_conflicts(self):
+        return self.blockchain.resolve_conflicts
+
+    @resolve_conflicts.setter
+    def resolve_conflicts(self, resolve_conflicts):
+        self.blockchain.resolve_conflicts = resolve_conflicts
+
+    def get_tip(self):
+        return self.blockchain.get_tip()
+
+    def get_balance(self, sender=None):
+        return self.blockchain.get_balance(sender)
+
+    def get_open_transactions(self):
+        return self.blockchain.get_open_transactions()
+
+    def get_open_transaction_count(self):
+        return self.blockchain.get_open_transaction_count()
+
+    def get_nodes(self):
+        return self.blockchain.get_nodes()
+
+    def get_wanted(self, transaction_ids, blocks):
+        return self.blockchain.get_wanted(transaction_ids, blocks)
+
+    # Generator of the encoded blocks start..end-1, it blocks on the store so advance it with run
+    def stream_chain(self, mimetype, start=0, end=None):
+        count, blocks = self.blockchain.stream_blocks(start, end)
+        return chain_stream.encode_blocks(mimetype, count, blocks)
+
+    async def get_headers(self, start, end):
+        return await self.run(self.blockchain.get_headers, start, end)
+
+    async def get_blocks(self, start, end):
+        return await self.run(self.blockchain.get_blocks, start, end)
+
+    async def get_address_history(self, address, start, end):
+        return await self.run(self.blockchain.get_address_history, address, start, end)
+
+    async def get_transaction(self, tx_id):
+        return await self.run(self.blockchain.get_transaction, tx_id)
+
+    async def get_merkle_proof(self, tx_id, height=None):
+        return await self.run(self.blockchain.get_merkle_proof, tx_id, height)
+
+    async def get_block(self, block_hash):
+        return await self.run(self.blockchain.get_block, block_hash)
+
+    async def add_new_transaction(self, sender, recipient, signature, amount, is_receiving=False):
+        return await self.run(self.blockchain.add_new_transaction, sender, recipient, signature, amount,
+                              is_receiving)
+
+    async def add_block(self, block):
+        return await self.run(self.blockchain.add_block, block)
+
+    async def resolve(self):
+        return await self.run(self.blockchain.resolve)
+
+    async def mine_block(self):
+        return await self.run(self.blockchain.mine_block)
+
+    async def get_snapshots(self):
+        return await self.run(self.blockchain.get_snapshots)
+
+    async def get_snapshot(self, height=None):
+        return await self.run(self.blockchain.get_snapshot, height)
+
+    async def bootstrap(self):
+        return await self.run(self.blockchain.bootstrap)
+
+    async def save_data(self):
+        await self.run(self.blockchain.save_data)
+
+    async def add_node(self, node):
+        await self.run(self.blockchain.add_node, node)
+
+    async def remove_node(self, node):
+        await self.run(self.blockchain.remove_node, node)
@@ -0,0 +1,195 @@
+import asyncio
+import json
+from collections import deque
+from time import time
+
+import aiohttp
+
+import chain_stream
+import codec
+import metrics
+from blockchain_settings import BROADCAST_TIMEOUT, BROADCAST_RETRIES, BROADCAST_BACKOFF, ASYNC_PEER_CONNECTIONS, \
+    STREAM_CHUNK_SIZE, STREAM_QUEUE_SIZE
+
+
+# Answer of a peer, has the attributes Blockchain callbacks use on a requests response
+class PeerResponse:
+    def __init__(self, status_code, headers, content):
+        self.status_code = status_code
+        self.headers = headers
+        self.content = content
+
+    def json(self):
+        return json.loads(self.content)
+
+
+# Delivers messages to peer nodes with non-blocking I/O on an event loop
+'''
+    Same interface and delivery rules as Broadcaster: every peer has an outbox delivered in order,
+    failed deliveries are retried with exponential backoff and binary payloads go to peers
+    advertising the codec. All peers share one connection pool on the event loop instead of a
+    thread per request.
+    broadcast can be called from any thread. fetch, fetch_all and fetch_blocks block the calling
+    thread until the answers arrive, so they must be called from executor threads and never from
+    the event loop.
+'''
+
+
+class AsyncBroadcaster:
+    def __init__(self):
+        self.__loop = None
+        self.__session = None
+        # Peers known to accept binary codec payloads
+        self.__binary_peers = set()
+        # Pending deliveries by peer, only touched on the event loop so no lock is needed
+        self.__outboxes = {}
+        self.__draining = set()
+
+    # Binds to the running event loop, called when the node starts
+    async def start(self):
+        self.__loop = asyncio.get_running_loop()
+        self.__session = aiohttp.ClientSession(
+            timeout=aiohttp.ClientTimeout(total=BROADCAST_TIMEOUT),
+            connector=aiohttp.TCPConnector(limit=ASYNC_PEER_CONNECTIONS))
+
+    async def close(self):
+        if self.__session is not None:
+            await self.__session.close()
+            self.__session = None
+
+    def __learn_formats(self, node, headers):
+        if codec.MIMETYPE in headers.get('Accept-Post', ''):
+            self.__binary_peers.add(node)
+
+    # Posts payload to path on every node without waiting for answers
+    '''
+        on_response: called on the event loop with node and PeerResponse once a node answers
+        binary_payload: same message in the binary codec format, sent to peers supporting it
+    '''
+
+    def broadcast(self, nodes, path, payload, on_response=None, binary_payload=None):
+        for node in nodes:
+            self.__loop.call_soon_threadsafe(self.__enqueue, (node, path, payload, binary_payload, on_response, 0))
+
+    def __enqueue(self, delivery):
+        node = delivery[0]
+        self.__outboxes.setdefault(node, deque()).append(delivery)
+        if node not in self.__draining:
+            self.__draining.add(node)
+            self.__loop.create_task(self.__drain(node))
+
+    async def __drain(self, node):
+        outbox = self.__outboxes[node]
+        while outbox:
+            await self.__deliver(outbox.popleft())
+        self.__draining.discard(node)
+        del self.__outboxes[node]
+
+    async def __deliver(self, delivery):
+        node, path, payload, binary_payload, on_response, attempt = delivery
+        url = 'http://{}{}'.format(node, path)
+        started = time()
+        try:
+            if binary_payload is not None and node in self.__binary_peers:
+                body = binary_payload
+                content_type = codec.MIMETYPE
+            else:
+                body = json.dumps(payload).encode()
+                content_type = 'application/json'
+            async with self.__session.post(url, data=body, headers={'Content-Type': content_type}) as response:
+                content = await response.read()
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            metrics.BROADCAST_FAILURES.inc(peer=node, path=path)
+            self.__schedule_retry(delivery)
+            return
+        metrics.BROADCAST_SECONDS.observe(time() - started, peer=node, path=path)
+        metrics.BROADCAST_BYTES.inc(len(body), peer=node, path=path)
+        self.__learn_formats(node, response.headers)
+        if response.status >= 500:
+            metrics.BROADCAST_FAILURES.inc(peer=node, path=path)
+            self.__schedule_retry(delivery)
+            return
+        if on_response is not None:
+            on_response(node, PeerResponse(response.status, response.headers, content))
+
+    def __schedule_retry(self, delivery):
+        node, path, payload, binary_payload, on_response, attempt = delivery
+        if attempt >= BROADCAST_RETRIES:
+            print('Failed to deliver {} to {}'.format(path, node))
+            return
+        self.__loop.call_later(BROADCAST_BACKOFF * 2 ** attempt, self.__enqueue,
+                               (node, path, payload, binary_payload, on_response, attempt + 1))
+
+    # Gets path from every node concurrently, returns decoded json answers by node
+    def fetch_all(self, nodes, path):
+        return asyncio.run_coroutine_threadsafe(self.fetch_all_async(nodes, path), self.__loop).result()
+
+    async def fetch_all_async(self, nodes, path):
+        nodes = list(nodes)
+        answers = await asyncio.gather(*[self.fetch_async(node, path) for node in nodes])
+        return {node: answer for node, answer in zip(nodes, answers) if answer is not None}
+
+    # Gets path from node, decode_binary is used when the node answers in the binary codec format
+    def fetch(self, node, path, decode_binary=None):
+        return asyncio.run_coroutine_threadsafe(self.fetch_async(node, path, decode_binary), self.__loop).result()
+
+    async def fetch_async(self, node, path, decode_binary=None):
+        url = 'http://{}{}'.format(node, path)
+        headers = {}
+        if decode_binary is not None:
+            headers['Accept'] = '{}, application/json;q=0.5'.format(codec.MIMETYPE)
+        try:
+            async with self.__session.get(url, headers=headers) as response:
+                content = await response.read()
+                self.__learn_formats(node, response.headers)
+                if decode_binary is not None and response.content_type == codec.MIMETYPE:
+                    return decode_binary(content)
+                return json.loads(content)
+        except (aiohttp.ClientError, asyncio.TimeoutError, ValueError):
+            return None
+
+    # Gets blocks from path on node, yields them one at a time as the answer arrives
+    '''
+        Same formats as Broadcaster.fetch_blocks. The answer is read on the event loop and handed to
+        the calling thread through a bounded queue, which stops reading while the caller is busy
+        verifying. Closing the generator early cancels the download.
+    '''
+
+    def fetch_blocks(self, node, path):
+        chunks = asyncio.Queue(STREAM_QUEUE_SIZE)
+        reader = asyncio.run_coroutine_threadsafe(self.__read_stream(node, path, chunks), self.__loop)
+
+        def next_chunk():
+            return asyncio.run_coroutine_threadsafe(chunks.get(), self.__loop).result()
+
+        try:
+            content_type = next_chunk()
+            if content_type is None:
+                return
+            chunks_left = iter(next_chunk, None)
+            yield from chain_stream.decode_blocks(content_type, chunks_left)
+            # Read to the end of the answer so the connection is kept for reuse
+            for _ in chunks_left:
+                pass
+        except ValueError:
+            print('Failed to fetch {} from {}'.format(path, node))
+        finally:
+            reader.cancel()
+
+    # Puts the content type and then the body chunks of the answer into chunks, None at the end
+    async def __read_stream(self, node, path, chunks):
+        url = 'http://{}{}'.format(node, path)
+        headers = {'Accept': '{}, {};q=0.8, application/json;q=0.5'.format(
+            codec.MIMETYPE, chain_stream.NDJSON_MIMETYPE)}
+        # A whole chain can take longer than BROADCAST_TIMEOUT, only a stalled peer times out
+        timeout = aiohttp.ClientTimeout(sock_connect=BROADCAST_TIMEOUT, sock_read=BROADCAST_TIMEOUT)
+        try:
+            async with self.__session.get(url, headers=headers, timeout=timeout) as response:
+                self.__learn_formats(node, response.headers)
+                if response.status < 400:
+                    await chunks.put(response.headers.get('Content-Type', ''))
+                    async for chunk in response.content.iter_chunked(STREAM_CHUNK_SIZE):
+                        await chunks.put(chunk)
+        except (aiohttp.ClientError, asyncio.TimeoutError):
+            print('Failed to fetch {} from {}'.format(path, node))
+        await chunks.put(None)
@@ -0,0 +1,667 @@
+import itertools
+import os
+
+from aiohttp import web
+
+import chain_stream
+import codec
+import metrics
+import transaction_batch
+from async_blockchain import AsyncBlockchain
+from async_broadcaster import AsyncBroadcaster
+from blockchain import Blockchain
+from mining_scheduler import MiningScheduler
+from wallet import Wallet
+from blockchain_settings import SYNC_HEADERS_PAGE, SYNC_BLOCKS_PAGE, HISTORY_PAGE
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+routes = web.RouteTableDef()
+
+# Keys of the node state kept on the application
+PORT = web.AppKey('port', int)
+WALLET = web.AppKey('wallet', Wallet)
+BLOCKCHAIN = web.AppKey('blockchain', AsyncBlockchain)
+MINING_SCHEDULER = web.AppKey('mining_scheduler', MiningScheduler)
+
+
+# Node on asyncio serving the same routes as node.py
+'''
+    Peers are reached through AsyncBroadcaster, blocking Blockchain calls, signing and encoding
+    run on the AsyncBlockchain executor and mining runs on the MiningScheduler thread, so the
+    event loop only parses requests and writes answers.
+'''
+
+
+# Profile sampled requests
+@web.middleware
+async def node_middleware(request, handler):
+    profile = metrics.PROFILER.start()
+    try:
+        return await handler(request)
+    finally:
+        if profile is not None:
+            metrics.PROFILER.stop(profile)
+
+
+# Answers CORS preflight requests as flask_cors does for node.py, the origin header is added by add_headers
+'''
+    A preflight is an OPTIONS request with Access-Control-Request-Method. No route handles OPTIONS,
+    so for existing paths the router reports the methods the path allows.
+'''
+
+
+@web.middleware
+async def cors_middleware(request, handler):
+    if request.method == 'OPTIONS' and 'Access-Control-Request-Method' in request.headers:
+        error = request.match_info.http_exception
+        if isinstance(error, web.HTTPMethodNotAllowed):
+            headers = {'Access-Control-Allow-Methods': ', '.join(sorted(set(error.allowed_methods) | {'OPTIONS'}))}
+            if 'Access-Control-Request-Headers' in request.headers:
+                headers['Access-Control-Allow-Headers'] = request.headers['Access-Control-Request-Headers']
+            return web.Response(headers=headers)
+    return await handler(request)
+
+
+# Advertise binary payloads and allow browser clients from any origin, also on streamed answers
+async def add_headers(request, response):
+    response.headers['Accept-Post'] = 'application/json, {}'.format(codec.MIMETYPE)
+    response.headers['Access-Control-Allow-Origin'] = '*'
+
+
+def json_response(data, status=200):
+    return web.json_response(data, status=status)
+
+
+# Decodes request body sent as json or in the binary codec format
+async def get_request_values(request, decode_binary=None):
+    if request.content_type == codec.MIMETYPE and decode_binary is not None:
+        try:
+            return decode_binary(await request.read())
+        except (codec.CodecError, UnicodeDecodeError):
+            return None
+    try:
+        return await request.json()
+    except ValueError:
+        return None
+
+
+# Mimetype the client accepts with the highest quality, ties go to the first one listed
+def best_match(request, mimetypes):
+    qualities = {}
+    for accepted in request.headers.get('Accept', '').split(','):
+        mimetype, _, parameters = accepted.strip().partition(';')
+        quality = 1.0
+        for parameter in parameters.split(';'):
+            name, _, value = parameter.strip().partition('=')
+            if name == 'q':
+                try:
+                    quality = float(value)
+                except ValueError:
+                    quality = 0.0
+        qualities[mimetype.strip()] = quality
+
+    def quality_of(mimetype):
+        for candidate in (mimetype, mimetype.split('/')[0] + '/*', '*/*'):
+            if candidate in qualities:
+                return qualities[candidate]
+        return 0.0
+
+    return max(mimetypes, key=quality_of)
+
+
+# True if the client prefers the binary codec format over json, ties go to json
+def wants_binary(request):
+    return best_match(request, ['application/json', codec.MIMETYPE]) == codec.MIMETYPE
+
+
+# Get web app UI
+
+@routes.get('/')
+async def get_node_ui(request):
+    return web.FileResponse(os.path.join(ROOT, 'frontend', 'node.html'))
+
+
+@routes.get('/network')
+async def get_network_ui(request):
+    return web.FileResponse(os.path.join(ROOT, 'frontend', 'network.html'))
+
+
+# Create wallet
+@routes.post('/wallet')
+async def create_keys(request):
+    wallet = request.app[WALLET]
+    blockchain = request.app[BLOCKCHAIN]
+    await blockchain.run(wallet.create_keys)
+    if await blockchain.run(wallet.save_keys):
+        blockchain.wallet = wallet.public_key
+        response = {
+            'public_key': wallet.public_key,
+            'private_key': wallet.private_key,
+            'funds': blockchain.get_balance()
+        }
+        return json_response(response, 201)
+    else:
+        response = {'message': 'Saving the keys error'}
+        return json_response(response, 500)
+
+
+# Load wallet
+@routes.get('/wallet')
+async def load_keys(request):
+    wallet = request.app[WALLET]
+    blockchain = request.app[BLOCKCHAIN]
+    if await blockchain.run(wallet.load_keys):
+        blockchain.wallet = wallet.public_key
+        response = {
+            'public_key': wallet.public_key,
+            'private_key': wallet.private_key,
+            'funds': blockchain.get_balance()
+        }
+        return json_response(response, 201)
+    else:
+        response = {'message': 'Load the keys error'}
+        return json_response(response, 500)
+
+
+# Get wallet balance
+@routes.get('/balance')
+async def get_balance(request):
+    balance = request.app[BLOCKCHAIN].get_balance()
+    if balance != None:
+        response = {
+            'funds': balance
+        }
+        return json_response(response, 200)
+    else:
+        response = {
+            'message': 'Error trying get balance',
+            'wallet': request.app[WALLET].public_key != None
+        }
+        return json_response(response, 500)
+
+
+# Broadcast transaction
+@routes.post('/broadcast-transaction')
+async def broadcast_transaction(request):
+    values = await get_request_values(request, codec.decode_transaction)
+    if not values:
+        response = {'message': 'No data found.'}
+        metrics.REJECTED_TRANSACTIONS.inc(reason='no_data')
+        return json_response(response, 400)
+    required_fields = ['sender', 'recipient', 'amount', 'signature']
+    if not all(field in values for field in required_fields):
+        response = {'message': 'Required data is missing'}
+        metrics.REJECTED_TRANSACTIONS.inc(reason='missing_fields')
+        return json_response(response, 400)
+    success = await request.app[BLOCKCHAIN].add_new_transaction(values['sender'], values['recipient'],
+                                                                  values['signature'], values['amount'], True)
+    if success:
+        response = {
+            'message': 'Trunsaction successfully add',
+            'transaction': {
+                'sender': values['sender'],
+                'recipient': values['recipient'],
+                'amount': values['amount'],
+                'signature': values['signature']
+            }
+        }
+        return json_response(response, 201)
+    else:
+        response = {'message': 'Failed add transaction'}
+        metrics.REJECTED_TRANSACTIONS.inc(reason='invalid')
+        return json_response(response, 400)
+
+
+# Inventory announced by a peer, answers with the ids this node wants to be sent
+@routes.post('/inv')
+async def receive_inventory(request):
+    values = await get_request_values(request)
+    if not isinstance(values, dict):
+        response = {'message': 'No data found.'}
+        return json_response(response, 400)
+    try:
+        wanted = request.app[BLOCKCHAIN].get_wanted(values.get('transactions', []), values.get('blocks', []))
+    except (KeyError, TypeError):
+        response = {'message': 'Invalid inventory'}
+        return json_response(response, 400)
+    return json_response(wanted, 200)
+
+
+# Broadcast block
+@routes.post('/broadcast-block')
+async def broadcast_block(request):
+    values = await get_request_values(request, lambda data: {'block': codec.decode_block(data)})
+    if not values:
+        response = {'Message': 'No data found'}
+        return json_response(response, 400)
+    if 'block' not in values:
+        response = {'Message': 'No Block in values'}
+        return json_response(response, 400)
+    blockchain = request.app[BLOCKCHAIN]
+    block = values['block']
+    if not isinstance(block, dict) or not isinstance(block.get('index'), int):
+        response = {'message': 'Block seems invalid.'}
+        return json_response(response, 400)
+    tip_height = blockchain.get_tip()['height']
+    if block['index'] == tip_height + 1:
+        if await blockchain.add_block(block):
+            response = {'message': 'Block added'}
+            return json_response(response, 201)
+        else:
+            response = {'message': 'Block seems invalid.'}
+            return json_response(response, 409)
+    elif block['index'] > tip_height + 1:
+        response = {'message': 'Block seems to differ from local blockchain.'}
+        blockchain.resolve_conflicts = True
+        return json_response(response, 200)
+    else:
+        response = {'message': 'Blockchain seems to be shorter, block not added'}
+        return json_response(response, 409)
+
+
+# Add transaction
+@routes.post('/transaction')
+async def add_transaction(request):
+    wallet = request.app[WALLET]
+    blockchain = request.app[BLOCKCHAIN]
+    if wallet.public_key is None:
+        response = {'message': 'You have no wallet'}
+        return json_response(response, 400)
+    values = await get_request_values(request)
+    if not values:
+        response = {'message': 'No data found.'}
+        return json_response(response, 400)
+    required_fields = ['recipient', 'amount']
+    if not all(field in values for field in required_fields):
+        response = {'message': 'Required data is missing'}
+        return json_response(response, 400)
+    recipient = values['recipient']
+    amount = values['amount']
+    signature = await blockchain.run(wallet.sign_transaction, wallet.public_key, recipient, amount)
+    success = await blockchain.add_new_transaction(wallet.public_key, recipient, signature, amount)
+    if success:
+        response = {
+            'message': 'Trunsaction successfully add',
+            'transaction': {
+                'sender': wallet.public_key,
+                'recipient': recipient,
+                'amount': amount,
+                'signature': signature
+            },
+            'funds': blockchain.get_balance()
+        }
+        return json_response(response, 201)
+    else:
+        response = {'message': 'Failed add transaction'}
+        return json_response(response, 400)
+
+
+# Add many transactions from this wallet: [{'recipient': ..., 'amount': ...}, ...]
+@routes.post('/transactions/batch')
+async def add_transactions(request):
+    wallet = request.app[WALLET]
+    blockchain = request.app[BLOCKCHAIN]
+    if wallet.public_key is None:
+        response = {'message': 'You have no wallet'}
+        return json_response(response, 400)
+    values = await get_request_values(request)
+    error = transaction_batch.check_batch(values)
+    if error is not None:
+        return json_response(*error)
+    transactions = await blockchain.run(transaction_batch.sign_batch, wallet, values)
+    results = await blockchain.run(transaction_batch.add_batch, blockchain.blockchain, values, transactions, False)
+    response, status = transaction_batch.batch_response(results)
+    response['funds'] = blockchain.get_balance()
+    return json_response(response, status)
+
+
+# Broadcast many transactions, sent by peers as one message
+@routes.post('/broadcast-transactions')
+async def broadcast_transactions(request):
+    values = await get_request_values(request, codec.decode_transactions)
+    error = transaction_batch.check_batch(values)
+    if error is not None:
+        return json_response(*error)
+    blockchain = request.app[BLOCKCHAIN]
+    results = await blockchain.run(transaction_batch.add_batch, blockchain.blockchain, values,
+                                   transaction_batch.get_relayed(values), True)
+    response, status = transaction_batch.batch_response(results)
+    return json_response(response, status)
+
+
+# Resolve miner conflicts
+@routes.post('/resolve-conflicts')
+async def resolve_conflicts(request):
+    replaced = await request.app[BLOCKCHAIN].resolve()
+    if replaced:
+        response = {'message': 'Chain was replaced'}
+    else:
+        response = {'message': 'Local chain saved'}
+    return json_response(response, 200)
+
+
+# Fresh node only: starts the chain at a balance snapshot served by a quorum of peers, then syncs the
+# blocks after it, without a quorum the full chain is synced
+@routes.post('/bootstrap')
+async def bootstrap(request):
+    blockchain = request.app[BLOCKCHAIN]
+    if not await blockchain.bootstrap():
+        response = {'message': 'Bootstrap failed'}
+        return json_response(response, 409)
+    response = {
+        'message': 'Bootstrapped from peers',
+        'tip': blockchain.get_tip()
+    }
+    return json_response(response, 200)
+
+
+# Mine for reward, mining runs in the background and the job can be polled
+@routes.post('/mine')
+async def mine(request):
+    if request.app[WALLET].public_key is None:
+        response = {'message': 'Adding a block failed', 'wallet': False}
+        return json_response(response, 400)
+    if request.app[BLOCKCHAIN].resolve_conflicts:
+        response = {'message': 'Resolve conflicts first, block not added'}
+        return json_response(response, 409)
+    values = await get_request_values(request) or {}
+    job = request.app[MINING_SCHEDULER].submit(bool(values.get('continuous', False)))
+    response = {
+        'message': 'Mining started',
+        'job': job
+    }
+    return json_response(response, 202)
+
+
+@routes.get('/mine/status')
+async def get_mining_status(request):
+    return json_response(request.app[MINING_SCHEDULER].status(), 200)
+
+
+@routes.get('/mine/{job_id}')
+async def get_mining_job(request):
+    job = request.app[MINING_SCHEDULER].get_job(request.match_info['job_id'])
+    if job is None:
+        response = {'message': 'No mining job found'}
+        return json_response(response, 404)
+    response = {
+        'job': job,
+        'funds': request.app[BLOCKCHAIN].get_balance()
+    }
+    if job['status'] == 'done':
+        response['message'] = 'Block added successfully'
+        response['block'] = job['blocks'][-1]
+    elif job['status'] == 'failed':
+        response['message'] = job['error']
+    return json_response(response, 200)
+
+
+@routes.delete('/mine/{job_id}')
+async def cancel_mining_job(request):
+    if not request.app[MINING_SCHEDULER].cancel(request.match_info['job_id']):
+        response = {'message': 'No running mining job found'}
+        return json_response(response, 404)
+    response = {'message': 'Mining cancelled'}
+    return json_response(response, 200)
+
+
+@routes.get('/transactions')
+async def get_transactions(request):
+    transactions = request.app[BLOCKCHAIN].get_open_transactions()
+    return json_response([tx.to_ordered_dict() for tx in transactions])
+
+
+# Blocks start..end-1, the whole chain by default, streamed one page of blocks at a time
+'''
+    Sent as a json array, as ndjson or in the binary codec format, whichever the client prefers.
+    Blocks are read and encoded on the executor, a page is only read once the previous one is sent.
+'''
+
+
+@routes.get('/chain')
+async def get_chain(request):
+    blockchain = request.app[BLOCKCHAIN]
+    start, _ = get_range(request, 0)
+    try:
+        end = int(request.query['end'])
+    except (KeyError, ValueError):
+        end = None
+    mimetype = best_match(request, chain_stream.MIMETYPES)
+    chunks = blockchain.stream_chain(mimetype, start, end)
+    response = web.StreamResponse(headers={'Content-Type': mimetype})
+    await response.prepare(request)
+    try:
+        while True:
+            data = await blockchain.run(lambda: b''.join(itertools.islice(chunks, SYNC_BLOCKS_PAGE)))
+            if not data:
+                break
+            await response.write(data)
+        await response.write_eof()
+    except ConnectionResetError:
+        # Client stopped reading, e.g. a peer that found the chain invalid
+        pass
+    return response
+
+
+@routes.get('/chain/tip')
+async def get_chain_tip(request):
+    return json_response(request.app[BLOCKCHAIN].get_tip(), 200)
+
+
+# Balance snapshots on the current chain: height, block hash and digest, newest first
+@routes.get('/snapshots')
+async def get_snapshots(request):
+    return json_response(await request.app[BLOCKCHAIN].get_snapshots(), 200)
+
+
+# Balances at a snapshot height with the block it was taken at, the newest snapshot without height
+@routes.get('/snapshot')
+@routes.get(r'/snapshot/{height:\d+}')
+async def get_snapshot(request):
+    height = request.match_info.get('height')
+    snapshot = await request.app[BLOCKCHAIN].get_snapshot(None if height is None else int(height))
+    if snapshot is None:
+        response = {'message': 'No snapshot found'}
+        return json_response(response, 404)
+    return json_response(snapshot, 200)
+
+
+def get_range(request, page):
+    try:
+        start = max(0, int(request.query.get('start', 0)))
+    except ValueError:
+        start = 0
+    try:
+        end = int(request.query.get('end', start + page))
+    except ValueError:
+        end = start + page
+    return start, end
+
+
+# Headers of blocks start..end-1, pages are capped at SYNC_HEADERS_PAGE
+@routes.get('/chain/headers')
+async def get_chain_headers(request):
+    start, end = get_range(request, SYNC_HEADERS_PAGE)
+    return json_response(await request.app[BLOCKCHAIN].get_headers(start, end), 200)
+
+
+# Blocks start..end-1, pages are capped at SYNC_BLOCKS_PAGE
+@routes.get('/chain/blocks')
+async def get_chain_blocks(request):
+    blockchain = request.app[BLOCKCHAIN]
+    start, end = get_range(request, SYNC_BLOCKS_PAGE)
+    blocks = await blockchain.get_blocks(start, end)
+    if wants_binary(request):
+        return web.Response(body=await blockchain.run(codec.encode_blocks, blocks), content_type=codec.MIMETYPE)
+    return json_response(blocks, 200)
+
+
+# Confirmed transactions of an address start..end-1 in chain order, pages are capped at HISTORY_PAGE
+@routes.get('/address/{address}/transactions')
+async def get_address_transactions(request):
+    start, end = get_range(request, HISTORY_PAGE)
+    history = await request.app[BLOCKCHAIN].get_address_history(request.match_info['address'], start, end)
+    return json_response(history, 200)
+
+
+@routes.get('/transaction/{tx_id}')
+async def get_transaction(request):
+    transaction = await request.app[BLOCKCHAIN].get_transaction(request.match_info['tx_id'])
+    if transaction is None:
+        response = {'message': 'No confirmed transaction found'}
+        return json_response(response, 404)
+    return json_response(transaction, 200)
+
+
+# Merkle inclusion proof of a confirmed transaction, checked by light clients against /chain/headers
+@routes.get('/transaction/{tx_id}/proof')
+async def get_transaction_proof(request):
+    try:
+        height = int(request.query['height']) if 'height' in request.query else None
+    except ValueError:
+        height = None
+    proof = await request.app[BLOCKCHAIN].get_merkle_proof(request.match_info['tx_id'], height)
+    if proof is None:
+        response = {'message': 'No Merkle proof found'}
+        return json_response(response, 404)
+    return json_response(proof, 200)
+
+
+@routes.get('/block/{block_hash}')
+async def get_block(request):
+    blockchain = request.app[BLOCKCHAIN]
+    block = await blockchain.get_block(request.match_info['block_hash'])
+    if block is None:
+        response = {'message': 'No block found'}
+        return json_response(response, 404)
+    if wants_binary(request):
+        return web.Response(body=codec.encode_block(block), content_type=codec.MIMETYPE)
+    return json_response(block, 200)
+
+
+# Metrics in the Prometheus text format
+@routes.get('/metrics')
+async def get_metrics(request):
+    blockchain = request.app[BLOCKCHAIN]
+    metrics.MEMPOOL_SIZE.set(blockchain.get_open_transaction_count())
+    metrics.CHAIN_HEIGHT.set(blockchain.get_tip()['height'])
+    response = web.Response(text=metrics.render(), content_type='text/plain')
+    response.headers['Content-Type'] = 'text/plain; version=0.0.4'
+    return response
+
+
+# Aggregated profile of sampled requests
+@routes.get('/metrics/profile')
+async def get_profile(request):
+    try:
+        limit = int(request.query.get('limit', 30))
+    except ValueError:
+        limit = 30
+    sort = request.query.get('sort', 'cumulative')
+    return web.Response(text=metrics.PROFILER.report(limit, sort), content_type='text/plain')
+
+
+# Toggle profiler: enabled, sample_rate between 0 and 1, reset to drop collected samples
+@routes.post('/metrics/profile')
+async def configure_profile(request):
+    values = await get_request_values(request)
+    if not values or 'enabled' not in values:
+        response = {'message': 'Required data is missing'}
+        return json_response(response, 400)
+    try:
+        metrics.PROFILER.configure(bool(values['enabled']), values.get('sample_rate'))
+    except ValueError as e:
+        response = {'message': str(e)}
+        return json_response(response, 400)
+    if values.get('reset'):
+        metrics.PROFILER.reset()
+    response = {
+        'enabled': metrics.PROFILER.enabled,
+        'sample_rate': metrics.PROFILER.sample_rate
+    }
+    return json_response(response, 200)
+
+
+@routes.post('/node')
+async def add_node(request):
+    blockchain = request.app[BLOCKCHAIN]
+    values = await get_request_values(request)
+    if not values:
+        response = {
+            'message': 'No data attached'
+        }
+        return json_response(response, 400)
+    if 'node' not in values:
+        response = {
+            'message': 'No node found'
+        }
+        return json_response(response, 400)
+    await blockchain.add_node(values['node'])
+    response = {
+        'message': 'Node add successfully',
+        'nodes': blockchain.get_nodes()
+    }
+    return json_response(response, 201)
+
+
+@routes.delete('/node/{node_url}')
+async def remove_node(request):
+    blockchain = request.app[BLOCKCHAIN]
+    node_url = request.match_info['node_url']
+    if node_url == '' or node_url == None:
+        response = {
+            'message': 'No node found'
+        }
+        return json_response(response, 400)
+    await blockchain.remove_node(node_url)
+    response = {
+        'message': 'Node removed',
+        'nodes': blockchain.get_nodes()
+    }
+    return json_response(response, 200)
+
+
+@routes.get('/nodes')
+async def get_nodes(request):
+    response = {
+        'nodes': request.app[BLOCKCHAIN].get_nodes()
+    }
+    return json_response(response, 200)
+
+
+# Builds the node application, wallet keys are loaded or created through /wallet as with node.py
+def create_app(port):
+    wallet = Wallet(port)
+    broadcaster = AsyncBroadcaster()
+    blockchain = AsyncBlockchain(Blockchain(wallet.public_key, port, broadcaster))
+    app = web.Application(middlewares=[cors_middleware, node_middleware])
+    app[PORT] = port
+    app[WALLET] = wallet
+    app[BLOCKCHAIN] = blockchain
+    app[MINING_SCHEDULER] = MiningScheduler(lambda: blockchain.blockchain)
+    app.add_routes(routes)
+
+    async def start_broadcaster(app):
+        await broadcaster.start()
+
+    async def close_broadcaster(app):
+        await broadcaster.close()
+
+    # Mempool and nodes are saved in the background, save what changed since
+    async def save_data(app):
+        await app[BLOCKCHAIN].save_data()
+
+    app.on_response_prepare.append(add_headers)
+    app.on_startup.append(start_broadcaster)
+    app.on_cleanup.append(close_broadcaster)
+    app.on_cleanup.append(save_data)
+    return app
+
+
+if __name__ == '__main__':
+    from argparse import ArgumentParser
+    parser = ArgumentParser()
+    parser.add_argument('-p', '--port', type=int, default=5000)
+    args = parser.parse_args()
+    web.run_app(create_app(args.port), host='0.0.0.0', port=args.port)
@@ -0,0 +1,44 @@
+import hashlib
+import json
+
+from blockchain_settings import SNAPSHOT_PRECISION
+
+
+# Confirmed balance of every address after the block at a height
+'''
+    Balances are rounded to SNAPSHOT_PRECISION decimals and zero balances are left out, so nodes
+    that reached the same block through different forks produce the same digest even though their
+    float sums differ in the last bits. Peers compare digests before a node trusts a snapshot.
+'''
+
+
+class BalanceSnapshot:
+    def __init__(self, height, block_hash, balances):
+        self.height = height
+        self.hash = block_hash
+        self.balances = {address: round(balance, SNAPSHOT_PRECISION) for address, balance in balances.items()
+                         if round(balance, SNAPSHOT_PRECISION) != 0}
+
+    @staticmethod
+    def from_dict(snapshot):
+        return BalanceSnapshot(snapshot['height'], snapshot['hash'], snapshot['balances'])
+
+    def to_dict(self):
+        return {
+            'height': self.height,
+            'hash': self.hash,
+            'balances': self.balances
+        }
+
+    def digest(self):
+        return hashlib.sha256(json.dumps(self.to_dict(), sort_keys=True).encode()).hexdigest()
+
+    def summary(self):
+        return {'height': self.height, 'hash': self.hash, 'digest': self.digest()}
+
+    # Coins are only moved or created by rewards, so balances sum to zero and only REWARD is negative
+    def is_consistent(self):
+        tolerance = 10 ** -SNAPSHOT_PRECISION * max(1, len(self.balances))
+        if abs(sum(self.balances.values())) > tolerance:
+            return False
+        return all(balance >= -tolerance for address, balance in self.balances.items() if address != 'REWARD')
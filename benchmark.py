@@ -0,0 +1,506 @@
+import contextlib
+import importlib.util
+import itertools
+import json
+import os
+import random
+import socket
+import sys
+import tempfile
+import threading
+from concurrent.futures import ThreadPoolExecutor
+from time import perf_counter, sleep
+
+from requests import Session
+from werkzeug.serving import make_server
+
+import difficulty
+import metrics
+import wallet as wallet_module
+from block import Block
+from blockchain import Blockchain
+from miner import Miner
+from verification import Verification
+from wallet import Wallet
+
+ROOT = os.path.dirname(os.path.abspath(__file__))
+
+# Seconds to wait for a block to reach every node
+PROPAGATION_TIMEOUT = 30
+
+# Random peers of every node in the gossip simulation, on top of its ring neighbour
+GOSSIP_PEERS = 2
+
+
+def summarize(durations):
+    return {
+        'runs': len(durations),
+        'mean': sum(durations) / len(durations),
+        'min': min(durations),
+        'max': max(durations),
+        'total': sum(durations)
+    }
+
+
+# Runs fn repeat times and summarizes durations in seconds
+def measure(fn, repeat=1):
+    durations = []
+    for _ in range(repeat):
+        started = perf_counter()
+        fn()
+        durations.append(perf_counter() - started)
+    return summarize(durations)
+
+
+def clear_signature_caches():
+    wallet_module._verified_signatures.clear()
+    wallet_module._get_verifier.cache_clear()
+
+
+def create_wallets(count, first_id):
+    wallets = []
+    for node_id in range(first_id, first_id + count):
+        wallet = Wallet(node_id)
+        wallet.create_keys()
+        wallets.append(wallet)
+    return wallets
+
+
+# Mines a chain of given height with signed transactions between real wallets
+def build_chain(blockchain, miner_wallet, wallets, height, transactions_per_block, rng):
+    participants = [miner_wallet] + wallets
+    while len(blockchain.chain) < height:
+        for _ in range(transactions_per_block):
+            sender = rng.choice(participants)
+            recipient = rng.choice(participants)
+            amount = round(rng.uniform(0.001, 0.01), 6)
+            if blockchain.get_balance(sender.public_key) < amount or sender is recipient:
+                sender = miner_wallet
+            signature = sender.sign_transaction(sender.public_key, recipient.public_key, amount)
+            blockchain.add_new_transaction(sender.public_key, recipient.public_key, signature, amount)
+        blockchain.mine_block()
+
+
+# Loads a separate copy of node.py so several nodes can run in one process
+def load_node(port):
+    spec = importlib.util.spec_from_file_location('node_{}'.format(port), os.path.join(ROOT, 'node.py'))
+    node = importlib.util.module_from_spec(spec)
+    spec.loader.exec_module(node)
+    node.port = port
+    node.wallet = Wallet(port)
+    node.blockchain = Blockchain(None, port)
+    return node
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+# Serves a node on localhost from a background thread
+def start_node():
+    port = free_port()
+    node = load_node(port)
+    server = make_server('127.0.0.1', port, node.app, threaded=True)
+    threading.Thread(target=server.serve_forever, daemon=True).start()
+    node.app.test_client().post('/wallet')
+    return node, server
+
+
+# Serves an async node on localhost from an event loop on a background thread
+def start_async_node():
+    import asyncio
+    from aiohttp import web
+    import async_node
+    port = free_port()
+    loop = asyncio.new_event_loop()
+    app = async_node.create_app(port)
+    runner = web.AppRunner(app)
+    loop.run_until_complete(runner.setup())
+    loop.run_until_complete(web.TCPSite(runner, '127.0.0.1', port).start())
+    threading.Thread(target=loop.run_forever, daemon=True).start()
+    return app, port, loop, runner
+
+
+def stop_async_node(loop, runner):
+    import asyncio
+    asyncio.run_coroutine_threadsafe(runner.cleanup(), loop).result()
+    loop.call_soon_threadsafe(loop.stop)
+
+
+# Sends GET requests for paths from concurrent clients, returns requests per second
+def load_test(port, paths, total, clients):
+    local = threading.local()
+
+    def get(path):
+        session = getattr(local, 'session', None)
+        if session is None:
+            session = local.session = Session()
+        session.get('http://127.0.0.1:{}{}'.format(port, path)).raise_for_status()
+
+    with ThreadPoolExecutor(max_workers=clients) as executor:
+        started = perf_counter()
+        list(executor.map(get, [paths[number % len(paths)] for number in range(total)]))
+        return total / (perf_counter() - started)
+
+
+# Wallet creation from the key pool and signing one by one against a payout batch
+def bench_wallet(args, wallets):
+    results = {}
+    wallet = wallets[0]
+    recipients = [other.public_key for other in wallets]
+    payouts = [(wallet.public_key, recipients[number % len(recipients)], round(0.000001 * (number + 1), 6))
+               for number in range(args.transactions * args.repeat * 10)]
+    results['create_keys'] = measure(lambda: Wallet('benchmark-wallet').create_keys(), args.repeat)
+    results['sign_transaction'] = measure(lambda: [wallet.sign_transaction(*payout) for payout in payouts])
+    results['sign_transactions'] = measure(lambda: wallet.sign_transactions(payouts))
+    results['payouts'] = len(payouts)
+    return results
+
+
+def bench_mining(args):
+    results = {}
+    prefix = Verification.proof_prefix([], 'benchmark')
+    for workers in sorted({1, args.workers}):
+        miner = Miner(workers)
+        hash_rates = []
+
+        def mine():
+            miner.mine(prefix + str(random.random()))
+            hash_rates.append(miner.hash_rate)
+
+        result = measure(mine, args.repeat)
+        result['hash_rate'] = sum(hash_rates) / len(hash_rates)
+        results['workers_{}'.format(workers)] = result
+        miner.close()
+    return results
+
+
+def bench_chain(args, blockchain, wallets):
+    chain = list(blockchain.chain)
+    results = {}
+
+    def verify_cold():
+        clear_signature_caches()
+        Verification.verify_chain(chain, blockchain.get_hash)
+
+    results['verify_chain_cold'] = measure(verify_cold, args.repeat)
+    results['verify_chain_cached'] = measure(lambda: Verification.verify_chain(chain, blockchain.get_hash),
+                                             args.repeat)
+    addresses = [wallet.public_key for wallet in wallets]
+    results['get_balance'] = measure(lambda: [blockchain.get_balance(address) for address in addresses],
+                                     args.repeat)
+    results['get_balance']['lookups_per_run'] = len(addresses)
+    results['save_data'] = measure(blockchain.save_data, args.repeat)
+    results['load_data'] = measure(lambda: Blockchain(blockchain.wallet, blockchain.node_id), args.repeat)
+
+    # Feed the same blocks to a fresh node one at a time
+    receiver = Blockchain(None, 'receiver')
+    dict_blocks = [block.to_dict() for block in chain[1:]]
+    clear_signature_caches()
+    results['add_block'] = measure(lambda: receiver.add_block(dict_blocks[len(receiver.chain) - 1]),
+                                   len(dict_blocks))
+    return results
+
+
+def bench_endpoints(args, wallets):
+    node = load_node('endpoints')
+    client = node.app.test_client()
+    client.post('/wallet')
+    build_chain(node.blockchain, node.wallet, wallets, args.height, args.transactions, random.Random(args.seed))
+    recipient = wallets[0].public_key
+    height = len(node.blockchain.chain)
+    # Every posted transaction gets its own amount, a repeated one would only time the rejection as already known
+    amounts = itertools.count(1)
+
+    def next_amount():
+        return round(0.000001 * next(amounts), 6)
+
+    def post_transaction():
+        return client.post('/transaction', json={'recipient': recipient, 'amount': next_amount()})
+
+    def post_batch():
+        batch = [{'recipient': recipient, 'amount': next_amount()} for _ in range(args.transactions)]
+        return client.post('/transactions/batch', json=batch)
+
+    requests = {
+        'GET /chain': lambda: client.get('/chain'),
+        'GET /chain/tip': lambda: client.get('/chain/tip'),
+        'GET /chain/headers': lambda: client.get('/chain/headers?start=0&end={}'.format(height)),
+        'GET /chain/blocks': lambda: client.get('/chain/blocks?start={}'.format(max(0, height - 100))),
+        'GET /balance': lambda: client.get('/balance'),
+        'GET /transactions': lambda: client.get('/transactions'),
+        'POST /transaction': post_transaction,
+        'POST /transactions/batch': post_batch,
+        'POST /mine': lambda: wait_for_job(client, client.post('/mine').json['job']['id'])
+    }
+    return {name: measure(request, args.repeat) for name, request in requests.items()}
+
+
+# Polls a background mining job until it finishes
+def wait_for_job(client, job_id):
+    while True:
+        job = client.get('/mine/{}'.format(job_id)).json['job']
+        if job['status'] not in ('queued', 'running', 'cancelling'):
+            return job
+        sleep(0.001)
+
+
+# Measures peers catching up with a chain through resolve, then how long a mined block takes to reach them
+def bench_network(args, wallets):
+    nodes = [start_node() for _ in range(args.nodes)]
+    try:
+        addresses = ['127.0.0.1:{}'.format(node.port) for node, _ in nodes]
+        miner_node = nodes[0][0]
+        build_chain(miner_node.blockchain, miner_node.wallet, wallets, args.height, args.transactions,
+                    random.Random(args.seed))
+        clear_signature_caches()
+        resolve_durations = []
+        for node, _ in nodes[1:]:
+            node.blockchain.add_node(addresses[0])
+            resolve_durations.append(measure(node.blockchain.resolve)['total'])
+        for address in addresses[1:]:
+            miner_node.blockchain.add_node(address)
+        propagation = []
+        for _ in range(args.repeat):
+            started = perf_counter()
+            block = miner_node.blockchain.mine_block()
+            while any(len(node.blockchain.chain) <= block.index for node, _ in nodes[1:]):
+                if perf_counter() - started > PROPAGATION_TIMEOUT:
+                    raise RuntimeError('Block {} did not reach every node'.format(block.index))
+                sleep(0.001)
+            propagation.append(perf_counter() - started)
+        return {
+            'nodes': args.nodes,
+            'resolve_from_genesis': summarize(resolve_durations),
+            'block_propagation': summarize(propagation)
+        }
+    finally:
+        for _, server in nodes:
+            server.shutdown()
+
+
+# Waits until check is true for every node, returns seconds since started
+def wait_for_nodes(nodes, check, started, item):
+    while not all(check(node) for node in nodes):
+        if perf_counter() - started > PROPAGATION_TIMEOUT:
+            raise RuntimeError('{} did not reach every node'.format(item))
+        sleep(0.001)
+    return perf_counter() - started
+
+
+# Propagation over a sparse topology where nodes only reach the rest through relays
+'''
+    Every node peers with its ring neighbour, which keeps the network connected, and a few random
+    nodes. Blocks are mined on the first node and transactions sent from it, the measurements are
+    the time until every node has them and the bytes posted to peers meanwhile.
+'''
+
+
+def bench_gossip(args):
+    nodes = [node for node, _ in [start_node() for _ in range(args.gossip_nodes)]]
+    rng = random.Random(args.seed)
+    addresses = ['127.0.0.1:{}'.format(node.port) for node in nodes]
+    for position, node in enumerate(nodes):
+        others = addresses[:position] + addresses[position + 1:]
+        peers = {addresses[(position + 1) % len(nodes)]} | set(rng.sample(others, min(GOSSIP_PEERS, len(others))))
+        for peer in peers - {addresses[position]}:
+            node.blockchain.add_node(peer)
+    miner = nodes[0]
+    client = miner.app.test_client()
+    block_propagation = []
+    transaction_propagation = []
+    bytes_before = metrics.BROADCAST_BYTES.total()
+    for number in range(args.repeat):
+        started = perf_counter()
+        block = miner.blockchain.mine_block()
+        block_propagation.append(wait_for_nodes(nodes, lambda node: len(node.blockchain.chain) > block.index,
+                                                started, 'Block {}'.format(block.index)))
+        started = perf_counter()
+        transaction = client.post('/transaction', json={'recipient': addresses[-1],
+                                                        'amount': round(0.001 * (number + 1), 6)}).json['transaction']
+        transaction_propagation.append(wait_for_nodes(
+            nodes, lambda node: any(tx.signature == transaction['signature']
+                                    for tx in node.blockchain.get_open_transactions()),
+            started, 'Transaction'))
+    bytes_sent = metrics.BROADCAST_BYTES.total() - bytes_before
+    return {
+        'nodes': len(nodes),
+        'peers_per_node': sum(len(node.blockchain.get_nodes()) for node in nodes) / len(nodes),
+        'block_propagation': summarize(block_propagation),
+        'transaction_propagation': summarize(transaction_propagation),
+        'bytes_sent': bytes_sent,
+        'bytes_per_item': bytes_sent / (2 * args.repeat)
+    }
+
+
+# Compares read throughput of the Flask node and the async node under concurrent clients
+def bench_servers(args):
+    paths = ['/chain/tip', '/balance', '/transactions', '/chain/blocks?start=0', '/nodes']
+    results = {'requests': args.server_requests, 'clients': args.threads}
+    node, server = start_node()
+    try:
+        for _ in range(3):
+            node.blockchain.mine_block()
+        results['flask'] = load_test(node.port, paths, args.server_requests, args.threads)
+    finally:
+        server.shutdown()
+    try:
+        app, port, loop, runner = start_async_node()
+    except ImportError as e:
+        results['async'] = 'skipped: {}'.format(e)
+        return results
+    import async_node
+    try:
+        Session().post('http://127.0.0.1:{}/wallet'.format(port)).raise_for_status()
+        for _ in range(3):
+            app[async_node.BLOCKCHAIN].blockchain.mine_block()
+        results['async'] = load_test(port, paths, args.server_requests, args.threads)
+    finally:
+        stop_async_node(loop, runner)
+    return results
+
+
+# Readers check every chain they see is linked, writers add transactions while blocks are mined
+'''
+    Fails if a reader sees a chain with a broken link or if an accepted transaction is neither
+    confirmed exactly once nor still outstanding at the end.
+'''
+
+
+def bench_concurrency(args):
+    node = load_node('concurrency')
+    node.app.test_client().post('/wallet')
+    blockchain = node.blockchain
+    # Funds for every stress transaction
+    blockchain.mine_block()
+    recipients = create_wallets(args.threads, 1000)
+    transactions = []
+    for number in range(args.stress_transactions):
+        recipient = recipients[number % len(recipients)].public_key
+        # Distinct amounts keep transaction ids distinct
+        amount = round(0.000001 * (number + 1), 6)
+        transactions.append((recipient, amount, node.wallet.sign_transaction(node.wallet.public_key, recipient,
+                                                                             amount)))
+    writing = threading.Event()
+    writing.set()
+    accepted = []
+    torn_chains = []
+    reads = []
+
+    def write(batch):
+        for recipient, amount, signature in batch:
+            if blockchain.add_new_transaction(node.wallet.public_key, recipient, signature, amount):
+                accepted.append((recipient, amount, signature))
+
+    def mine():
+        while writing.is_set():
+            blockchain.mine_block()
+
+    def read():
+        client = node.app.test_client()
+        count = 0
+        while writing.is_set():
+            chain = [Block.from_dict(block) for block in client.get('/chain').json]
+            for previous_block, block in zip(chain, chain[1:]):
+                if block.previous_hash != previous_block.hash or block.index != previous_block.index + 1:
+                    torn_chains.append(block.index)
+                    break
+            client.get('/balance')
+            client.get('/transactions')
+            count += 1
+        reads.append(count)
+
+    writers = [threading.Thread(target=write, args=(transactions[number::args.threads],))
+               for number in range(args.threads)]
+    others = [threading.Thread(target=mine)] + [threading.Thread(target=read) for _ in range(args.threads)]
+    started = perf_counter()
+    for thread in writers + others:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    elapsed = perf_counter() - started
+    writing.clear()
+    for thread in others:
+        thread.join()
+    while blockchain.get_open_transactions():
+        blockchain.mine_block()
+
+    confirmed = [(tx.recipient, tx.amount, tx.signature) for block in blockchain.chain for tx in block.transactions
+                 if tx.sender == node.wallet.public_key]
+    lost = len(set(accepted) - set(confirmed))
+    duplicated = len(confirmed) - len(set(confirmed))
+    if torn_chains or lost or duplicated:
+        raise RuntimeError('Concurrency check failed: {} torn chains, {} lost and {} duplicated transactions'.format(
+            len(torn_chains), lost, duplicated))
+    return {
+        'threads': args.threads,
+        'transactions': len(transactions),
+        'accepted': len(accepted),
+        'blocks': len(blockchain.chain),
+        'chain_reads': sum(reads),
+        'transactions_per_second': len(accepted) / elapsed,
+        'torn_chains': len(torn_chains),
+        'lost_transactions': lost,
+        'duplicated_transactions': duplicated
+    }
+
+
+def main():
+    from argparse import ArgumentParser
+    parser = ArgumentParser(
+        description='Benchmark mining, verification, balances, persistence, endpoints and concurrency')
+    parser.add_argument('--height', type=int, default=100, help='blocks in the synthetic chain')
+    parser.add_argument('--transactions', type=int, default=5, help='transactions per block')
+    parser.add_argument('--wallets', type=int, default=5, help='wallets sending transactions')
+    parser.add_argument('--nodes', type=int, default=3, help='in-process nodes for network scenarios')
+    parser.add_argument('--repeat', type=int, default=5, help='runs per measurement')
+    parser.add_argument('--workers', type=int, default=os.cpu_count() or 1, help='mining worker processes')
+    parser.add_argument('--threads', type=int, default=8, help='writer and reader threads in the concurrency test')
+    parser.add_argument('--stress-transactions', type=int, default=400,
+                        help='transactions added concurrently in the concurrency test')
+    parser.add_argument('--gossip-nodes', type=int, default=8, help='in-process nodes for the gossip simulation')
+    parser.add_argument('--server-requests', type=int, default=2000,
+                        help='requests sent to each server when comparing the Flask and async nodes')
+    parser.add_argument('--target-block-time', type=float, default=0,
+                        help='seconds between blocks difficulty retargets to, 0 keeps the initial target so '
+                             'synthetic chains build quickly')
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--output', help='write json results to this file instead of stdout')
+    args = parser.parse_args()
+    difficulty.TARGET_BLOCK_TIME = args.target_block_time
+
+    output = os.path.abspath(args.output) if args.output else None
+    # Node progress messages go to stderr so stdout stays valid json
+    with tempfile.TemporaryDirectory() as directory, contextlib.redirect_stdout(sys.stderr):
+        os.chdir(directory)
+        wallets = create_wallets(args.wallets, 1)
+        miner_wallet = Wallet('miner')
+        miner_wallet.create_keys()
+        blockchain = Blockchain(miner_wallet.public_key, 'benchmark')
+        build_started = perf_counter()
+        build_chain(blockchain, miner_wallet, wallets, args.height, args.transactions, random.Random(args.seed))
+        results = {
+            'config': vars(args),
+            'build_chain': perf_counter() - build_started,
+            'mining': bench_mining(args),
+            'wallet': bench_wallet(args, wallets),
+            'chain': bench_chain(args, blockchain, wallets),
+            'endpoints': bench_endpoints(args, wallets),
+            'network': bench_network(args, wallets),
+            'gossip': bench_gossip(args),
+            'concurrency': bench_concurrency(args),
+            'servers': bench_servers(args)
+        }
+        os.chdir(ROOT)
+    report = json.dumps(results, indent=2)
+    if output:
+        with open(output, mode='w') as file:
+            file.write(report)
+    else:
+        print(report)
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -1,14 +1,105 @@
+import hashlib
+import json
+import math
 from time import time
 
+import metrics
+from transaction import Transaction
+
+
+# Block is immutable after construction, so its serialization and hash are computed once
+'''
+    Blocks with a Merkle root are hashed over their header only, the root commits to the
+    transactions, so a header alone is enough to check the hash, the proof of work and the link to
+    the previous block. Older blocks without a root are hashed over the whole block.
+'''
+
 
 class Block:
-    def __init__(self, index, previous_hash, transactions, proof_number, timestamp=None):
-        self.index = index
-        self.previous_hash = previous_hash  # Hash of previous block
-        self.transactions = transactions    # Transactions in the block
-        self.proof_number = proof_number
-        self.timestamp = time() if timestamp is None else timestamp
-        # self.timestamp = 0
+    __slots__ = ('index', 'previous_hash', 'transactions', 'proof_number', 'timestamp', 'bits', 'merkle_root',
+                 '_serialized', '_hash')
+
+    def __init__(self, index, previous_hash, transactions, proof_number, timestamp=None, bits=None,
+                 merkle_root=None):
+        set_field = super().__setattr__
+        set_field('index', index)
+        set_field('previous_hash', previous_hash)  # Hash of previous block
+        set_field('transactions', tuple(transactions))  # Transactions in the block
+        set_field('proof_number', proof_number)
+        set_field('timestamp', time() if timestamp is None else timestamp)
+        # Compact proof of work target, None for blocks mined before targets were stored per block
+        set_field('bits', bits)
+        # Merkle root of the transaction ids, None for blocks mined before roots were stored
+        set_field('merkle_root', merkle_root)
+        set_field('_serialized', None)
+        set_field('_hash', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Block is immutable')
+
+    # Raises ValueError if a field the codec stores as a varint is not a non-negative int,
+    # or the timestamp is not a finite number
+    @staticmethod
+    def from_dict(block):
+        for field in ('index', 'proof_number', 'bits'):
+            value = block.get(field, 0 if field == 'bits' else None)
+            if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+                raise ValueError('Block {} must be a non-negative int, got {!r}'.format(field, value))
+        timestamp = block['timestamp']
+        if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool) or not math.isfinite(timestamp):
+            raise ValueError('Block timestamp must be a finite number, got {!r}'.format(timestamp))
+        transactions = [Transaction(tx['sender'], tx['recipient'], tx['amount'], tx['signature'])
+                        for tx in block['transactions']]
+        return Block(block['index'], block['previous_hash'], transactions, block['proof_number'], block['timestamp'],
+                     block.get('bits'), block.get('merkle_root'))
+
+    # Blocks without bits or root keep their old form, so their hashes do not change
+    def to_dict(self):
+        block = {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'transactions': [tx.to_ordered_dict() for tx in self.transactions],
+            'proof_number': self.proof_number,
+            'timestamp': self.timestamp
+        }
+        if self.bits is not None:
+            block['bits'] = self.bits
+        if self.merkle_root is not None:
+            block['merkle_root'] = self.merkle_root
+        return block
+
+    # Block fields without transactions, plus the block hash
+    def header(self):
+        header = self.__header_fields()
+        header['hash'] = self.hash
+        return header
+
+    def __header_fields(self):
+        header = {
+            'index': self.index,
+            'previous_hash': self.previous_hash,
+            'proof_number': self.proof_number,
+            'timestamp': self.timestamp
+        }
+        if self.bits is not None:
+            header['bits'] = self.bits
+        if self.merkle_root is not None:
+            header['merkle_root'] = self.merkle_root
+        return header
+
+    # Canonical serialization the block hash is computed from, the header if the block has a Merkle root
+    def serialize(self):
+        if self._serialized is None:
+            fields = self.to_dict() if self.merkle_root is None else self.__header_fields()
+            super().__setattr__('_serialized', json.dumps(fields, sort_keys=True))
+        return self._serialized
+
+    @property
+    def hash(self):
+        if self._hash is None:
+            with metrics.BLOCK_HASH_SECONDS.time():
+                super().__setattr__('_hash', hashlib.sha256(self.serialize().encode()).hexdigest())
+        return self._hash
 
     def __repr__(self):
-        return str(self.__dict__)
+        return str(self.to_dict())
@@ -0,0 +1,453 @@
+import json
+import mmap
+import os
+import struct
+import zlib
+
+import chain_stream
+import codec
+import metrics
+from blockchain_settings import SEGMENT_SIZE, FSYNC_EVERY, CHECKPOINT_INTERVAL, STORE_FORMAT, SNAPSHOTS_KEPT, \
+    STREAM_CHUNK_SIZE
+
+# Every record in a segment is framed as: payload length, crc32 of payload, payload
+RECORD_HEADER = struct.Struct('>II')
+
+# Bytes of a binary record read for its block header, enough for every header field
+BLOCK_HEADER_READ = 160
+
+
+# Append-only block log split into segments
+'''
+    Blocks are appended as framed records and never rewritten. A record holding block N supersedes
+    every block at height N and above, so switching to another fork only appends the new suffix.
+    index-<generation>.log is an append-only journal of the offset index, one json line per
+    appended entry ([height, segment, offset, length, hash], replacing that height and everything
+    above) or truncation ([height]). A checkpoint appends the lines since the previous one and
+    rewrites the small checkpoint.json with the journal size and the log position it covers; on
+    startup the journal is applied and only the records after that position are replayed. Once
+    forks made the journal much longer than the chain the index is written to the next generation.
+    state.json holds the small mempool and peers state.
+    Record payloads are json or the binary codec format, told apart by their first byte.
+    Index entries below the tip are never changed in place, replacing them builds a new list, so a
+    reader holding an index snapshot keeps seeing the same blocks while the writer appends.
+    A node bootstrapped from a balance snapshot has no blocks below the snapshot height, the
+    chain then starts at base. A record past the tip starts a new base, both when appending and
+    when replaying. Balance snapshots are kept as snapshot-<height>.json next to the segments.
+    address-index.log is the append-only journal of the address index, see AddressIndex, it is
+    written by the node state thread and rewritten once it grew much longer than the chain.
+'''
+
+
+def _encode_record(record):
+    if STORE_FORMAT == 'binary':
+        return codec.encode_block(record)
+    return json.dumps(record).encode()
+
+
+def _decode_record(payload):
+    if payload[:1] == b'{':
+        return json.loads(payload.decode())
+    return codec.decode_block(payload)
+
+
+class BlockStore:
+    def __init__(self, node_id):
+        # Absolute, state is saved from a background thread whatever the working directory is then
+        self.directory = os.path.abspath('blockchain-{}'.format(node_id))
+        self.legacy_file = 'blockchain-{}.txt'.format(node_id)
+        # Offset index, one entry per height from base: [segment, offset, length, block hash]
+        self.__index = []
+        # Height of the first stored block, blocks below it are pruned
+        self.__base = 0
+        self.__segment = 0
+        self.__position = 0
+        self.__file = None
+        self.__unsynced = 0
+        self.__since_checkpoint = 0
+        # Index journal lines not written yet, generation and base of the journal file, its size and line count
+        self.__journal = []
+        self.__journal_generation = 0
+        self.__journal_base = 0
+        self.__journal_size = 0
+        self.__journal_records = 0
+        # Journal file does not match the index, it is rewritten at the next checkpoint
+        self.__compact = True
+        # Lines in the address index journal
+        self.address_journal_records = 0
+        # Read-only memory maps by segment
+        self.__maps = {}
+
+    def __len__(self):
+        return self.__base + len(self.__index)
+
+    @property
+    def base(self):
+        return self.__base
+
+    def get_hash(self, height):
+        return self.__entry(height)[3]
+
+    def __entry(self, height):
+        if height < self.__base:
+            raise IndexError('block {} is pruned'.format(height))
+        return self.__index[height - self.__base]
+
+    # Current offset index, its base and the chain length, entries below that length never change
+    def index_snapshot(self):
+        index = self.__index
+        base = self.__base
+        return index, base, base + len(index)
+
+    def __segment_path(self, segment):
+        return os.path.join(self.directory, 'blocks-{:05d}.log'.format(segment))
+
+    def __path(self, name):
+        return os.path.join(self.directory, name)
+
+    # Loads offset index from checkpoint and index journal and replays the log tail written after them
+    def load(self):
+        os.makedirs(self.directory, exist_ok=True)
+        self.__journal = []
+        self.__compact = False
+        try:
+            with open(self.__path('checkpoint.json'), mode='r') as file:
+                checkpoint = json.load(file)
+            self.__segment = checkpoint['segment']
+            self.__position = checkpoint['position']
+            if 'index' in checkpoint:
+                # Checkpoint written before the index journal, it holds the whole index
+                self.__index = checkpoint['index']
+                self.__base = checkpoint.get('base', 0)
+                self.__compact = True
+            else:
+                self.__read_journal(checkpoint['journal_generation'], checkpoint['journal_base'],
+                                    checkpoint['journal_size'])
+        except (IOError, ValueError, KeyError):
+            self.__index = []
+            self.__base = 0
+            self.__segment = 0
+            self.__position = 0
+            self.__compact = True
+        self.__replay_tail()
+
+    # Applies the first size bytes of the index journal, lines written after the checkpoint are dropped
+    def __read_journal(self, generation, base, size):
+        with open(self.__journal_path(generation), mode='rb') as file:
+            data = file.read(size)
+            if len(data) < size:
+                raise ValueError('Index journal is shorter than its checkpoint')
+        self.__index = []
+        self.__base = base
+        lines = data.splitlines()
+        for line in lines:
+            self.__apply(json.loads(line.decode()))
+        # Records after the checkpoint are replayed from the log and journaled again
+        with open(self.__journal_path(generation), mode='r+b') as file:
+            file.truncate(size)
+        self.__journal_generation = generation
+        self.__journal_base = base
+        self.__journal_size = size
+        self.__journal_records = len(lines)
+
+    def __apply(self, record):
+        if len(record) == 1:
+            self.__drop_from(record[0])
+        else:
+            self.__add_entry(record[0], record[1:], True)
+
+    # Places entry at height, see __place, and journals it
+    def __add_entry(self, height, entry, rebase):
+        self.__place(height, rebase)
+        self.__index.append(entry)
+        self.__journal.append([height] + entry)
+
+    def __replay_tail(self):
+        while True:
+            path = self.__segment_path(self.__segment)
+            if not os.path.exists(path):
+                break
+            with open(path, mode='rb') as file:
+                file.seek(self.__position)
+                while True:
+                    header = file.read(RECORD_HEADER.size)
+                    if len(header) < RECORD_HEADER.size:
+                        torn = len(header) > 0
+                        break
+                    length, crc = RECORD_HEADER.unpack(header)
+                    payload = file.read(length)
+                    if len(payload) < length or zlib.crc32(payload) != crc:
+                        torn = True
+                        break
+                    block = _decode_record(payload)
+                    self.__add_entry(block['index'], [self.__segment, self.__position, length, block['hash']], True)
+                    self.__position += RECORD_HEADER.size + length
+            if torn:
+                # Process died mid-write, drop the partial record
+                print('Truncating torn record in {}'.format(path))
+                with open(path, mode='r+b') as file:
+                    file.truncate(self.__position)
+                break
+            if not os.path.exists(self.__segment_path(self.__segment + 1)):
+                break
+            self.__segment += 1
+            self.__position = 0
+
+    # Reads block at given height as dict
+    def read(self, height):
+        return self.read_entry(self.__entry(height))
+
+    # Reads block of an offset index entry as dict
+    def read_entry(self, entry):
+        segment, offset, length, _ = entry
+        start = offset + RECORD_HEADER.size
+        segment_map = self.__map(segment, start + length)
+        return _decode_record(segment_map[start:start + length])
+
+    # Reads the header of the block of an offset index entry as dict, its hash comes from the entry
+    '''
+        Binary records only read the bytes in front of the transactions, json records are decoded whole.
+    '''
+
+    def read_header_entry(self, entry):
+        segment, offset, length, block_hash = entry
+        start = offset + RECORD_HEADER.size
+        segment_map = self.__map(segment, start + length)
+        if segment_map[start:start + 1] == b'{':
+            header = json.loads(segment_map[start:start + length].decode())
+            del header['transactions']
+        else:
+            try:
+                header = codec.decode_block_header(segment_map[start:start + min(length, BLOCK_HEADER_READ)])
+            except codec.CodecError:
+                header = codec.decode_block_header(segment_map[start:start + length])
+        header['hash'] = block_hash
+        return header
+
+    # Maps segment into memory, remapping when the segment grew past the mapped size
+    def __map(self, segment, size):
+        segment_map = self.__maps.get(segment)
+        if segment_map is None or len(segment_map) < size:
+            # A smaller map may still be read by another thread, it is closed once unreferenced
+            with open(self.__segment_path(segment), mode='rb') as file:
+                segment_map = mmap.mmap(file.fileno(), 0, access=mmap.ACCESS_READ)
+            self.__maps[segment] = segment_map
+        return segment_map
+
+    # Appends block dict at height block['index'], replacing that height and everything above
+    '''
+        rebase: block may lie past the tip, the stored chain then starts at that block
+    '''
+
+    def append(self, block, block_hash, rebase=False):
+        if (block['index'] > len(self) or block['index'] < self.__base) and not rebase:
+            raise ValueError('Block {} does not extend the stored chain'.format(block['index']))
+        record = dict(block)
+        record['hash'] = block_hash
+        payload = _encode_record(record)
+        if self.__position > 0 and self.__position + RECORD_HEADER.size + len(payload) > SEGMENT_SIZE:
+            self.__roll_segment()
+        if self.__file is None:
+            self.__file = open(self.__segment_path(self.__segment), mode='ab')
+        self.__file.write(RECORD_HEADER.pack(len(payload), zlib.crc32(payload)))
+        self.__file.write(payload)
+        # Hand the record to the OS right away, fsync is batched
+        self.__file.flush()
+        self.__add_entry(block['index'], [self.__segment, self.__position, len(payload), block_hash], rebase)
+        self.__position += RECORD_HEADER.size + len(payload)
+        metrics.BLOCK_STORE_BYTES.inc(RECORD_HEADER.size + len(payload))
+        self.__unsynced += 1
+        self.__since_checkpoint += 1
+        if self.__unsynced >= FSYNC_EVERY:
+            self.sync()
+        if self.__since_checkpoint >= CHECKPOINT_INTERVAL or rebase:
+            self.checkpoint()
+
+    # Drops blocks from given height onwards, used when switching to another fork
+    def truncate(self, height):
+        if height < self.__base:
+            raise ValueError('Cannot truncate below pruned height {}'.format(self.__base))
+        self.__drop_from(height)
+        self.__journal.append([height])
+        # Persist immediately so a restart does not replay the dropped blocks
+        self.checkpoint()
+
+    # Makes room for a record at height, a height outside the stored chain starts a new base
+    def __place(self, height, rebase):
+        if rebase and (height > len(self) or height < self.__base):
+            self.__index = []
+            self.__base = height
+        else:
+            self.__drop_from(height)
+
+    # Copies the index instead of deleting in place so readers of older snapshots are not affected
+    def __drop_from(self, height):
+        if height - self.__base < len(self.__index):
+            self.__index = self.__index[:height - self.__base]
+
+    def __roll_segment(self):
+        self.sync()
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+        self.__segment += 1
+        self.__position = 0
+
+    # Flushes appended records to disk
+    def sync(self):
+        if self.__file is not None and self.__unsynced:
+            os.fsync(self.__file.fileno())
+        self.__unsynced = 0
+
+    # Writes the index journal lines since the last checkpoint and the log position they cover
+    def checkpoint(self):
+        self.sync()
+        previous_generation = self.__journal_generation
+        if self.__compact or self.__journal_records + len(self.__journal) > 2 * len(self.__index) + CHECKPOINT_INTERVAL:
+            self.__rewrite_journal()
+        elif self.__journal:
+            content = ''.join(json.dumps(record) + '\n' for record in self.__journal).encode()
+            with open(self.__journal_path(self.__journal_generation), mode='ab') as file:
+                file.write(content)
+                file.flush()
+                os.fsync(file.fileno())
+            self.__journal_size += len(content)
+            self.__journal_records += len(self.__journal)
+        self.__journal = []
+        self.__write_atomic('checkpoint.json', {
+            'segment': self.__segment,
+            'position': self.__position,
+            'journal_generation': self.__journal_generation,
+            'journal_base': self.__journal_base,
+            'journal_size': self.__journal_size
+        })
+        self.__since_checkpoint = 0
+        # The old generation is only dropped once no checkpoint refers to it
+        if self.__journal_generation != previous_generation and os.path.exists(
+                self.__journal_path(previous_generation)):
+            os.remove(self.__journal_path(previous_generation))
+
+    def __journal_path(self, generation):
+        return self.__path('index-{:05d}.log'.format(generation))
+
+    # Writes one line per current index entry to the next journal generation
+    def __rewrite_journal(self):
+        content = ''.join(json.dumps([self.__base + offset] + entry) + '\n'
+                          for offset, entry in enumerate(self.__index)).encode()
+        self.__journal_generation += 1
+        self.__write_file_atomic(os.path.basename(self.__journal_path(self.__journal_generation)), content)
+        self.__journal_base = self.__base
+        self.__journal_size = len(content)
+        self.__journal_records = len(self.__index)
+        self.__compact = False
+
+    def close(self):
+        self.checkpoint()
+        for segment_map in self.__maps.values():
+            segment_map.close()
+        self.__maps = {}
+        if self.__file is not None:
+            self.__file.close()
+            self.__file = None
+
+    # Saves outstanding transactions and peer nodes
+    def save_state(self, open_transactions, nodes):
+        with metrics.SAVE_DATA_SECONDS.time():
+            written = self.__write_atomic('state.json', {'open_transactions': open_transactions, 'nodes': nodes})
+        metrics.SAVE_DATA_BYTES.inc(written)
+
+    def load_state(self):
+        try:
+            with open(self.__path('state.json'), mode='r') as file:
+                state = json.load(file)
+                return state['open_transactions'], state['nodes']
+        except (IOError, ValueError, KeyError):
+            return [], []
+
+    # Saves balance snapshot dict, only the newest SNAPSHOTS_KEPT and the one at base are kept
+    def save_snapshot(self, snapshot):
+        self.__write_atomic('snapshot-{:010d}.json'.format(snapshot['height']), snapshot)
+        for height in self.list_snapshots()[SNAPSHOTS_KEPT:]:
+            if height != self.__base:
+                os.remove(self.__path('snapshot-{:010d}.json'.format(height)))
+
+    # Heights of stored balance snapshots, newest first
+    def list_snapshots(self):
+        heights = []
+        for name in os.listdir(self.directory):
+            if name.startswith('snapshot-') and name.endswith('.json'):
+                heights.append(int(name[len('snapshot-'):-len('.json')]))
+        return sorted(heights, reverse=True)
+
+    def load_snapshot(self, height):
+        try:
+            with open(self.__path('snapshot-{:010d}.json'.format(height)), mode='r') as file:
+                return json.load(file)
+        except (IOError, ValueError):
+            return None
+
+    # Appends address index journal records
+    def append_address_journal(self, records):
+        content = ''.join(json.dumps(record) + '\n' for record in records).encode()
+        with open(self.__path('address-index.log'), mode='ab') as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        self.address_journal_records += len(records)
+
+    # Replaces the address index journal with records
+    def rewrite_address_journal(self, records):
+        content = ''.join(json.dumps(record) + '\n' for record in records).encode()
+        self.__write_file_atomic('address-index.log', content)
+        self.address_journal_records = len(records)
+
+    # Records of the address index journal, a line torn by a crash and everything after it is dropped
+    def load_address_journal(self):
+        records = []
+        path = self.__path('address-index.log')
+        if os.path.exists(path):
+            size = 0
+            with open(path, mode='rb') as file:
+                for line in file:
+                    if not line.endswith(b'\n'):
+                        break
+                    try:
+                        records.append(json.loads(line.decode()))
+                    except ValueError:
+                        break
+                    size += len(line)
+            with open(path, mode='r+b') as file:
+                file.truncate(size)
+        self.address_journal_records = len(records)
+        return records
+
+    # Writes to a temporary file first so a crash never leaves a half written file behind
+    def __write_atomic(self, name, data):
+        return self.__write_file_atomic(name, json.dumps(data).encode())
+
+    def __write_file_atomic(self, name, content):
+        path = self.__path(name)
+        tmp_path = path + '.tmp'
+        with open(tmp_path, mode='wb') as file:
+            file.write(content)
+            file.flush()
+            os.fsync(file.fileno())
+        os.replace(tmp_path, path)
+        return len(content)
+
+    # Reads outstanding transactions and nodes from the old single file format, None without one
+    def load_legacy_state(self):
+        try:
+            with open(self.legacy_file, mode='r') as file:
+                # Skip the chain line a chunk at a time instead of reading it into memory
+                line = file.readline(STREAM_CHUNK_SIZE)
+                while line and not line.endswith('\n'):
+                    line = file.readline(STREAM_CHUNK_SIZE)
+                return json.loads(file.readline()), json.loads(file.readline())
+        except (IOError, ValueError):
+            return None
+
+    # Blocks of the old single file format one at a time, raises IOError or ValueError on a broken file
+    def iter_legacy_blocks(self):
+        with open(self.legacy_file, mode='r') as file:
+            yield from chain_stream.iter_decode_array(iter(lambda: file.read(STREAM_CHUNK_SIZE), ''))
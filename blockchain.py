@@ -1,22 +1,53 @@
-import functools
-import json
-import hashlib
-import requests
+import threading
+from time import time
 
+import difficulty
+import merkle
+import metrics
+from address_index import AddressIndex
+from balance_snapshot import BalanceSnapshot
 from block import Block
+from broadcaster import Broadcaster
+from block_store import BlockStore
+from chain_state import ChainState
+from chain_view import ChainView
+from gossip import Gossip
+from mempool import Mempool
+from miner import Miner
+from state_writer import StateWriter
 from transaction import Transaction
 from verification import Verification
 
 from wallet import Wallet
-from blockchain_settings import MINING_REWARD
+from blockchain_settings import MINING_REWARD, SYNC_HEADERS_PAGE, SYNC_BLOCKS_PAGE, SNAPSHOT_INTERVAL, SNAPSHOT_QUORUM, \
+    HISTORY_PAGE, CHECKPOINT_INTERVAL
 
 # Reward for mining
 reward = MINING_REWARD
 
+# Messages for the reasons add_new_transactions rejects a transaction
+REJECTION_MESSAGES = {
+    'missing_fields': 'Required data is missing',
+    'invalid': 'Invalid signature',
+    'duplicate': 'Transaction already known',
+    'insufficient_funds': 'Insufficient funds'
+}
+
 
 # Defining attributes and methods of a blockchain
+'''
+    Concurrency: changes (add_new_transaction, add_block, resolve, mine_block, add_node, remove_node)
+    are serialized by a single writer lock. After every change the writer publishes an immutable
+    ChainState, readers (chain, get_tip, get_balance, get_open_transactions, get_nodes, ...) only
+    dereference the current state and never wait for the writer. Slow work such as signature checks,
+    proof of work and downloading peer chains happens outside the writer lock.
+    Balances are saved as a BalanceSnapshot every SNAPSHOT_INTERVAL blocks, a restart only replays
+    the blocks after the newest snapshot and a fresh node can bootstrap from a peer's snapshot.
+'''
+
+
 class Blockchain:
-    def __init__(self, wallet, node_id):
+    def __init__(self, wallet, node_id, broadcaster=None):
         ''' Genesis block: The very first block that is hardcoded in the blockchain -
                 index: 0
                 previous hash: ''
@@ -24,25 +55,92 @@ class Blockchain:
                 proof number: 100
                 timestamp: 0
         '''
-        genesis_block = Block(0, '', [], 100, 0)
+        self.__genesis_block = Block(0, '', [], 100, 0)
 
-        self.__chain = [genesis_block]
-        self.__open_transactions = []
+        # Outstanding transactions by id, also tracks amounts they spend per sender
+        self.__mempool = Mempool()
+        # Confirmed balance per address, kept up to date as blocks are appended
+        self.__balances = {}
+        # Confirmed transactions by address and id, blocks by hash
+        self.__address_index = AddressIndex()
         self.wallet = wallet
         self.__nodes = set()
         self.node_id = node_id
         self.resolve_conflicts = False
+        self.__store = BlockStore(node_id)
+        # Chain blocks are loaded from the block store on access
+        self.__chain = ChainView(self.__store)
+        self.__miner = Miner()
+        # Only one proof of work runs at a time on the miner
+        self.__mining_lock = threading.Lock()
+        # Delivers messages to peers, the async node passes one doing non-blocking I/O
+        self.__broadcaster = broadcaster if broadcaster is not None else Broadcaster()
+        # Announces new transactions and blocks to peers and relays the ones received from them
+        self.__gossip = Gossip(self.__broadcaster)
+        # Serializes every change to chain, balances, mempool and nodes
+        self.__write_lock = threading.RLock()
+        # Latest published state, replaced as a whole by the writer
+        self.__state = None
+        self.__balances_changed = True
+        # Saves mempool and nodes a moment after they change instead of on every change
+        self.__state_writer = StateWriter(self.__save_state)
+        # Appends address index changes to its journal outside the writer lock
+        self.__address_writer = StateWriter(self.__save_address_index)
         self.load_data()
 
+    # Read-only snapshot of the chain, blocks are loaded lazily
     @property
     def chain(self):
-        return self.__chain[:]
+        return self.__state.chain
+
+    # Consistent snapshot of chain, balances, outstanding transactions and nodes
+    def get_state(self):
+        return self.__state
+
+    # Height and hash of the last block, answered without loading any block
+    def get_tip(self):
+        chain = self.__state.chain
+        return {'height': len(chain) - 1, 'hash': chain.get_hash(-1)}
+
+    def get_headers(self, start, end):
+        return self.__state.chain.headers(start, min(end, start + SYNC_HEADERS_PAGE))
+
+    # Blocks start..end-1 as dicts read one at a time, for serving a whole chain without copying it
+    '''
+        Returns the number of blocks and a generator over them, both from the same snapshot so a
+        switch to another fork while the blocks are read does not mix two chains
+    '''
+
+    def stream_blocks(self, start=0, end=None):
+        chain = self.__state.chain
+        heights = range(max(start, chain.base), len(chain) if end is None else min(end, len(chain)))
+        return len(heights), (chain[height].to_dict() for height in heights)
+
+    def get_blocks(self, start, end):
+        return [block.to_dict() for block in self.__state.chain[start:min(end, start + SYNC_BLOCKS_PAGE)]]
 
     def get_open_transactions(self):
-        return self.__open_transactions[:]
+        return list(self.__state.open_transactions)
+
+    # Number of outstanding transactions without copying them
+    def get_open_transaction_count(self):
+        return len(self.__state.open_transactions)
 
     def get_nodes(self):
-        return list(self.__nodes)[:]
+        return list(self.__state.nodes)
+
+    # Publishes the current state for readers, called by the writer after every change
+    def __publish_state(self):
+        state = self.__state
+        if self.__balances_changed or state is None:
+            balances = dict(self.__balances)
+            self.__balances_changed = False
+        else:
+            balances = state.balances
+        # O(1) whatever the pool size, only the changes since the last state are recorded
+        open_transactions = self.__mempool.snapshot()
+        self.__state = ChainState(self.__chain.snapshot(), balances, open_transactions.pending_spent,
+                                  open_transactions, tuple(self.__nodes))
 
     # Function to add transaction in a block
     '''
@@ -50,73 +148,138 @@ class Blockchain:
         recipient: Receives transactoin from sender
         signature: Unique signature by sender
         amount: Amount to be transfered
+        is_receiving: transaction was relayed by a peer, funds are not checked
     '''
 
     def add_new_transaction(self, sender, recipient, signature, amount, is_receiving=False):
         transaction = Transaction(sender, recipient, amount, signature)
-        if Verification.verify_transaction(transaction, self.get_balance, not is_receiving):
+        if not Verification.valid_amount(amount):
+            print("Transaction amount is invalid")
+            return False
+        # Check signature before taking the writer lock, the result is cached for the check below
+        if not Wallet.verify_transaction(transaction):
+            print("Transaction failed!")
+            return False
+        with self.__write_lock:
+            if transaction.tx_id in self.__mempool:
+                print("Transaction already known")
+                return False
+            if not Verification.verify_transaction(transaction, self.__get_live_balance, not is_receiving):
+                # Report transaction failure in case transaction does not pass verification
+                print("Transaction failed!")
+                return False
             # Append in outstanding transactions if verification returns true
-            self.__open_transactions.append(transaction)
+            self.__mempool.add(transaction)
             print("Transaction successfully added!")
             # Save in text file after passing validity check
-            self.save_data()
-            if not is_receiving:
-                # if receiving:
-                for node in self.__nodes:
-                    # Broadcast transaction to all nodes
-                    url = 'http://{}/broadcast-transaction'.format(node)
-                    try:
-                        response = requests.post(url,
-                                                 json={'sender': self.wallet, 'recipient': recipient, 'amount': amount,
-                                                       'signature': signature})
-                        # Report failure if failed to broadcast transaction
-                        if response.status_code == 400 or response.status_code == 500:
-                            print('Failed broadcast transaction')
-                            return False
-                    except requests.exceptions.ConnectionError:
-                        continue
-            return True
-        # Report transaction failure in case transaction does not pass verification
-        else:
-            print("Transaction failed!")
-            return False
+            self.__publish_state()
+            self.__state_writer.mark_dirty()
+        # Announce transaction to peers, also relays transactions received from peers
+        self.__gossip.announce(self.get_nodes(), transactions=[transaction])
+        return True
+
+    # Function to add many transactions at once
+    '''
+        transactions: list of (sender, recipient, signature, amount)
+        Returns one entry per transaction: None if it was added, otherwise the rejection reason
+        (a key of REJECTION_MESSAGES). Signatures are verified in parallel before taking the writer
+        lock, funds are checked in order so earlier transactions of the batch count as spent.
+        State is saved once and every added transaction is announced to peers in a single message.
+    '''
+
+    def add_new_transactions(self, transactions, is_receiving=False):
+        transactions = [Transaction(sender, recipient, amount, signature)
+                        for sender, recipient, signature, amount in transactions]
+        valid_signatures = Wallet.verify_transactions(transactions)
+        reasons = []
+        added = []
+        with self.__write_lock:
+            for transaction, valid_signature in zip(transactions, valid_signatures):
+                if not valid_signature or not Verification.valid_amount(transaction.amount):
+                    reasons.append('invalid')
+                elif transaction.tx_id in self.__mempool:
+                    reasons.append('duplicate')
+                elif not is_receiving and self.__get_live_balance(transaction.sender) < transaction.amount:
+                    reasons.append('insufficient_funds')
+                else:
+                    # Pending spends of the pool include the transactions added before this one
+                    self.__mempool.add(transaction)
+                    added.append(transaction)
+                    reasons.append(None)
+            if added:
+                self.__publish_state()
+                self.__state_writer.mark_dirty()
+        print('Added {} of {} transactions'.format(len(added), len(transactions)))
+        self.__gossip.announce(self.get_nodes(), transactions=added)
+        return reasons
 
     # Function to add block in blockchain
     ''' block: block that needs to be added in the blockchain '''
 
     def add_block(self, block):
-        # loop through transaction attribute in block object and store in variable
-        transactions = [Transaction(tx['sender'], tx['recipient'], tx['amount'], tx['signature']) for tx in
-                        block['transactions']]
-        # First two characters of hash should be 0
-        valid_proof = Verification.valid_proof(transactions[:-1], block['previous_hash'], block['proof_number'])
+        try:
+            added_block = Block.from_dict(block)
+        except (KeyError, TypeError, ValueError) as e:
+            print('Block is malformed: {}'.format(e))
+            return False
+        transactions = list(added_block.transactions)
+        # Hash of the proof must be within the target the block claims
+        valid_proof = Verification.valid_block_proof(added_block)
         if not valid_proof:
             print('not valid proof')
-        # Checks if previous hashes match in chain
-        last_hash = self.get_hash(self.chain[-1]) == block['previous_hash']
-        if not last_hash:
-            print('not last hash')
-        if not valid_proof or not last_hash:
-            # Do not add block in chain
-            print('Block is not valid. Adding stop')
-            return False
-        # Add block in chain
-        self.__chain.append(
-            Block(block['index'], block['previous_hash'], transactions, block['proof_number'], block['timestamp']))
-        stored_transactions = self.__open_transactions[:]
-        for tx in block['transactions']:
-            for opentx in stored_transactions:
-                # Check transaction consistency
-                if opentx.sender == tx['sender'] and opentx.recipient == tx['recipient'] and opentx.amount == tx[
-                    'amount'] and opentx.signature == tx['signature']:
-                    try:
-                        # Remove from outstanding transaction to maintain consistency
-                        self.__open_transactions.remove(opentx)
-                    except ValueError:
-                        print('Transaction was already removed')
-        self.save_data()
+        # Reward and amounts, then the signatures of the other transactions, mostly cached by the mempool
+        valid_transactions = Verification.valid_transactions(added_block) and all(
+            Wallet.verify_transactions(added_block.transactions[:-1]))
+        if not valid_transactions:
+            print('not valid transactions')
+        with self.__write_lock:
+            # Checks if previous hashes match in chain and the block is the next height, the store
+            # would otherwise place it below the tip and drop the blocks above
+            last_hash = added_block.index == len(self.__chain) and self.__chain.get_hash(-1) == block['previous_hash']
+            if not last_hash:
+                print('not last hash')
+            # Retargeting reads timestamps, they must move forward and not run ahead of the clock
+            valid_timestamp = last_hash and difficulty.valid_timestamp(added_block, self.__get_stored_block)
+            if last_hash and not valid_timestamp:
+                print('not valid timestamp')
+            # Claimed target must be the one retargeting gives for the local chain
+            valid_bits = last_hash and difficulty.valid_bits(added_block, self.__get_stored_block)
+            if last_hash and not valid_bits:
+                print('not valid target')
+            valid_root = last_hash and Verification.valid_merkle_root(added_block, self.__chain[-1])
+            if last_hash and not valid_root:
+                print('not valid merkle root')
+            if (not valid_proof or not last_hash or not valid_timestamp or not valid_bits or not valid_root
+                    or not valid_transactions):
+                # Do not add block in chain
+                print('Block is not valid. Adding stop')
+                return False
+            # Add block in chain
+            self.__append_block(added_block)
+            # Remove from outstanding transactions to maintain consistency
+            self.__mempool.remove_confirmed(transactions)
+            self.__publish_state()
+            self.__state_writer.mark_dirty()
+        # Proof of work running on the old tip is stale now
+        self.cancel_mining()
+        # Relay block to peers that do not have it yet
+        self.__gossip.announce(self.get_nodes(), blocks=[added_block], on_block_response=self.__on_block_broadcast)
         return True
 
+    # Ids of an inventory announced by a peer that this node does not have yet
+    '''
+        transaction_ids: ids of announced transactions
+        blocks: announced blocks as dicts with hash and index
+    '''
+
+    def get_wanted(self, transaction_ids, blocks):
+        chain = self.__state.chain
+
+        def has_block(block_hash, index):
+            return chain.base <= index < len(chain) and chain.get_hash(index) == block_hash
+
+        return self.__gossip.get_wanted(transaction_ids, blocks, has_block)
+
     # Resolves miner conflicts based on chain length
     '''
         Chain with the longest length is considered valid chain
@@ -124,36 +287,166 @@ class Blockchain:
     '''
 
     def resolve(self):
-        winner_chain = self.chain
-        replace = False
-        for node in self.__nodes:
-            url = 'http://{}/chain'.format(node)
-            try:
-                response = requests.get(url)
-                node_chain = response.json()
-                node_chain = [Block(block['index'], block['previous_hash'],
-                                    [Transaction(tx['sender'], tx['recipient'], tx['amount'], tx['signature'])
-                                     for tx in block['transactions']], block['proof_number'], block['timestamp']) for
-                              block in node_chain]
-                node_chain_len = len(node_chain)
-                local_chain_len = len(winner_chain)
-                # Make node chain winner if its length is greater than winner chain and it passes verification
-                if node_chain_len > local_chain_len and Verification.verify_chain(node_chain, self.get_hash):
-                    winner_chain = node_chain
-                    replace = True  # Assumed winner chain has been replaced
-                    print("1        ")
-            except requests.exceptions.ConnectionError:
+        with metrics.RESOLVE_SECONDS.time():
+            replaced = self.__resolve()
+        metrics.RESOLVES.inc(outcome='replaced' if replaced else 'kept')
+        return replaced
+
+    def __resolve(self):
+        # Peers are compared with a snapshot so blocks and transactions keep being accepted while downloading
+        chain = self.__state.chain
+        winner_suffix = None
+        winner_fork_height = len(chain)
+        # Compare tips before downloading anything, try the highest peers first
+        tips = {}
+        for node, tip in self.__broadcaster.fetch_all(self.get_nodes(), '/chain/tip').items():
+            height = tip.get('height') if isinstance(tip, dict) else None
+            if not isinstance(height, int) or isinstance(height, bool) or height < 0:
+                print('Node {} sent invalid tip'.format(node))
+                continue
+            tips[node] = tip
+        for node, tip in sorted(tips.items(), key=lambda item: item[1]['height'], reverse=True):
+            node_chain_len = tip['height'] + 1
+            local_chain_len = len(chain) if winner_suffix is None else winner_fork_height + len(winner_suffix)
+            if node_chain_len <= local_chain_len:
+                break
+            synced = self.__sync_from(chain, node, node_chain_len)
+            if synced is None:
                 continue
+            fork_height, suffix = synced
+            # Make node chain winner if its length is greater than winner chain and it passes verification
+            if fork_height + len(suffix) > local_chain_len:
+                winner_suffix = suffix
+                winner_fork_height = fork_height
+                break
         self.resolve_conflicts = False
-        self.__chain = winner_chain
-        self.save_data()
-        return replace
+        if winner_suffix is None:
+            return False
+        with self.__write_lock:
+            # Local chain may have grown while downloading, the winner must still fork from it and be longer
+            if (len(self.__chain) < winner_fork_height or winner_fork_height <= self.__chain.base
+                    or self.__chain.get_hash(winner_fork_height - 1) != chain.get_hash(winner_fork_height - 1)
+                    or winner_fork_height + len(winner_suffix) <= len(self.__chain)):
+                print('Local chain changed while resolving, chain kept')
+                return False
+            # Roll back local blocks above the fork, keep the common prefix in the block store
+            # and append only the winning suffix
+            for block in reversed(self.__chain[winner_fork_height:]):
+                self.__revert_block_balances(block)
+                self.__address_index.remove_block(block, block.hash)
+            self.__address_writer.mark_dirty()
+            self.__chain.truncate(winner_fork_height)
+            for block in winner_suffix:
+                self.__append_block(block)
+                self.__mempool.remove_confirmed(block.transactions)
+            self.__gossip.forget_confirmed(winner_suffix)
+            self.__publish_state()
+            self.__state_writer.mark_dirty()
+        self.cancel_mining()
+        return True
+
+    # Downloads and verifies the blocks of a node that differ from the local chain
+    '''
+        Returns fork height and the verified blocks above it, or None if the node chain is invalid or unreachable
+        Headers are fetched backwards from the common height in growing windows until a block hash
+        matches the local chain, then the bodies are streamed in one request and verified a page at
+        a time as they arrive. Only the verified suffix is kept, the chain switches to it at once.
+    '''
+
+    def __sync_from(self, chain, node, node_chain_len):
+        fork_height = self.__find_fork_height(chain, node, node_chain_len)
+        if fork_height is None:
+            return None
+        suffix = []
+        previous_block = chain[fork_height - 1]
+
+        # Blocks below a page come from the verified suffix or the shared local prefix
+        def get_ancestor(height):
+            if height >= fork_height:
+                return suffix[height - fork_height]
+            return chain[height] if height >= chain.base else None
+
+        # Verifies page linked to the last verified block and adds it to the suffix
+        def extend(page):
+            start = fork_height + len(suffix)
+            if [block.index for block in page] != list(range(start, start + len(page))):
+                print('Node {} sent unexpected blocks'.format(node))
+                return False
+            if not Verification.verify_chain([suffix[-1] if suffix else previous_block] + page, self.get_hash,
+                                             get_ancestor=get_ancestor):
+                print('Node {} chain is invalid'.format(node))
+                return False
+            suffix.extend(page)
+            return True
+        page = []
+        blocks = self.__broadcaster.fetch_blocks(node, '/chain?start={}&end={}'.format(fork_height, node_chain_len))
+        try:
+            for block in blocks:
+                try:
+                    block = Block.from_dict(block)
+                except (KeyError, TypeError, ValueError):
+                    print('Node {} sent a malformed block'.format(node))
+                    return None
+                # Nodes that do not know start send their chain from genesis
+                if block.index < fork_height:
+                    continue
+                if block.index >= node_chain_len:
+                    break
+                page.append(block)
+                if len(page) == SYNC_BLOCKS_PAGE:
+                    if not extend(page):
+                        return None
+                    page = []
+        finally:
+            blocks.close()
+        if page and not extend(page):
+            return None
+        return fork_height, suffix
+
+    def __find_fork_height(self, chain, node, node_chain_len):
+        common_length = min(len(chain), node_chain_len)
+        window = 1
+        end = common_length
+        # A bootstrapped chain has no blocks below its base to compare
+        while end > chain.base:
+            start = max(chain.base, end - window)
+            headers = []
+            for page_start in range(start, end, SYNC_HEADERS_PAGE):
+                page = self.__broadcaster.fetch(node, '/chain/headers?start={}&end={}'.format(
+                    page_start, min(page_start + SYNC_HEADERS_PAGE, end)))
+                if not self.__valid_headers(page):
+                    print('Node {} sent malformed headers'.format(node))
+                    return None
+                headers.extend(page)
+            # Hashes commit to the previous block, so the highest matching header marks the fork
+            for header in reversed(headers):
+                height = header['index']
+                if chain.base <= height < common_length and header['hash'] == chain.get_hash(height):
+                    return height + 1
+            end = start
+            window *= 2
+        print('Node {} does not share a stored block with the local chain'.format(node))
+        return None
+
+    # Header page of a peer is a list of dicts with an int index and a str hash
+    @staticmethod
+    def __valid_headers(page):
+        if not isinstance(page, list):
+            return False
+        for header in page:
+            if not isinstance(header, dict):
+                return False
+            index = header.get('index')
+            if not isinstance(index, int) or isinstance(index, bool) or not isinstance(header.get('hash'), str):
+                return False
+        return True
 
     # Retrieves balance of sender
     '''
-        Balance: take into account coins recevied and coins sent
-        coins_sent_list: amount sent in transaction if sender is a participant in that transaction
-        coins_sent_open_list: amount sent in outstanding transaction if sender is a participant in the outstanding transaction
+        Balance: coins received minus coins sent in confirmed blocks, minus coins sent in outstanding transactions
+        __balances: confirmed balance of every participant, updated per appended block
+        __mempool: tracks amount sent in outstanding transactions per sender
+        Readers get the balance of the published state, the writer checks funds against the live state
     '''
 
     def get_balance(self, sender=None):
@@ -163,124 +456,435 @@ class Blockchain:
             participant = self.wallet
         else:
             participant = sender
-        coins_sent_list = [[tx.amount for tx in block.transactions if tx.sender == participant] for block in
-                           self.__chain]
-        coins_sent_open_list = [tx.amount for tx in self.__open_transactions if tx.sender == participant]
-        coins_sent_list.append(coins_sent_open_list)
+        return self.__state.get_balance(participant)
 
-        coins_sent = functools.reduce(lambda sum1, amt: sum1 + sum(amt) if len(amt) > 0 else sum1, coins_sent_list, 0)
+    def __get_live_balance(self, participant):
+        return self.__balances.get(participant, 0) - self.__mempool.pending_spent(participant)
 
-        coins_accept_list = [[tx.amount for tx in block.transactions if tx.recipient == self.wallet] for block in
-                             self.__chain]
-        coins_accept = functools.reduce(lambda sum1, amt: sum1 + sum(amt) if len(amt) > 0 else sum1, coins_accept_list,
-                                        0)
-        return coins_accept - coins_sent
+    # Block of the live chain at height, None if it is below the base of a bootstrapped chain
+    def __get_stored_block(self, height):
+        return self.__chain[height] if height >= self.__chain.base else None
 
-    # Function to mine blocks
-    def mine_block(self):
-        if not self.wallet:
+    # Appends block to the chain, balance index and block store
+    def __append_block(self, block):
+        self.__chain.append(block)
+        self.__apply_block_balances(block)
+        self.__address_index.add_block(block, block.hash)
+        self.__address_writer.mark_dirty()
+        if block.index % SNAPSHOT_INTERVAL == 0:
+            self.__save_snapshot(BalanceSnapshot(block.index, block.hash, self.__balances))
+
+    def __save_snapshot(self, snapshot):
+        self.__store.save_snapshot(dict(snapshot.to_dict(), digest=snapshot.digest()))
+
+    # Applies transactions of an appended block to the balance index
+    def __apply_block_balances(self, block):
+        self.__balances_changed = True
+        for tx in block.transactions:
+            self.__balances[tx.sender] = self.__balances.get(tx.sender, 0) - tx.amount
+            self.__balances[tx.recipient] = self.__balances.get(tx.recipient, 0) + tx.amount
+
+    def __revert_block_balances(self, block):
+        self.__balances_changed = True
+        for tx in block.transactions:
+            self.__balances[tx.sender] = self.__balances.get(tx.sender, 0) + tx.amount
+            self.__balances[tx.recipient] = self.__balances.get(tx.recipient, 0) - tx.amount
+
+    # Rebuilds balance index when data is loaded, from the newest snapshot on the chain or from scratch
+    def __rebuild_balances(self):
+        self.__balances = {}
+        self.__balances_changed = True
+        chain = self.__chain.snapshot()
+        start = chain.base
+        for height in self.__store.list_snapshots():
+            snapshot = self.__load_snapshot(chain, height)
+            if snapshot is not None:
+                self.__balances = dict(snapshot['balances'])
+                start = height + 1
+                break
+        else:
+            if chain.base > 0:
+                print('No balance snapshot matches the chain stored from height {}'.format(chain.base))
+        # Stream blocks from the store instead of loading them all at once
+        for height in range(start, len(chain)):
+            self.__apply_block_balances(chain[height])
+
+    # Replays the saved address index journal as far as it matches the chain and indexes the blocks after it
+    def __rebuild_address_index(self):
+        chain = self.__chain.snapshot()
+        self.__address_index = AddressIndex()
+        height = chain.base
+        try:
+            for record in AddressIndex.replay_journal(self.__store.load_address_journal()):
+                # Blocks below a bootstrapped base are not indexed
+                if record[0] < chain.base:
+                    continue
+                if record[0] != height or height >= len(chain) or chain.get_hash(height) != record[1]:
+                    break
+                self.__address_index.add_entries(*record)
+                height += 1
+        except (TypeError, ValueError, IndexError):
+            # Unreadable record, the blocks from there on are indexed from the chain
+            self.__address_index = AddressIndex()
+            height = chain.base
+        # Replayed records are saved already
+        self.__address_index.take_journal()
+        for height in range(height, len(chain)):
+            self.__address_index.add_block(chain[height], chain.get_hash(height))
+        self.__address_writer.mark_dirty()
+
+    # Confirmed transactions of address start..end-1 in chain order, pages are capped at HISTORY_PAGE
+    '''
+        Returns total number of transactions of the address and the page, every entry has height,
+        position and hash of its block, the block timestamp and the transaction
+    '''
+
+    def get_address_history(self, address, start, end):
+        chain = self.__state.chain
+        total, locations = self.__address_index.get_history(address, start, min(end, start + HISTORY_PAGE))
+        transactions = []
+        for height, position in locations:
+            entry = self.__get_location(chain, height, position)
+            # Index may already be ahead of the snapshot or on another fork
+            if entry is not None and address in (entry['transaction']['sender'], entry['transaction']['recipient']):
+                transactions.append(entry)
+        return {'address': address, 'total': total, 'transactions': transactions}
+
+    # Confirmed transaction by id with every block it is in, None if it is not confirmed
+    def get_transaction(self, tx_id):
+        chain = self.__state.chain
+        confirmations = []
+        for height, position in self.__address_index.get_locations(tx_id):
+            entry = self.__get_location(chain, height, position)
+            if entry is not None and chain[height].transactions[position].tx_id == tx_id:
+                confirmations.append(entry)
+        if not confirmations:
+            return None
+        return {
+            'tx_id': tx_id,
+            'transaction': confirmations[0]['transaction'],
+            'confirmations': [{key: value for key, value in entry.items() if key != 'transaction'}
+                              for entry in confirmations]
+        }
+
+    # Merkle proof that a confirmed transaction is in its block, None if it is not confirmed in a block with a root
+    '''
+        height: block to prove inclusion in when the transaction is confirmed more than once, the first by default
+        Light clients check it with merkle.verify_proof against the root of the block header
+    '''
+
+    def get_merkle_proof(self, tx_id, height=None):
+        chain = self.__state.chain
+        for location in self.__address_index.get_locations(tx_id):
+            if height is not None and location[0] != height:
+                continue
+            entry = self.__get_location(chain, *location)
+            if entry is None:
+                continue
+            block = chain[entry['height']]
+            tx_ids = [tx.tx_id for tx in block.transactions]
+            if block.merkle_root is None or tx_ids[entry['position']] != tx_id:
+                continue
+            return {
+                'tx_id': tx_id,
+                'height': entry['height'],
+                'position': entry['position'],
+                'block_hash': entry['block_hash'],
+                'merkle_root': block.merkle_root,
+                'proof': merkle.merkle_proof(tx_ids, entry['position'])
+            }
+        return None
+
+    # Block by hash as dict, None if it is not on the chain
+    def get_block(self, block_hash):
+        chain = self.__state.chain
+        height = self.__address_index.get_height(block_hash)
+        if height is None or not chain.base <= height < len(chain) or chain.get_hash(height) != block_hash:
+            return None
+        return chain[height].to_dict()
+
+    @staticmethod
+    def __get_location(chain, height, position):
+        if not chain.base <= height < len(chain):
+            return None
+        block = chain[height]
+        if position >= len(block.transactions):
+            return None
+        return {
+            'height': height,
+            'position': position,
+            'block_hash': chain.get_hash(height),
+            'timestamp': block.timestamp,
+            'transaction': block.transactions[position].to_ordered_dict()
+        }
+
+    # Stored snapshot at height, None if it is missing or was taken on another fork
+    def __load_snapshot(self, chain, height):
+        if not chain.base <= height < len(chain):
             return None
-        proof_number = self.proof_of_work()
-        transaction_reward = Transaction('REWARD', self.wallet, reward, '')
-        copy_open_transactions = self.__open_transactions[:]
-        for tx in copy_open_transactions:
-            # Check validity of outstanding transaction
-            if not Wallet.verify_transaction(tx):
-                print('open transactions is not valid')
+        snapshot = self.__store.load_snapshot(height)
+        if snapshot is None or snapshot['hash'] != chain.get_hash(height):
+            return None
+        return snapshot
+
+    # Summaries of the balance snapshots taken on the current chain, newest first
+    def get_snapshots(self):
+        chain = self.__state.chain
+        snapshots = []
+        for height in self.__store.list_snapshots():
+            snapshot = self.__load_snapshot(chain, height)
+            if snapshot is not None:
+                snapshots.append({'height': height, 'hash': snapshot['hash'], 'digest': snapshot['digest']})
+        return snapshots
+
+    # Balance snapshot at height with the block it was taken at, the newest one if height is None
+    def get_snapshot(self, height=None):
+        chain = self.__state.chain
+        if height is None:
+            snapshots = self.get_snapshots()
+            if not snapshots:
                 return None
-        copy_open_transactions.append(transaction_reward)
-        previous_hash = self.get_hash(self.__chain[-1])
-        block = Block(len(self.__chain), previous_hash, copy_open_transactions, proof_number)
-        # Append block in chain and clear outstanding transaction
-        self.__chain.append(block)
-        self.__open_transactions.clear()
-        self.save_data()
-        dict_block = block.__dict__.copy()
-        dict_block['transactions'] = [tx.__dict__ for tx in dict_block['transactions']]
-        # Broadcast this to other nodes in the network
-        for node in self.__nodes:
-            url = 'http://{}/broadcast-block'.format(node)
+            height = snapshots[0]['height']
+        snapshot = self.__load_snapshot(chain, height)
+        if snapshot is None:
+            return None
+        snapshot['block'] = chain[height].to_dict()
+        return snapshot
+
+    # Bootstraps a fresh node from a balance snapshot served by its peers
+    '''
+        Peers list their snapshots at /snapshots. The highest snapshot listed with the same digest by
+        SNAPSHOT_QUORUM peers is downloaded and checked against its digest, the hash and proof of the
+        block it was taken at and the coin supply. The chain then starts at that block and resolve
+        syncs only the blocks after it.
+        Balances below the snapshot are trusted to the quorum of peers, they are not replayed. With
+        fewer agreeing peers the node syncs and verifies the full chain instead, trusting a single
+        peer is an explicit choice of SNAPSHOT_QUORUM = 1.
+        Returns True if the node synced from its peers either way.
+    '''
+
+    def bootstrap(self):
+        if len(self.__state.chain) > 1:
+            print('Only a fresh node can bootstrap from a snapshot')
+            return False
+        listings = self.__broadcaster.fetch_all(self.get_nodes(), '/snapshots')
+        votes = {}
+        for node, summaries in listings.items():
             try:
-                response = requests.post(url, json={'block': dict_block})
-                if response.status_code == 400 or response.status_code == 500:
-                    print('Failed broadcast block')
-                if response.status_code == 409:
-                    self.resolve_conflicts = True
-            except requests.exceptions.ConnectionError:
+                for summary in summaries:
+                    votes.setdefault((summary['height'], summary['hash'], summary['digest']), []).append(node)
+            except (TypeError, KeyError):
+                print('Node {} sent invalid snapshot listing'.format(node))
+        for key, voters in sorted(votes.items(), key=lambda item: item[0][0], reverse=True):
+            if len(voters) < SNAPSHOT_QUORUM:
                 continue
+            for node in voters:
+                fetched = self.__fetch_snapshot(node, *key)
+                if fetched is not None:
+                    break
+            else:
+                continue
+            snapshot, block = fetched
+            with self.__write_lock:
+                if len(self.__chain) > 1:
+                    print('Chain grew while bootstrapping, snapshot not used')
+                    return False
+                self.__chain.append(block, True)
+                self.__balances = dict(snapshot.balances)
+                # History below the snapshot is not available on this node
+                self.__address_index = AddressIndex()
+                self.__address_index.add_block(block, block.hash)
+                self.__address_writer.mark_dirty()
+                self.__balances_changed = True
+                self.__save_snapshot(snapshot)
+                self.__publish_state()
+            print('Bootstrapped from snapshot at height {}'.format(snapshot.height))
+            self.resolve()
+            return True
+        print('No snapshot is served by a quorum of peers, syncing the full chain')
+        return self.resolve()
+
+    # Downloads a snapshot from node, returns it with its block or None if it does not verify
+    def __fetch_snapshot(self, node, height, block_hash, digest):
+        answer = self.__broadcaster.fetch(node, '/snapshot/{}'.format(height))
+        try:
+            snapshot = BalanceSnapshot.from_dict(answer)
+            block = Block.from_dict(answer['block'])
+        except (TypeError, KeyError, ValueError, AttributeError):
+            print('Node {} sent invalid snapshot'.format(node))
+            return None
+        if (snapshot.height != height or block.index != height or snapshot.hash != block_hash
+                or self.get_hash(block) != block_hash or snapshot.digest() != digest
+                or not Verification.valid_block_proof(block)
+                or block.merkle_root is not None and not Verification.valid_merkle_root(block, None)
+                or not snapshot.is_consistent()):
+            print('Node {} sent invalid snapshot'.format(node))
+            return None
+        return snapshot, block
+
+    # Function to mine blocks
+    def mine_block(self):
+        with self.__mining_lock:
+            block = self.__mine_block()
+        if block is None:
+            return None
+        # Announce block to other nodes in the network, delivery happens in the background
+        self.__gossip.announce(self.get_nodes(), blocks=[block], on_block_response=self.__on_block_broadcast)
+        return block
+
+    # Proof of work runs on a snapshot without the writer lock, the block is only appended if the tip is unchanged
+    def __mine_block(self):
+        wallet = self.wallet
+        if not wallet:
+            return None
+        # Snapshot outstanding transactions and tip, transactions arriving while mining wait for the next block
+        state = self.__state
+        copy_open_transactions = list(state.open_transactions)
+        # Check validity of outstanding transactions, already verified ones come from the signature cache
+        if not all(Wallet.verify_transactions(copy_open_transactions)):
+            print('open transactions is not valid')
+            return None
+        chain = state.chain
+        previous_hash = chain.get_hash(-1)
+
+        def get_block(height):
+            return chain[height] if height >= chain.base else None
+
+        bits = difficulty.next_bits(len(chain), get_block)
+        if bits is None:
+            # Retarget window is below the base of a bootstrapped chain, keep the last target
+            bits = chain[-1].bits if chain[-1].bits is not None else difficulty.INITIAL_BITS
+        # Reward is part of the Merkle root, so the proof of work also commits to the miner
+        block_transactions = copy_open_transactions + [Transaction('REWARD', wallet, reward, '')]
+        merkle_root = merkle.merkle_root([tx.tx_id for tx in block_transactions])
+        # A clock behind the blocks of peers still has to give a timestamp after their median
+        median = difficulty.median_time(len(chain), get_block)
+        timestamp = time() if median is None else max(time(), median + 0.001)
+        prefix = Verification.header_prefix(len(chain), previous_hash, merkle_root, timestamp, bits)
+        proof_number = self.proof_of_work(prefix, difficulty.bits_to_target(bits))
+        if proof_number is None:
+            return None
+        with self.__write_lock:
+            if previous_hash != self.__chain.get_hash(-1):
+                # Another block arrived while mining, this proof is stale
+                print('Chain tip changed while mining')
+                return None
+            print('Proof found at {:.0f} hashes/sec'.format(self.__miner.hash_rate))
+            block = Block(len(chain), previous_hash, block_transactions, proof_number, timestamp, bits, merkle_root)
+            # Append block in chain and clear mined outstanding transactions
+            self.__append_block(block)
+            self.__mempool.remove_confirmed(copy_open_transactions)
+            self.__publish_state()
+            self.__state_writer.mark_dirty()
         return block
 
-    # Function of POW
-    def proof_of_work(self):
-        last_block = self.__chain[-1]
-        previous_hash = self.get_hash(last_block)
-        proof_number = 0
-        while not Verification.valid_proof(self.__open_transactions, previous_hash, proof_number):
-            proof_number += 1
+    def __on_block_broadcast(self, node, response):
+        if response.status_code == 400:
+            print('Failed broadcast block to {}'.format(node))
+        if response.status_code == 409:
+            self.resolve_conflicts = True
+
+    # Function of POW, returns None if mining was cancelled
+    '''
+        prefix: part of the guess before the proof number, see Verification.header_prefix
+    '''
+
+    def proof_of_work(self, prefix, target=difficulty.LEGACY_TARGET):
+        with metrics.PROOF_OF_WORK_SECONDS.time():
+            proof_number = self.__miner.mine(prefix, target)
+        metrics.HASHES.inc(self.__miner.hashes)
+        metrics.HASH_RATE.set(self.__miner.hash_rate)
         return proof_number
 
-    def get_hash(self, block):
-        hashed_block = block.__dict__.copy()
-        hashed_block['transactions'] = [tx.to_ordered_dict() for tx in hashed_block['transactions']]
-        return hashlib.sha256(json.dumps(hashed_block, sort_keys=True).encode()).hexdigest()
+    # Stops a running proof of work, e.g. when a competing block arrives
+    def cancel_mining(self):
+        self.__miner.cancel()
+
+    @staticmethod
+    def get_hash(block):
+        return block.hash
+
+    # Saves outstanding transactions and peer nodes now, blocks are persisted as they are appended
+    '''
+        Changes are otherwise saved by the state writer in the background, call this on shutdown.
+    '''
 
-    # Saves data in blockchain-host.txt if validity check is passed
     def save_data(self):
-        with open('blockchain-{}.txt'.format(self.node_id), mode='w') as file:
-            # pickle realization
-            # save_data = {
-            #     'blockchain': blockchain,
-            #     'open_transactions': open_transactions
-            # }
-            # file.write(pickle.dumps(save_data))
-
-            # json realization
-
-            dict_blockchain = [block.__dict__ for block in [
-                Block(block_el.index, block_el.previous_hash, [tx.__dict__ for tx in block_el.transactions],
-                      block_el.proof_number, block_el.timestamp) for block_el in self.__chain.copy()]]
-            file.write(json.dumps(dict_blockchain))
-            file.write('\n')
-            savable_transactions = [tx.__dict__ for tx in self.__open_transactions]
-            file.write(json.dumps(savable_transactions))
-            file.write('\n')
-            file.write(json.dumps(list(self.__nodes)))
+        self.__state_writer.save()
+        self.__address_writer.flush()
+
+    # Writes the published state, it is immutable so no lock is held while writing
+    def __save_state(self):
+        state = self.__state
+        self.__store.save_state([tx.to_ordered_dict() for tx in state.open_transactions], list(state.nodes))
+
+    # Appends the address index changes since the last save to its journal
+    '''
+        Runs on the address writer thread, so the writer lock is not held while writing. The journal
+        is rewritten from the whole index once forks made it much longer than the chain.
+    '''
+
+    def __save_address_index(self):
+        address_index = self.__address_index
+        chain = self.__state.chain
+        records = address_index.take_journal()
+        if self.__store.address_journal_records + len(records) > 2 * (len(chain) - chain.base) + CHECKPOINT_INTERVAL:
+            self.__store.rewrite_address_journal(address_index.take_journal(True))
+        elif records:
+            self.__store.append_address_journal(records)
 
     # Function to load blockchain
     def load_data(self):
+        with self.__write_lock:
+            self.__load_data()
+            self.__publish_state()
+
+    def __load_data(self):
+        self.__store.load()
+        if len(self.__store) == 0:
+            self.__import_legacy_data()
+        if len(self.__store) == 0:
+            # Fresh node, persist the genesis block
+            self.__chain.append(self.__genesis_block)
+            self.__store.sync()
+        open_transactions, nodes = self.__store.load_state()
+        self.__mempool = Mempool()
+        for tx in open_transactions:
+            self.__mempool.add(Transaction(tx['sender'], tx['recipient'], tx['amount'], tx['signature']))
+        self.__nodes = set(nodes)
+        self.__rebuild_balances()
+        self.__rebuild_address_index()
+        # Outstanding transactions are known, peers announcing them are not asked for them
+        for tx in self.__mempool:
+            self.__gossip.seen.add(tx.tx_id)
+
+    # Moves data saved by the old blockchain-host.txt format into the block store
+    def __import_legacy_data(self):
+        legacy_state = self.__store.load_legacy_state()
+        if legacy_state is None:
+            return
+        open_transactions, nodes = legacy_state
+        imported = 0
         try:
-            with open('blockchain-{}.txt'.format(self.node_id), mode='r') as file:
-                # pickle realization
-                # file_content = pickle.loads(file.read())
-                # blockchain = file_content['blockchain']
-                # open_transactions = file_content['open_transactions']
-
-                # json realization
-                line = file.readlines()
-                updated_blockchain = []
-                blockchain = json.loads(line[0][:-1])
-                for block in blockchain:
-                    transactions = [Transaction(tx['sender'], tx['recipient'], tx['amount'], tx['signature']) for tx in
-                                    block['transactions']]
-                    updated_block = Block(block['index'], block['previous_hash'], transactions, block['proof_number'],
-                                          block['timestamp'])
-                    updated_blockchain.append(updated_block)
-                self.__chain = updated_blockchain
-
-                json_transactions = json.loads(line[1][:-1])
-                updated_transactions = [Transaction(tx['sender'], tx['recipient'], tx['amount'], tx['signature']) for tx
-                                        in
-                                        json_transactions]
-                self.__open_transactions = updated_transactions
-                self.__nodes = set(json.loads(line[2]))
-
-        except (IOError, IndexError):
-            print("Error load file")
+            for block in self.__store.iter_legacy_blocks():
+                self.__store.append(block, self.get_hash(Block.from_dict(block)))
+                imported += 1
+        except (IOError, ValueError):
+            # A broken file is not imported at all, as when it was read at once
+            self.__store.truncate(0)
+            return
+        self.__store.checkpoint()
+        self.__store.save_state(open_transactions, nodes)
+        print('Imported {} blocks from {}'.format(imported, self.__store.legacy_file))
 
     def add_node(self, node):
-        self.__nodes.add(node)
-        self.save_data()
+        with self.__write_lock:
+            self.__nodes.add(node)
+            self.__publish_state()
+            self.__state_writer.mark_dirty()
 
     def remove_node(self, node):
-        self.__nodes.discard(node)
-        self.save_data()
+        with self.__write_lock:
+            self.__nodes.discard(node)
+            self.__publish_state()
+            self.__state_writer.mark_dirty()
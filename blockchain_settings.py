@@ -1,5 +1,122 @@
-# Proof of Work Difficulty
+import os
+
+# Proof of Work Difficulty: leading zero hex characters of blocks without a stored target,
+# also the initial and easiest target of blocks with one
 POW_DIFFICULTY = 2
 
+# Difficulty: seconds between blocks retargeting aims for, 0 keeps the initial target
+TARGET_BLOCK_TIME = 10
+
+# Difficulty: blocks between retargets and the largest factor the target changes by at once
+RETARGET_INTERVAL = 10
+RETARGET_CLAMP = 4
+
+# Timestamps: a block must be later than the median timestamp of this many blocks below it
+MEDIAN_TIME_BLOCKS = 11
+
+# Timestamps: seconds a block may be ahead of the local clock
+MAX_FUTURE_DRIFT = 120
+
 # Mining Reward
 MINING_REWARD = 1
+
+# Block store: maximum size of a log segment in bytes
+SEGMENT_SIZE = 16 * 1024 * 1024
+
+# Block store: appended blocks between fsync calls
+FSYNC_EVERY = 8
+
+# Block store: appended blocks between offset index checkpoints
+CHECKPOINT_INTERVAL = 256
+
+# Block store: seconds mempool and peer changes are collected before state.json is saved
+STATE_SAVE_DELAY = 1
+
+# Mining: worker processes searching nonces, 1 mines in the calling process
+MINING_WORKERS = os.cpu_count() or 1
+
+# Mining: nonces a worker tries between checks for cancellation
+MINING_BATCH_SIZE = 1000
+
+# Signature verification: parsed sender public keys kept in memory
+PUBLIC_KEY_CACHE_SIZE = 1024
+
+# Signature verification: remembered results by transaction id
+SIGNATURE_CACHE_SIZE = 100000
+
+# Signature verification: batches at least this large are verified on the process pool
+PARALLEL_VERIFY_THRESHOLD = 64
+
+# Worker processes for parallel verification
+VERIFY_WORKERS = os.cpu_count() or 1
+
+# Broadcast: threads delivering messages to peers
+BROADCAST_WORKERS = 16
+
+# Broadcast: seconds to wait for a peer to answer
+BROADCAST_TIMEOUT = 3
+
+# Broadcast: delivery attempts after the first one fails, delay doubles every attempt
+BROADCAST_RETRIES = 3
+BROADCAST_BACKOFF = 0.5
+
+# Chain sync: maximum headers and blocks served or requested per page
+SYNC_HEADERS_PAGE = 2000
+SYNC_BLOCKS_PAGE = 100
+
+# Mempool: maximum outstanding transactions, the oldest are evicted first
+MEMPOOL_MAX_SIZE = 10000
+
+# Chain view: decoded blocks kept in memory, least recently used are dropped
+BLOCK_CACHE_SIZE = 512
+
+# Block store record format for new blocks: 'binary' or 'json', both are always readable
+STORE_FORMAT = 'binary'
+
+# Mining scheduler: attempts per job when mining is interrupted, e.g. by a new tip
+MINING_RESTARTS = 5
+
+# Mining scheduler: finished jobs kept for status queries
+MINING_JOBS_KEPT = 100
+
+# Async node: threads running blocking Blockchain calls, signing and encoding off the event loop
+ASYNC_EXECUTOR_WORKERS = 16
+
+# Async node: open connections to peers at once
+ASYNC_PEER_CONNECTIONS = 100
+
+# Batch submission: maximum transactions accepted in one request
+TRANSACTION_BATCH_MAX = 1000
+
+# Gossip: peers every new transaction or block is announced to, 0 announces to every peer
+GOSSIP_FANOUT = 8
+
+# Gossip: transaction and block ids remembered to suppress fetching and relaying them twice
+GOSSIP_SEEN_SIZE = 100000
+
+# Gossip: seconds a requested transaction or block may take to arrive before the next announcer is asked
+GOSSIP_FETCH_TIMEOUT = 10
+
+# Balance snapshots: blocks between snapshots, how many are kept and decimals balances are rounded to
+SNAPSHOT_INTERVAL = 1000
+SNAPSHOTS_KEPT = 2
+SNAPSHOT_PRECISION = 8
+
+# Balance snapshots: peers that must serve the same snapshot before a fresh node bootstraps from it,
+# with fewer the full chain is synced, 1 trusts a single peer
+SNAPSHOT_QUORUM = 2
+
+# Address history: most transactions returned per page
+HISTORY_PAGE = 100
+
+# Wallet: RSA keys generated ahead in the background so creating a wallet does not wait
+KEY_POOL_SIZE = 2
+
+# Wallet: signing batches at least this large are spread over the verification processes
+PARALLEL_SIGN_THRESHOLD = 200
+
+# Chain streaming: bytes read at once from a peer answer or a legacy chain file
+STREAM_CHUNK_SIZE = 64 * 1024
+
+# Chain streaming: chunks read from a peer ahead of the thread decoding them on the async node
+STREAM_QUEUE_SIZE = 16
@@ -0,0 +1,178 @@
+import heapq
+import threading
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from time import time
+
+import requests
+
+import chain_stream
+import codec
+import metrics
+from blockchain_settings import BROADCAST_WORKERS, BROADCAST_TIMEOUT, BROADCAST_RETRIES, BROADCAST_BACKOFF, \
+    STREAM_CHUNK_SIZE
+
+
+# Delivers messages to peer nodes concurrently
+'''
+    Every peer gets its own keep-alive session and an outbox delivered in order, so blocks mined
+    one after another reach a peer in sequence. Outboxes of different peers are drained
+    concurrently on a thread pool and callers return immediately; failed deliveries go to a
+    retry queue and are attempted again with exponential backoff until BROADCAST_RETRIES is
+    exhausted.
+    Peers advertising the binary codec in their Accept-Post header get binary payloads,
+    binary answers are requested wherever the caller can decode them.
+'''
+
+
+class Broadcaster:
+    def __init__(self):
+        self.__sessions = {}
+        self.__sessions_lock = threading.Lock()
+        # Peers known to accept binary codec payloads
+        self.__binary_peers = set()
+        # Pending deliveries by peer, a peer is in __draining while a pool thread delivers its outbox
+        self.__outboxes = {}
+        self.__draining = set()
+        self.__outboxes_lock = threading.Lock()
+        self.__executor = ThreadPoolExecutor(max_workers=BROADCAST_WORKERS)
+        # Retry queue ordered by due time: (due, sequence, delivery)
+        self.__retries = []
+        self.__retries_condition = threading.Condition()
+        self.__sequence = 0
+        threading.Thread(target=self.__run_retries, daemon=True).start()
+
+    def __session(self, node):
+        with self.__sessions_lock:
+            session = self.__sessions.get(node)
+            if session is None:
+                session = requests.Session()
+                self.__sessions[node] = session
+            return session
+
+    def __learn_formats(self, node, response):
+        if codec.MIMETYPE in response.headers.get('Accept-Post', ''):
+            self.__binary_peers.add(node)
+
+    # Posts payload to path on every node without waiting for answers
+    '''
+        on_response: called with node and response once a node answers
+        binary_payload: same message in the binary codec format, sent to peers supporting it
+    '''
+
+    def broadcast(self, nodes, path, payload, on_response=None, binary_payload=None):
+        for node in nodes:
+            self.__enqueue((node, path, payload, binary_payload, on_response, 0))
+
+    def __enqueue(self, delivery):
+        node = delivery[0]
+        with self.__outboxes_lock:
+            self.__outboxes.setdefault(node, deque()).append(delivery)
+            if node in self.__draining:
+                return
+            self.__draining.add(node)
+        self.__executor.submit(self.__drain, node)
+
+    def __drain(self, node):
+        while True:
+            with self.__outboxes_lock:
+                outbox = self.__outboxes[node]
+                if not outbox:
+                    self.__draining.discard(node)
+                    del self.__outboxes[node]
+                    return
+                delivery = outbox.popleft()
+            self.__deliver(delivery)
+
+    def __deliver(self, delivery):
+        node, path, payload, binary_payload, on_response, attempt = delivery
+        url = 'http://{}{}'.format(node, path)
+        started = time()
+        try:
+            if binary_payload is not None and node in self.__binary_peers:
+                response = self.__session(node).post(url, data=binary_payload, timeout=BROADCAST_TIMEOUT,
+                                                     headers={'Content-Type': codec.MIMETYPE})
+            else:
+                response = self.__session(node).post(url, json=payload, timeout=BROADCAST_TIMEOUT)
+        except requests.exceptions.RequestException:
+            metrics.BROADCAST_FAILURES.inc(peer=node, path=path)
+            self.__schedule_retry(delivery)
+            return
+        metrics.BROADCAST_SECONDS.observe(time() - started, peer=node, path=path)
+        metrics.BROADCAST_BYTES.inc(len(response.request.body or b''), peer=node, path=path)
+        self.__learn_formats(node, response)
+        if response.status_code >= 500:
+            metrics.BROADCAST_FAILURES.inc(peer=node, path=path)
+            self.__schedule_retry(delivery)
+            return
+        if on_response is not None:
+            on_response(node, response)
+
+    def __schedule_retry(self, delivery):
+        node, path, payload, binary_payload, on_response, attempt = delivery
+        if attempt >= BROADCAST_RETRIES:
+            print('Failed to deliver {} to {}'.format(path, node))
+            return
+        due = time() + BROADCAST_BACKOFF * 2 ** attempt
+        with self.__retries_condition:
+            self.__sequence += 1
+            heapq.heappush(self.__retries, (due, self.__sequence, (node, path, payload, binary_payload, on_response, attempt + 1)))
+            self.__retries_condition.notify()
+
+    def __run_retries(self):
+        while True:
+            with self.__retries_condition:
+                while not self.__retries or self.__retries[0][0] > time():
+                    timeout = self.__retries[0][0] - time() if self.__retries else None
+                    self.__retries_condition.wait(timeout)
+                _, _, delivery = heapq.heappop(self.__retries)
+            self.__enqueue(delivery)
+
+    # Gets path from every node concurrently, returns decoded json answers by node
+    def fetch_all(self, nodes, path):
+        futures = {node: self.__executor.submit(self.fetch, node, path) for node in nodes}
+        results = {}
+        for node, future in futures.items():
+            result = future.result()
+            if result is not None:
+                results[node] = result
+        return results
+
+    # Gets path from node, decode_binary is used when the node answers in the binary codec format
+    def fetch(self, node, path, decode_binary=None):
+        url = 'http://{}{}'.format(node, path)
+        headers = {}
+        if decode_binary is not None:
+            headers['Accept'] = '{}, application/json;q=0.5'.format(codec.MIMETYPE)
+        try:
+            response = self.__session(node).get(url, headers=headers, timeout=BROADCAST_TIMEOUT)
+            self.__learn_formats(node, response)
+            if decode_binary is not None and response.headers.get('Content-Type', '').startswith(codec.MIMETYPE):
+                return decode_binary(response.content)
+            return response.json()
+        except (requests.exceptions.RequestException, ValueError):
+            return None
+
+    # Gets blocks from path on node, yields them one at a time as the answer arrives
+    '''
+        The node may answer in the binary codec format, as ndjson or as a json array, blocks are
+        decoded while the answer is read so only the current one is held in memory. Stops early if
+        the node fails to answer or sends malformed data.
+    '''
+
+    def fetch_blocks(self, node, path):
+        url = 'http://{}{}'.format(node, path)
+        headers = {'Accept': '{}, {};q=0.8, application/json;q=0.5'.format(
+            codec.MIMETYPE, chain_stream.NDJSON_MIMETYPE)}
+        try:
+            with self.__session(node).get(url, headers=headers, timeout=BROADCAST_TIMEOUT, stream=True) as response:
+                self.__learn_formats(node, response)
+                if response.status_code >= 400:
+                    return
+                chunks = response.iter_content(STREAM_CHUNK_SIZE)
+                yield from chain_stream.decode_blocks(response.headers.get('Content-Type', ''), chunks)
+                # Read to the end of the answer so the connection is kept for reuse
+                for _ in chunks:
+                    pass
+        except (requests.exceptions.RequestException, ValueError):
+            print('Failed to fetch {} from {}'.format(path, node))
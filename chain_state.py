@@ -0,0 +1,28 @@
+# Consistent view of the node state published by the writer after every change
+'''
+    chain: ChainSnapshot of the blocks
+    balances: confirmed balance per address
+    pending_spent: amount every sender spends in outstanding transactions, read with get
+    open_transactions: MempoolSnapshot of the outstanding transactions in order of arrival
+    nodes: peer nodes
+    A state is never modified after it is published, readers use it without locking. The writer
+    builds a new state and replaces the reference, which is atomic.
+'''
+
+
+class ChainState:
+    __slots__ = ('chain', 'balances', 'pending_spent', 'open_transactions', 'nodes')
+
+    def __init__(self, chain, balances, pending_spent, open_transactions, nodes):
+        set_field = super().__setattr__
+        set_field('chain', chain)
+        set_field('balances', balances)
+        set_field('pending_spent', pending_spent)
+        set_field('open_transactions', open_transactions)
+        set_field('nodes', nodes)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('ChainState is immutable')
+
+    def get_balance(self, address):
+        return self.balances.get(address, 0) - self.pending_spent.get(address, 0)
@@ -0,0 +1,121 @@
+import codecs
+import json
+
+import codec
+
+# Streaming encoders and decoders for lists of blocks
+'''
+    Blocks are written and read one at a time so serving, downloading or importing a chain only
+    holds the block being encoded or decoded, never the whole chain.
+    Formats:
+        application/json:      a json array, the same bytes a client reading the whole answer expects
+        application/x-ndjson:  one json block per line
+        codec.MIMETYPE:        the framing of codec.encode_blocks
+    Encoders yield bytes, decoders take an iterable of byte chunks split anywhere.
+'''
+
+JSON_MIMETYPE = 'application/json'
+NDJSON_MIMETYPE = 'application/x-ndjson'
+
+# Formats a chain can be streamed in, the first one is the default
+MIMETYPES = [JSON_MIMETYPE, NDJSON_MIMETYPE, codec.MIMETYPE]
+
+
+def iter_encode_array(items):
+    yield b'['
+    for position, item in enumerate(items):
+        yield (b',' if position else b'') + json.dumps(item).encode()
+    yield b']'
+
+
+def iter_encode_ndjson(items):
+    for item in items:
+        yield json.dumps(item).encode() + b'\n'
+
+
+def _iter_text(chunks):
+    decoder = codecs.getincrementaldecoder('utf-8')()
+    for chunk in chunks:
+        yield chunk if isinstance(chunk, str) else decoder.decode(chunk)
+    yield decoder.decode(b'', final=True)
+
+
+# Yields the items of a json array as they complete, anything after the closing bracket is not read
+def iter_decode_array(chunks):
+    decoder = json.JSONDecoder()
+    text = _iter_text(chunks)
+    buffer = ''
+    position = 0
+    ended = False
+    # What may come next: '[' before the array, ']' or an item after it opens, ',' or ']' after an item
+    expected = '['
+
+    # Drops the consumed text and reads the next chunk, False at the end of the data
+    def fill():
+        nonlocal buffer, position, ended
+        chunk = next(text, None)
+        if chunk is None:
+            ended = True
+            return False
+        buffer = buffer[position:] + chunk
+        position = 0
+        return True
+
+    while True:
+        while position < len(buffer) and buffer[position].isspace():
+            position += 1
+        if position == len(buffer):
+            if not fill():
+                raise ValueError('Unexpected end of json array')
+            continue
+        character = buffer[position]
+        if expected in ('[', ',') or character == ']':
+            if character == ']' and expected in (']', ','):
+                return
+            if character != expected:
+                raise ValueError('Expected {!r} at {!r}'.format(expected, character))
+            position += 1
+            expected = 'item' if expected == ',' else ']'
+            continue
+        try:
+            item, end = decoder.raw_decode(buffer, position)
+        except ValueError:
+            if ended or not fill():
+                raise
+            continue
+        # A number at the end of the buffer may continue in the next chunk
+        if end == len(buffer) and not ended and fill():
+            continue
+        position = end
+        expected = ','
+        yield item
+
+
+def iter_decode_ndjson(chunks):
+    buffer = ''
+    for text in _iter_text(chunks):
+        lines = (buffer + text).split('\n')
+        buffer = lines.pop()
+        for line in lines:
+            if line.strip():
+                yield json.loads(line)
+    if buffer.strip():
+        yield json.loads(buffer)
+
+
+# Encodes count blocks in mimetype, one chunk per block
+def encode_blocks(mimetype, count, blocks):
+    if mimetype == codec.MIMETYPE:
+        return codec.iter_encode_blocks(blocks, count)
+    if mimetype == NDJSON_MIMETYPE:
+        return iter_encode_ndjson(blocks)
+    return iter_encode_array(blocks)
+
+
+# Decodes blocks from chunks of an answer with content_type, raises ValueError on malformed data
+def decode_blocks(content_type, chunks):
+    if content_type.startswith(codec.MIMETYPE):
+        return codec.iter_decode_blocks(chunks)
+    if content_type.startswith(NDJSON_MIMETYPE):
+        return iter_decode_ndjson(chunks)
+    return iter_decode_array(chunks)
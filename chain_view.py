@@ -0,0 +1,145 @@
+import threading
+from collections import OrderedDict
+
+from block import Block
+from blockchain_settings import BLOCK_CACHE_SIZE
+
+
+# Recently used decoded blocks, keyed by block hash and shared by every view of a store
+class BlockCache:
+    def __init__(self, size=BLOCK_CACHE_SIZE):
+        self.size = size
+        self.__blocks = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def get(self, block_hash):
+        with self.__lock:
+            block = self.__blocks.get(block_hash)
+            if block is not None:
+                self.__blocks.move_to_end(block_hash)
+            return block
+
+    def put(self, block_hash, block):
+        with self.__lock:
+            self.__blocks[block_hash] = block
+            self.__blocks.move_to_end(block_hash)
+            while len(self.__blocks) > self.size:
+                self.__blocks.popitem(last=False)
+
+
+# Read-only list-like chain as it was when the snapshot was taken
+'''
+    Holds the offset index of the store and the length it had. The writer never changes entries
+    below that length, so the snapshot can be read from any thread without locking while blocks
+    are appended or the chain switches to another fork.
+    On a pruned chain heights below base raise IndexError, iterating and slicing skip them.
+'''
+
+
+class ChainSnapshot:
+    def __init__(self, store, cache, index, base, length):
+        self.__store = store
+        self.__cache = cache
+        self.__index = index
+        self.base = base
+        self.__length = length
+
+    def __len__(self):
+        return self.__length
+
+    def __getitem__(self, item):
+        if isinstance(item, slice):
+            return [self.__load(height) for height in range(*item.indices(self.__length)) if height >= self.base]
+        return self.__load(self.__height(item))
+
+    def __iter__(self):
+        for height in range(self.base, self.__length):
+            yield self.__load(height)
+
+    def __height(self, height):
+        if height < 0:
+            height += self.__length
+        if not 0 <= height < self.__length:
+            raise IndexError('block index out of range')
+        if height < self.base:
+            raise IndexError('block {} is pruned'.format(height))
+        return height
+
+    def __load(self, height):
+        entry = self.__index[height - self.base]
+        block = self.__cache.get(entry[3])
+        if block is None:
+            block = Block.from_dict(self.__store.read_entry(entry))
+            self.__cache.put(entry[3], block)
+        return block
+
+    # Hash of block at height, read from the offset index
+    def get_hash(self, height=-1):
+        return self.__index[self.__height(height) - self.base][3]
+
+    # Headers of blocks start..end-1 as dicts, Block.header() of cached blocks
+    '''
+        Blocks that are not cached are not decoded, only their header is read from the store and
+        they are not put in the cache, so serving headers to peers does not evict recent blocks.
+    '''
+
+    def headers(self, start, end):
+        headers = []
+        for height in range(max(start, self.base), min(end, self.__length)):
+            entry = self.__index[height - self.base]
+            block = self.__cache.get(entry[3])
+            headers.append(block.header() if block is not None else self.__store.read_header_entry(entry))
+        return headers
+
+
+# List-like view of the chain backed by the block store
+'''
+    Only the offset index (with block hashes) is held in memory. Block bodies are read from the
+    memory-mapped segments when accessed and the most recently used ones are kept decoded.
+    Length, tip hash and hash lookups never touch block bodies. Reads go through a snapshot of
+    the current chain, append and truncate are only called by the writer.
+'''
+
+
+class ChainView:
+    def __init__(self, store, cache_size=BLOCK_CACHE_SIZE):
+        self.__store = store
+        self.__cache = BlockCache(cache_size)
+
+    def __len__(self):
+        return len(self.__store)
+
+    # Height of the first stored block, above 0 on a node bootstrapped from a balance snapshot
+    @property
+    def base(self):
+        return self.__store.base
+
+    def __getitem__(self, item):
+        return self.snapshot()[item]
+
+    def __iter__(self):
+        return iter(self.snapshot())
+
+    def snapshot(self):
+        index, base, length = self.__store.index_snapshot()
+        return ChainSnapshot(self.__store, self.__cache, index, base, length)
+
+    # Hash of block at height, read from the offset index
+    def get_hash(self, height=-1):
+        if height < 0:
+            height += len(self)
+        return self.__store.get_hash(height)
+
+    # Persists block at height block.index, replacing that height and everything above
+    '''
+        rebase: block may lie past the tip, the chain then starts at that block
+    '''
+
+    def append(self, block, rebase=False):
+        self.__store.append(block.to_dict(), block.hash, rebase)
+        self.__cache.put(block.hash, block)
+
+    # Drops blocks from given height onwards
+    def truncate(self, height):
+        if height < len(self):
+            self.__store.truncate(height)
@@ -0,0 +1,376 @@
+import struct
+
+# Compact binary encoding of blocks and transactions
+'''
+    Layout, all integers are varints:
+        block:        version, flags, index, previous_hash, proof_number, timestamp, [bits],
+                      [merkle_root], [address table], [hash], transaction count, transactions
+        transaction:  sender, recipient, amount, signature
+        transactions: version, flags, [address table], transaction count, transactions
+    Hex strings (keys, signatures, hashes) are stored as raw bytes, anything else as utf8.
+    With the address table flag every distinct sender/recipient of the block is stored once
+    and transactions refer to it by position. Canonical hashing still uses the json form,
+    the binary form only has to decode back to exactly the same values.
+'''
+
+FORMAT_VERSION = 1
+MIMETYPE = 'application/x-mythcoin'
+
+FLAG_ADDRESS_TABLE = 0x01
+FLAG_HASH = 0x02
+FLAG_BITS = 0x04
+FLAG_MERKLE_ROOT = 0x08
+
+# Field tags
+TEXT_HEX = 0
+TEXT_UTF8 = 1
+NUMBER_INT = 0
+NUMBER_FLOAT = 1
+
+FLOAT = struct.Struct('>d')
+
+
+class CodecError(ValueError):
+    pass
+
+
+def _write_varint(out, value):
+    if not isinstance(value, int) or isinstance(value, bool) or value < 0:
+        raise CodecError('Varint must be a non-negative int, got {!r}'.format(value))
+    while True:
+        byte = value & 0x7f
+        value >>= 7
+        if value:
+            out.append(byte | 0x80)
+        else:
+            out.append(byte)
+            return
+
+
+def _read_varint(data, position):
+    value = 0
+    shift = 0
+    while True:
+        if position >= len(data):
+            raise CodecError('Truncated varint')
+        byte = data[position]
+        position += 1
+        value |= (byte & 0x7f) << shift
+        if not byte & 0x80:
+            return value, position
+        shift += 7
+
+
+def _write_number(out, value):
+    # A bool would decode as 1.0 or 0.0 and change the hash of what contains it
+    if not isinstance(value, (int, float)) or isinstance(value, bool):
+        raise CodecError('Number must be an int or float, got {!r}'.format(value))
+    if isinstance(value, int):
+        out.append(NUMBER_INT)
+        # Zigzag so negative numbers stay short
+        _write_varint(out, value * 2 if value >= 0 else -value * 2 - 1)
+    else:
+        out.append(NUMBER_FLOAT)
+        out += FLOAT.pack(value)
+
+
+def _read_number(data, position):
+    tag = data[position]
+    position += 1
+    if tag == NUMBER_INT:
+        value, position = _read_varint(data, position)
+        return (value >> 1 if not value & 1 else -((value + 1) >> 1)), position
+    if tag == NUMBER_FLOAT:
+        return FLOAT.unpack_from(data, position)[0], position + FLOAT.size
+    raise CodecError('Unknown number tag {}'.format(tag))
+
+
+def _write_text(out, value):
+    if not isinstance(value, str):
+        raise CodecError('Text must be a str, got {!r}'.format(value))
+    try:
+        raw = bytes.fromhex(value)
+        # Only lowercase, even length hex decodes back to the same string
+        hex_encoded = raw.hex() == value
+    except ValueError:
+        hex_encoded = False
+    if hex_encoded:
+        out.append(TEXT_HEX)
+    else:
+        out.append(TEXT_UTF8)
+        raw = value.encode()
+    _write_varint(out, len(raw))
+    out += raw
+
+
+def _read_text(data, position):
+    tag = data[position]
+    length, position = _read_varint(data, position + 1)
+    raw = bytes(data[position:position + length])
+    if len(raw) < length:
+        raise CodecError('Truncated text')
+    position += length
+    if tag == TEXT_HEX:
+        return raw.hex(), position
+    if tag == TEXT_UTF8:
+        return raw.decode(), position
+    raise CodecError('Unknown text tag {}'.format(tag))
+
+
+def _write_transaction(out, tx, addresses=None):
+    for field in ('sender', 'recipient'):
+        if addresses is None:
+            _write_text(out, tx[field])
+        else:
+            _write_varint(out, addresses[tx[field]])
+    _write_number(out, tx['amount'])
+    _write_text(out, tx['signature'])
+
+
+def _read_transaction(data, position, addresses=None):
+    tx = {}
+    for field in ('sender', 'recipient'):
+        if addresses is None:
+            tx[field], position = _read_text(data, position)
+        else:
+            address, position = _read_varint(data, position)
+            tx[field] = addresses[address]
+    tx['amount'], position = _read_number(data, position)
+    tx['signature'], position = _read_text(data, position)
+    return tx, position
+
+
+# Checks version byte, returns position after it
+def _read_version(data):
+    if not data:
+        raise CodecError('Empty data')
+    if data[0] != FORMAT_VERSION:
+        raise CodecError('Unsupported format version {}'.format(data[0]))
+    return 1
+
+
+def _write_address_table(out, transactions):
+    addresses = {}
+    for tx in transactions:
+        for field in ('sender', 'recipient'):
+            addresses.setdefault(tx[field], len(addresses))
+    _write_varint(out, len(addresses))
+    for address in addresses:
+        _write_text(out, address)
+    return addresses
+
+
+def _read_address_table(data, position):
+    count, position = _read_varint(data, position)
+    addresses = []
+    for _ in range(count):
+        address, position = _read_text(data, position)
+        addresses.append(address)
+    return addresses, position
+
+
+def _write_block(out, block, address_table=True):
+    flags = ((FLAG_ADDRESS_TABLE if address_table else 0) | (FLAG_HASH if 'hash' in block else 0)
+             | (FLAG_BITS if 'bits' in block else 0) | (FLAG_MERKLE_ROOT if 'merkle_root' in block else 0))
+    out.append(flags)
+    _write_varint(out, block['index'])
+    _write_text(out, block['previous_hash'])
+    _write_varint(out, block['proof_number'])
+    _write_number(out, block['timestamp'])
+    if 'bits' in block:
+        _write_varint(out, block['bits'])
+    if 'merkle_root' in block:
+        _write_text(out, block['merkle_root'])
+    addresses = _write_address_table(out, block['transactions']) if address_table else None
+    if 'hash' in block:
+        _write_text(out, block['hash'])
+    _write_varint(out, len(block['transactions']))
+    for tx in block['transactions']:
+        _write_transaction(out, tx, addresses)
+
+
+# Reads the fields before the address table, returns them with the flags and the position after them
+def _read_header(data, position):
+    flags = data[position]
+    block = {}
+    block['index'], position = _read_varint(data, position + 1)
+    block['previous_hash'], position = _read_text(data, position)
+    block['proof_number'], position = _read_varint(data, position)
+    block['timestamp'], position = _read_number(data, position)
+    if flags & FLAG_BITS:
+        block['bits'], position = _read_varint(data, position)
+    if flags & FLAG_MERKLE_ROOT:
+        block['merkle_root'], position = _read_text(data, position)
+    return block, flags, position
+
+
+def _read_block(data, position):
+    block, flags, position = _read_header(data, position)
+    addresses = None
+    if flags & FLAG_ADDRESS_TABLE:
+        addresses, position = _read_address_table(data, position)
+    if flags & FLAG_HASH:
+        block['hash'], position = _read_text(data, position)
+    count, position = _read_varint(data, position)
+    transactions = []
+    for _ in range(count):
+        tx, position = _read_transaction(data, position, addresses)
+        transactions.append(tx)
+    block['transactions'] = transactions
+    return block, position
+
+
+# Encodes block dict, an optional 'hash' key is kept
+def encode_block(block, address_table=True):
+    out = bytearray([FORMAT_VERSION])
+    _write_block(out, block, address_table)
+    return bytes(out)
+
+
+def decode_block(data):
+    position = _read_version(data)
+    try:
+        block, _ = _read_block(data, position)
+    except (IndexError, struct.error) as e:
+        raise CodecError('Truncated block') from e
+    return block
+
+
+# Decodes the header fields of an encoded block without its transactions or hash
+'''
+    The header comes first in the encoding, data may be cut off anywhere after it.
+'''
+
+
+def decode_block_header(data):
+    position = _read_version(data)
+    try:
+        header, _, _ = _read_header(data, position)
+    except (IndexError, struct.error) as e:
+        raise CodecError('Truncated block header') from e
+    return header
+
+
+# Encodes list of block dicts, every block is prefixed with its length
+def encode_blocks(blocks, address_table=True):
+    out = bytearray([FORMAT_VERSION])
+    _write_varint(out, len(blocks))
+    for block in blocks:
+        encoded = bytearray()
+        _write_block(encoded, block, address_table)
+        _write_varint(out, len(encoded))
+        out += encoded
+    return bytes(out)
+
+
+def decode_blocks(data):
+    position = _read_version(data)
+    count, position = _read_varint(data, position)
+    blocks = []
+    try:
+        for _ in range(count):
+            length, position = _read_varint(data, position)
+            block, _ = _read_block(data, position)
+            blocks.append(block)
+            position += length
+    except (IndexError, struct.error) as e:
+        raise CodecError('Truncated blocks') from e
+    return blocks
+
+
+# Same bytes as encode_blocks, produced one block at a time, count is the number of blocks
+def iter_encode_blocks(blocks, count, address_table=True):
+    out = bytearray([FORMAT_VERSION])
+    _write_varint(out, count)
+    yield bytes(out)
+    for block in blocks:
+        encoded = bytearray()
+        _write_block(encoded, block, address_table)
+        out = bytearray()
+        _write_varint(out, len(encoded))
+        yield bytes(out + encoded)
+
+
+# Decodes the output of encode_blocks from an iterable of byte chunks, yields blocks as they complete
+def iter_decode_blocks(chunks):
+    chunks = iter(chunks)
+    buffer = bytearray()
+
+    # Reads the next chunk into buffer, False at the end of the data
+    def fill():
+        chunk = next(chunks, None)
+        if chunk is None:
+            return False
+        buffer.extend(chunk)
+        return True
+
+    def read_varint():
+        while True:
+            try:
+                value, position = _read_varint(buffer, 0)
+            except CodecError:
+                if not fill():
+                    raise
+                continue
+            del buffer[:position]
+            return value
+
+    while not buffer:
+        if not fill():
+            raise CodecError('Empty data')
+    del buffer[:_read_version(buffer)]
+    count = read_varint()
+    for _ in range(count):
+        length = read_varint()
+        while len(buffer) < length:
+            if not fill():
+                raise CodecError('Truncated blocks')
+        try:
+            block, _ = _read_block(buffer, 0)
+        except (IndexError, struct.error) as e:
+            raise CodecError('Truncated blocks') from e
+        del buffer[:length]
+        yield block
+
+
+def encode_transaction(tx):
+    out = bytearray([FORMAT_VERSION])
+    _write_transaction(out, tx)
+    return bytes(out)
+
+
+def decode_transaction(data):
+    position = _read_version(data)
+    try:
+        tx, _ = _read_transaction(data, position)
+    except (IndexError, struct.error) as e:
+        raise CodecError('Truncated transaction') from e
+    return tx
+
+
+# Encodes list of transaction dicts, e.g. a batch relayed to peers
+def encode_transactions(transactions, address_table=True):
+    out = bytearray([FORMAT_VERSION, FLAG_ADDRESS_TABLE if address_table else 0])
+    addresses = _write_address_table(out, transactions) if address_table else None
+    _write_varint(out, len(transactions))
+    for tx in transactions:
+        _write_transaction(out, tx, addresses)
+    return bytes(out)
+
+
+def decode_transactions(data):
+    position = _read_version(data)
+    try:
+        flags = data[position]
+        position += 1
+        addresses = None
+        if flags & FLAG_ADDRESS_TABLE:
+            addresses, position = _read_address_table(data, position)
+        count, position = _read_varint(data, position)
+        transactions = []
+        for _ in range(count):
+            tx, position = _read_transaction(data, position, addresses)
+            transactions.append(tx)
+    except (IndexError, struct.error) as e:
+        raise CodecError('Truncated transactions') from e
+    return transactions
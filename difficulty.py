@@ -0,0 +1,128 @@
+import math
+from time import time
+
+from blockchain_settings import (POW_DIFFICULTY, TARGET_BLOCK_TIME, RETARGET_INTERVAL, RETARGET_CLAMP,
+                                 MEDIAN_TIME_BLOCKS, MAX_FUTURE_DRIFT)
+
+# Proof of work targets and retargeting
+'''
+    A proof is valid if the sha256 digest of the guess, read as a big-endian integer, is at most the
+    target. Blocks store their target compactly as bits: the top byte is the length of the target
+    in bytes, the low three bytes its most significant bytes.
+    Blocks without bits were mined against POW_DIFFICULTY leading zero hex characters, which is
+    LEGACY_TARGET. The first blocks with bits start at that target. Every RETARGET_INTERVAL blocks
+    the target is scaled by the time the last interval took over the time it should have taken at
+    TARGET_BLOCK_TIME, by at most RETARGET_CLAMP and never easier than LEGACY_TARGET.
+    Retargeting trusts block timestamps, so a block must be later than the median of the
+    MEDIAN_TIME_BLOCKS blocks below it and at most MAX_FUTURE_DRIFT seconds ahead of the local clock.
+'''
+
+# Digest below 16 ** (64 - POW_DIFFICULTY) has POW_DIFFICULTY leading zero hex characters
+LEGACY_TARGET = (1 << (256 - 4 * POW_DIFFICULTY)) - 1
+
+
+def bits_to_target(bits):
+    size = bits >> 24
+    mantissa = bits & 0xffffff
+    if size <= 3:
+        return mantissa >> (8 * (3 - size))
+    return mantissa << (8 * (size - 3))
+
+
+# Compact form of target, rounded down so the target never gets easier
+def target_to_bits(target):
+    size = (target.bit_length() + 7) // 8
+    if size <= 3:
+        mantissa = target << (8 * (3 - size))
+    else:
+        mantissa = target >> (8 * (size - 3))
+    return size << 24 | mantissa
+
+
+INITIAL_BITS = target_to_bits(LEGACY_TARGET)
+MAX_TARGET = bits_to_target(INITIAL_BITS)
+
+
+# Bits a block can claim: a 32 bit compact target not easier than MAX_TARGET
+'''
+    Checked before anything computes the target, a size byte from a peer is otherwise an
+    arbitrarily large shift.
+'''
+
+
+def valid_compact(bits):
+    if not isinstance(bits, int) or isinstance(bits, bool) or not 0 <= bits <= 0xffffffff:
+        return False
+    return 0 < bits_to_target(bits) <= MAX_TARGET
+
+
+def get_target(block):
+    return LEGACY_TARGET if block.bits is None else bits_to_target(block.bits)
+
+
+# Bits of the block at height
+'''
+    get_block: called with a height below it, returns the block or None if it is not stored
+    Returns None if the retarget window is not stored, e.g. below the base of a bootstrapped chain
+'''
+
+
+def next_bits(height, get_block):
+    parent = get_block(height - 1)
+    parent_bits = INITIAL_BITS if parent.bits is None else parent.bits
+    # Genesis has no real timestamp, the first window starts after it
+    if not TARGET_BLOCK_TIME or height % RETARGET_INTERVAL != 0 or height - RETARGET_INTERVAL < 1:
+        return parent_bits
+    first = get_block(height - RETARGET_INTERVAL)
+    if first is None:
+        return None
+    # Integer milliseconds keep the result identical on every node
+    expected = TARGET_BLOCK_TIME * RETARGET_INTERVAL * 1000
+    actual = int((parent.timestamp - first.timestamp) * 1000)
+    actual = min(max(actual, expected // RETARGET_CLAMP), expected * RETARGET_CLAMP)
+    target = bits_to_target(parent_bits) * actual // expected
+    return target_to_bits(max(1, min(target, MAX_TARGET)))
+
+
+# Checks the bits of block follow from the blocks below it
+def valid_bits(block, get_block):
+    parent = get_block(block.index - 1)
+    if block.bits is None:
+        # Blocks without bits are only valid on a chain that has none yet
+        return parent.bits is None
+    if not valid_compact(block.bits):
+        return False
+    expected = next_bits(block.index, get_block)
+    if expected is not None:
+        return block.bits == expected
+    # Retarget window is not stored, accept what a retarget could have produced
+    parent_target = get_target(parent)
+    return parent_target // RETARGET_CLAMP <= bits_to_target(block.bits) <= min(parent_target * RETARGET_CLAMP,
+                                                                               MAX_TARGET)
+
+
+# Median timestamp of the MEDIAN_TIME_BLOCKS blocks below height, None if none of them is stored
+def median_time(height, get_block):
+    blocks = [get_block(below) for below in range(max(0, height - MEDIAN_TIME_BLOCKS), height)]
+    timestamps = sorted(block.timestamp for block in blocks if block is not None)
+    if not timestamps:
+        return None
+    return timestamps[len(timestamps) // 2]
+
+
+# Checks the timestamp of block is a finite number after the median time and not too far in the future
+'''
+    now: local clock, defaults to the current time
+    Blocks whose median window is not stored, e.g. above the base of a bootstrapped chain, are only
+    checked against the local clock.
+'''
+
+
+def valid_timestamp(block, get_block, now=None):
+    timestamp = block.timestamp
+    if not isinstance(timestamp, (int, float)) or isinstance(timestamp, bool) or not math.isfinite(timestamp):
+        return False
+    if timestamp > (time() if now is None else now) + MAX_FUTURE_DRIFT:
+        return False
+    median = median_time(block.index, get_block)
+    return median is None or timestamp > median
@@ -0,0 +1,161 @@
+import random
+import threading
+from collections import OrderedDict
+from time import time
+
+import codec
+from blockchain_settings import GOSSIP_FANOUT, GOSSIP_SEEN_SIZE, GOSSIP_FETCH_TIMEOUT
+
+
+# Ids of transactions and blocks this node has accepted and relayed, oldest are forgotten first
+class SeenSet:
+    def __init__(self, max_size=GOSSIP_SEEN_SIZE):
+        self.max_size = max_size
+        self.__ids = OrderedDict()
+        self.__lock = threading.Lock()
+
+    def __contains__(self, item_id):
+        with self.__lock:
+            return item_id in self.__ids
+
+    def add(self, item_id):
+        with self.__lock:
+            self.__add(item_id)
+
+    def discard(self, item_id):
+        with self.__lock:
+            self.__ids.pop(item_id, None)
+
+    def __add(self, item_id):
+        self.__ids[item_id] = None
+        self.__ids.move_to_end(item_id)
+        while len(self.__ids) > self.max_size:
+            self.__ids.popitem(last=False)
+
+
+# Ids requested from a peer that have not been accepted yet
+'''
+    A request that is not answered with an accepted item within the timeout, e.g. because the peer
+    went away or sent something invalid, expires and the next peer announcing the id is asked.
+'''
+
+
+class InFlightSet:
+    def __init__(self, timeout=GOSSIP_FETCH_TIMEOUT, max_size=GOSSIP_SEEN_SIZE):
+        self.timeout = timeout
+        self.max_size = max_size
+        # Deadline by id, in deadline order because every request gets the same timeout
+        self.__deadlines = OrderedDict()
+        self.__lock = threading.Lock()
+
+    # Marks item_id requested, returns False if an earlier request for it is still pending
+    def request(self, item_id):
+        now = time()
+        with self.__lock:
+            deadline = self.__deadlines.get(item_id)
+            if deadline is not None and deadline > now:
+                return False
+            self.__deadlines[item_id] = now + self.timeout
+            self.__deadlines.move_to_end(item_id)
+            while self.__deadlines and (len(self.__deadlines) > self.max_size
+                                        or next(iter(self.__deadlines.values())) <= now):
+                self.__deadlines.popitem(last=False)
+            return True
+
+    def discard(self, item_id):
+        with self.__lock:
+            self.__deadlines.pop(item_id, None)
+
+
+# Inventory based relay of transactions and blocks
+'''
+    Instead of pushing full payloads to every peer, a node posts the ids of new items to /inv on
+    a random subset of GOSSIP_FANOUT peers. The peer answers with the ids it does not know yet and
+    only those are sent, through /broadcast-transactions and /broadcast-block. Every node relays
+    the items it accepts the same way. Accepted items are seen and never fetched or relayed twice,
+    items requested but not accepted yet are in flight and only asked from one peer at a time.
+    Transactions leave the seen set when a block confirms them: transaction ids have no nonce, so
+    paying the same amount to the same recipient again gives the same id and must still relay.
+    inv message: {'transactions': [tx_id, ...], 'blocks': [{'hash': ..., 'index': ...}, ...]}
+'''
+
+
+class Gossip:
+    def __init__(self, broadcaster, fanout=GOSSIP_FANOUT, seen_size=GOSSIP_SEEN_SIZE):
+        self.__broadcaster = broadcaster
+        self.fanout = fanout
+        self.seen = SeenSet(seen_size)
+        self.in_flight = InFlightSet(max_size=seen_size)
+
+    # Random subset of nodes to announce to, every node if fanout is not limited
+    def pick_peers(self, nodes):
+        nodes = list(nodes)
+        if not self.fanout or len(nodes) <= self.fanout:
+            return nodes
+        return random.sample(nodes, self.fanout)
+
+    # Announces transactions and blocks this node accepted to a random subset of nodes
+    '''
+        on_block_response: called with node and response when a peer was sent a block it asked for
+    '''
+
+    def announce(self, nodes, transactions=(), blocks=(), on_block_response=None):
+        for tx in transactions:
+            self.__accept(tx.tx_id)
+        for block in blocks:
+            self.__accept(block.hash)
+        self.forget_confirmed(blocks)
+        peers = self.pick_peers(nodes)
+        if not peers or not (transactions or blocks):
+            return
+        inventory = {
+            'transactions': [tx.tx_id for tx in transactions],
+            'blocks': [{'hash': block.hash, 'index': block.index} for block in blocks]
+        }
+        self.__broadcaster.broadcast(peers, '/inv', inventory,
+                                     lambda node, response: self.__send_wanted(node, response, transactions, blocks,
+                                                                               on_block_response))
+
+    # Sends the announced items a peer asked for in its answer to /inv
+    def __send_wanted(self, node, response, transactions, blocks, on_block_response):
+        if response.status_code != 200:
+            return
+        try:
+            wanted = response.json()
+            wanted_transactions = set(wanted.get('transactions', []))
+            wanted_blocks = set(wanted.get('blocks', []))
+        except (ValueError, AttributeError, TypeError):
+            return
+        dict_transactions = [tx.to_ordered_dict() for tx in transactions if tx.tx_id in wanted_transactions]
+        if dict_transactions:
+            self.__broadcaster.broadcast([node], '/broadcast-transactions', dict_transactions, None,
+                                         codec.encode_transactions(dict_transactions))
+        for block in blocks:
+            if block.hash in wanted_blocks:
+                dict_block = block.to_dict()
+                self.__broadcaster.broadcast([node], '/broadcast-block', {'block': dict_block}, on_block_response,
+                                             codec.encode_block(dict_block))
+
+    # Confirmed transactions left the pool, an identical payment after them is a new one
+    def forget_confirmed(self, blocks):
+        for block in blocks:
+            for tx in block.transactions:
+                self.seen.discard(tx.tx_id)
+
+    def __accept(self, item_id):
+        self.seen.add(item_id)
+        self.in_flight.discard(item_id)
+
+    # Ids of an announcement this node wants, they are in flight so other announcers are not asked meanwhile
+    '''
+        has_block: called with hash and index, True if the block is already in the local chain
+    '''
+
+    def get_wanted(self, transaction_ids, blocks, has_block):
+        wanted_transactions = [tx_id for tx_id in transaction_ids if self.__want(tx_id)]
+        wanted_blocks = [block['hash'] for block in blocks
+                         if not has_block(block['hash'], block['index']) and self.__want(block['hash'])]
+        return {'transactions': wanted_transactions, 'blocks': wanted_blocks}
+
+    def __want(self, item_id):
+        return item_id not in self.seen and self.in_flight.request(item_id)
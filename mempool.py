@@ -0,0 +1,169 @@
+from bisect import bisect_right
+from collections import OrderedDict
+
+from blockchain_settings import MEMPOOL_MAX_SIZE
+
+
+# Versioned record of the pool that snapshots read from, only ever appended to by the writer
+'''
+    log: transactions in order of arrival, removed ones included
+    removed: version a log position was removed at, by position
+    positions: log position of every transaction still in the pool, by id
+    spent: (version, pending spent) changes by address, in version order
+'''
+
+
+class _Generation:
+    def __init__(self):
+        self.log = []
+        self.removed = {}
+        self.positions = {}
+        self.spent = {}
+        self.changes = 0
+
+
+# Read-only view of the pool as it was at one version
+'''
+    Taking one costs O(1) whatever the pool size. Changes made after it carry a later version and
+    are skipped, so it can be read from any thread while the writer keeps changing the pool.
+'''
+
+
+class MempoolSnapshot:
+    __slots__ = ('__generation', '__version', '__length', '__count', 'pending_spent')
+
+    def __init__(self, generation, version, count):
+        self.__generation = generation
+        self.__version = version
+        self.__length = len(generation.log)
+        self.__count = count
+        self.pending_spent = PendingSpentView(generation, version)
+
+    def __len__(self):
+        return self.__count
+
+    def __iter__(self):
+        log = self.__generation.log
+        removed = self.__generation.removed
+        for position in range(self.__length):
+            if removed.get(position, self.__version + 1) > self.__version:
+                yield log[position]
+
+
+# Amount sent per address in the outstanding transactions of a snapshot, read like a dict
+class PendingSpentView:
+    __slots__ = ('__spent', '__version')
+
+    def __init__(self, generation, version):
+        self.__spent = generation.spent
+        self.__version = version
+
+    def get(self, address, default=0):
+        changes = self.__spent.get(address)
+        if not changes:
+            return default
+        # Last change at or before the version, changes of the same version compare by amount
+        position = bisect_right(changes, (self.__version, float('inf'))) - 1
+        if position < 0 or not changes[position][1]:
+            return default
+        return changes[position][1]
+
+
+# Outstanding transactions keyed by transaction id, in order of arrival
+'''
+    Keeps the amount every sender spends in outstanding transactions so balances do not
+    have to scan the pool. Transactions have no fees, so when the pool is full the oldest
+    transaction is evicted.
+    Every change is also recorded with the current version for snapshots. Taking a snapshot
+    starts the next version. Once the record holds more changes than the pool has transactions
+    it is started over from the pool, old snapshots keep reading the old one.
+'''
+
+
+class Mempool:
+    def __init__(self, max_size=MEMPOOL_MAX_SIZE):
+        self.max_size = max_size
+        self.__transactions = OrderedDict()
+        self.__pending_spent = {}
+        self.__version = 0
+        self.__generation = _Generation()
+
+    def __len__(self):
+        return len(self.__transactions)
+
+    def __contains__(self, tx_id):
+        return tx_id in self.__transactions
+
+    def __iter__(self):
+        return iter(list(self.__transactions.values()))
+
+    def get(self, tx_id):
+        return self.__transactions.get(tx_id)
+
+    # Returns False if the transaction is already in the pool
+    def add(self, transaction):
+        tx_id = transaction.tx_id
+        if tx_id in self.__transactions:
+            return False
+        # Computed before the pool changes, so a bad amount leaves the pool as it was
+        pending_spent = self.__pending_spent.get(transaction.sender, 0) + transaction.amount
+        self.__transactions[tx_id] = transaction
+        self.__pending_spent[transaction.sender] = pending_spent
+        generation = self.__generation
+        generation.positions[tx_id] = len(generation.log)
+        generation.log.append(transaction)
+        self.__record_spent(transaction.sender, pending_spent)
+        while len(self.__transactions) > self.max_size:
+            self.remove(next(iter(self.__transactions)))
+            print('Mempool full, evicted oldest transaction')
+        return True
+
+    def remove(self, tx_id):
+        transaction = self.__transactions.pop(tx_id, None)
+        if transaction is not None:
+            generation = self.__generation
+            generation.removed[generation.positions.pop(tx_id)] = self.__version
+            self.__remove_pending_spend(transaction)
+        return transaction
+
+    # Removes transactions included in a block, costs O(block size)
+    def remove_confirmed(self, transactions):
+        for tx in transactions:
+            self.remove(tx.tx_id)
+
+    # Amount sent by address in outstanding transactions
+    def pending_spent(self, address):
+        return self.__pending_spent.get(address, 0)
+
+    # Read-only view of the pool as it is now, for publishing a state snapshot
+    def snapshot(self):
+        if self.__generation.changes > 2 * len(self.__transactions) + 64:
+            self.__start_generation()
+        snapshot = MempoolSnapshot(self.__generation, self.__version, len(self.__transactions))
+        self.__version += 1
+        return snapshot
+
+    def __start_generation(self):
+        generation = _Generation()
+        generation.log = list(self.__transactions.values())
+        generation.positions = {tx.tx_id: position for position, tx in enumerate(generation.log)}
+        generation.spent = {address: [(self.__version, spent)] for address, spent in self.__pending_spent.items()}
+        self.__generation = generation
+
+    def __remove_pending_spend(self, transaction):
+        remaining = self.__pending_spent.get(transaction.sender, 0) - transaction.amount
+        if remaining:
+            self.__pending_spent[transaction.sender] = remaining
+        else:
+            self.__pending_spent.pop(transaction.sender, None)
+        self.__record_spent(transaction.sender, remaining)
+
+    # Records the pending spend of address at the current version, replacing a change of the same version
+    def __record_spent(self, address, spent):
+        generation = self.__generation
+        generation.changes += 1
+        changes = generation.spent.setdefault(address, [])
+        if changes and changes[-1][0] == self.__version:
+            changes[-1] = (self.__version, spent)
+        else:
+            changes.append((self.__version, spent))
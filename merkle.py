@@ -0,0 +1,59 @@
+import hashlib
+
+# Merkle tree over the transaction ids of a block
+'''
+    Leaves are the transaction ids in block order. A parent is sha256(0x01 + left + right) of the
+    raw digests, the prefix keeps parents from being passed off as transaction ids. A node without
+    a sibling moves up a level unchanged instead of being paired with itself, so no two transaction
+    lists share a root. Hashes are hex strings like transaction ids and block hashes.
+    Proof: siblings from the leaf up, each as {'side': 'left' or 'right', 'hash': ...}
+'''
+
+# Root of a block without transactions
+EMPTY_ROOT = hashlib.sha256(b'').hexdigest()
+
+
+def _parent(left, right):
+    return hashlib.sha256(b'\x01' + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def _next_level(level):
+    parents = [_parent(level[position], level[position + 1]) for position in range(0, len(level) - 1, 2)]
+    if len(level) % 2:
+        parents.append(level[-1])
+    return parents
+
+
+def merkle_root(tx_ids):
+    if not tx_ids:
+        return EMPTY_ROOT
+    level = list(tx_ids)
+    while len(level) > 1:
+        level = _next_level(level)
+    return level[0]
+
+
+# Siblings proving the transaction at position is in the tree, log2 of the transaction count long
+def merkle_proof(tx_ids, position):
+    proof = []
+    level = list(tx_ids)
+    while len(level) > 1:
+        sibling = position ^ 1
+        if sibling < len(level):
+            proof.append({'side': 'left' if sibling < position else 'right', 'hash': level[sibling]})
+        level = _next_level(level)
+        position //= 2
+    return proof
+
+
+def verify_proof(tx_id, proof, root):
+    node = tx_id
+    try:
+        for step in proof:
+            if step['side'] == 'left':
+                node = _parent(step['hash'], node)
+            else:
+                node = _parent(node, step['hash'])
+    except (KeyError, TypeError, ValueError):
+        return False
+    return node == root
@@ -0,0 +1,175 @@
+import cProfile
+import io
+import math
+import pstats
+import random
+import threading
+from contextlib import contextmanager
+from time import perf_counter
+
+
+# Counters, gauges and summaries rendered in the Prometheus text format
+'''
+    Metrics are module level and shared by every Blockchain in the process. Each metric keeps one
+    value per combination of label values, labels are passed as keyword arguments.
+'''
+
+
+class Metric:
+    type = None
+
+    def __init__(self, name, help_text):
+        self.name = name
+        self.help_text = help_text
+        self._values = {}
+        self._lock = threading.Lock()
+        REGISTRY.append(self)
+
+    @staticmethod
+    def _key(labels):
+        return tuple(sorted(labels.items()))
+
+    @staticmethod
+    def _format_labels(key):
+        if not key:
+            return ''
+        return '{' + ','.join('{}="{}"'.format(name, str(value).replace('\\', '\\\\').replace('"', '\\"'))
+                              for name, value in key) + '}'
+
+    def _samples(self):
+        with self._lock:
+            return [(self.name, key, value) for key, value in self._values.items()]
+
+    def render(self):
+        lines = ['# HELP {} {}'.format(self.name, self.help_text), '# TYPE {} {}'.format(self.name, self.type)]
+        for name, key, value in self._samples():
+            lines.append('{}{} {}'.format(name, self._format_labels(key), repr(float(value))))
+        return '\n'.join(lines)
+
+
+class Counter(Metric):
+    type = 'counter'
+
+    def inc(self, amount=1, **labels):
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0) + amount
+
+    # Sum over every combination of label values
+    def total(self):
+        with self._lock:
+            return sum(self._values.values())
+
+
+class Gauge(Metric):
+    type = 'gauge'
+
+    def set(self, value, **labels):
+        with self._lock:
+            self._values[self._key(labels)] = value
+
+
+# Count and sum of observed values, e.g. durations in seconds
+class Summary(Metric):
+    type = 'summary'
+
+    def observe(self, value, **labels):
+        key = self._key(labels)
+        with self._lock:
+            count, total = self._values.get(key, (0, 0))
+            self._values[key] = (count + 1, total + value)
+
+    @contextmanager
+    def time(self, **labels):
+        started = perf_counter()
+        try:
+            yield
+        finally:
+            self.observe(perf_counter() - started, **labels)
+
+    def _samples(self):
+        with self._lock:
+            samples = []
+            for key, (count, total) in self._values.items():
+                samples.append((self.name + '_count', key, count))
+                samples.append((self.name + '_sum', key, total))
+            return samples
+
+
+REGISTRY = []
+
+
+def render():
+    return '\n'.join(metric.render() for metric in REGISTRY) + '\n'
+
+
+# Opt-in cProfile of sampled requests, aggregated until reset
+class Profiler:
+    def __init__(self):
+        self.enabled = False
+        self.sample_rate = 1.0
+        self.__stats = None
+        self.__lock = threading.Lock()
+
+    # Raises ValueError and keeps the settings if sample_rate is not a number
+    def configure(self, enabled, sample_rate=None):
+        if sample_rate is not None:
+            if isinstance(sample_rate, bool) or not isinstance(sample_rate, (int, float)) or math.isnan(sample_rate):
+                raise ValueError('sample_rate must be a number between 0 and 1')
+            self.sample_rate = min(max(sample_rate, 0.0), 1.0)
+        self.enabled = enabled
+
+    # Returns a running profile if this call is sampled, None otherwise
+    def start(self):
+        if not self.enabled or random.random() >= self.sample_rate:
+            return None
+        profile = cProfile.Profile()
+        try:
+            profile.enable()
+        except ValueError:
+            # Another profile is active in this interpreter
+            return None
+        return profile
+
+    def stop(self, profile):
+        profile.disable()
+        with self.__lock:
+            if self.__stats is None:
+                self.__stats = pstats.Stats(profile)
+            else:
+                self.__stats.add(profile)
+
+    def report(self, limit=30, sort='cumulative'):
+        with self.__lock:
+            if self.__stats is None:
+                return 'No samples\n'
+            output = io.StringIO()
+            self.__stats.stream = output
+            self.__stats.sort_stats(sort).print_stats(limit)
+            return output.getvalue()
+
+    def reset(self):
+        with self.__lock:
+            self.__stats = None
+
+
+PROFILER = Profiler()
+
+PROOF_OF_WORK_SECONDS = Summary('mythcoin_proof_of_work_seconds', 'Time spent searching proofs of work')
+HASHES = Counter('mythcoin_hashes_total', 'Proof of work hashes computed')
+HASH_RATE = Gauge('mythcoin_hash_rate', 'Hashes per second of the last proof of work')
+SIGNATURE_VERIFY_SECONDS = Summary('mythcoin_signature_verify_seconds', 'Time spent verifying signatures')
+SIGNATURE_VERIFICATIONS = Counter('mythcoin_signature_verifications_total', 'Signatures verified with RSA')
+SIGNATURE_CACHE_HITS = Counter('mythcoin_signature_cache_hits_total', 'Signature checks answered from cache')
+BLOCK_HASH_SECONDS = Summary('mythcoin_block_hash_seconds', 'Time spent serializing and hashing blocks')
+SAVE_DATA_SECONDS = Summary('mythcoin_save_data_seconds', 'Time spent persisting node state')
+SAVE_DATA_BYTES = Counter('mythcoin_save_data_bytes_total', 'Bytes written persisting node state')
+BLOCK_STORE_BYTES = Counter('mythcoin_block_store_bytes_total', 'Bytes appended to the block store')
+BROADCAST_SECONDS = Summary('mythcoin_broadcast_seconds', 'Latency of messages delivered to peers')
+BROADCAST_BYTES = Counter('mythcoin_broadcast_bytes_total', 'Request body bytes delivered to peers')
+BROADCAST_FAILURES = Counter('mythcoin_broadcast_failures_total', 'Failed deliveries to peers')
+RESOLVE_SECONDS = Summary('mythcoin_resolve_seconds', 'Time spent resolving conflicts with peers')
+RESOLVES = Counter('mythcoin_resolve_total', 'Conflict resolutions by outcome')
+REJECTED_TRANSACTIONS = Counter('mythcoin_rejected_transactions_total', 'Transactions rejected by reason')
+MEMPOOL_SIZE = Gauge('mythcoin_mempool_size', 'Outstanding transactions')
+CHAIN_HEIGHT = Gauge('mythcoin_chain_height', 'Height of the chain tip')
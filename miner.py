@@ -0,0 +1,76 @@
+import multiprocessing
+from time import time
+
+import difficulty
+from verification import ProofContext
+from blockchain_settings import MINING_WORKERS, MINING_BATCH_SIZE
+
+# Set when a worker finds a proof or mining is cancelled, shared by all worker processes
+_stop_event = None
+
+
+def _init_worker(stop_event):
+    global _stop_event
+    _stop_event = stop_event
+
+
+# Searches nonce batches worker, worker + workers, worker + 2 * workers, ... until a proof is found or stopped
+def _search(args):
+    prefix, target, worker, workers = args
+    context = ProofContext(prefix, target)
+    hashes = 0
+    batch = worker
+    while not _stop_event.is_set():
+        start = batch * MINING_BATCH_SIZE
+        for proof_number in range(start, start + MINING_BATCH_SIZE):
+            if context.valid(proof_number):
+                _stop_event.set()
+                return proof_number, hashes + proof_number - start + 1
+        hashes += MINING_BATCH_SIZE
+        batch += workers
+    return None, hashes
+
+
+# Proof of work engine spreading disjoint nonce ranges over worker processes
+class Miner:
+    def __init__(self, workers=MINING_WORKERS):
+        self.workers = max(1, workers)
+        self.hash_rate = 0
+        self.hashes = 0
+        self.__stop_event = multiprocessing.Event()
+        self.__pool = None
+
+    def __get_pool(self):
+        if self.__pool is None:
+            self.__pool = multiprocessing.Pool(self.workers, initializer=_init_worker,
+                                               initargs=(self.__stop_event,))
+        return self.__pool
+
+    # Returns a proof number valid for the prefix and target, or None if mining was cancelled
+    def mine(self, prefix, target=difficulty.LEGACY_TARGET):
+        self.__stop_event.clear()
+        started = time()
+        if self.workers == 1:
+            _init_worker(self.__stop_event)
+            results = [_search((prefix, target, 0, 1))]
+        else:
+            pool = self.__get_pool()
+            results = pool.map(_search, [(prefix, target, worker, self.workers) for worker in range(self.workers)])
+        proofs = [proof_number for proof_number, _ in results if proof_number is not None]
+        hashes = sum(worker_hashes for _, worker_hashes in results)
+        elapsed = time() - started
+        self.hashes = hashes
+        self.hash_rate = hashes / elapsed if elapsed > 0 else 0
+        if not proofs:
+            print('Mining cancelled after {} hashes'.format(hashes))
+            return None
+        return min(proofs)
+
+    # Stops every worker, mine returns None unless a proof was already found
+    def cancel(self):
+        self.__stop_event.set()
+
+    def close(self):
+        if self.__pool is not None:
+            self.__pool.terminate()
+            self.__pool = None
@@ -0,0 +1,139 @@
+import threading
+import uuid
+from collections import OrderedDict, deque
+from time import time
+
+from blockchain_settings import MINING_RESTARTS, MINING_JOBS_KEPT
+
+
+# Runs mining jobs on a background thread so requests return immediately
+'''
+    A job mines one block, or blocks back to back when continuous. Every attempt assembles a new
+    template from the mempool and the current tip; when a competing block arrives, mining on the
+    stale tip is cancelled and the job restarts on the new tip.
+    get_blockchain: returns the Blockchain to mine on, it is created after the scheduler
+'''
+
+
+class MiningScheduler:
+    def __init__(self, get_blockchain):
+        self.get_blockchain = get_blockchain
+        self.__jobs = OrderedDict()
+        self.__queue = deque()
+        self.__condition = threading.Condition()
+        self.__current = None
+        self.__thread = None
+
+    # Queues a job and returns its status
+    def submit(self, continuous=False):
+        job = {
+            'id': uuid.uuid4().hex,
+            'status': 'queued',
+            'continuous': continuous,
+            'created': time(),
+            'started': None,
+            'finished': None,
+            'attempts': 0,
+            'blocks': [],
+            'error': None
+        }
+        with self.__condition:
+            self.__jobs[job['id']] = job
+            self.__queue.append(job['id'])
+            self.__forget_finished_jobs()
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+            return dict(job)
+
+    def get_job(self, job_id):
+        with self.__condition:
+            job = self.__jobs.get(job_id)
+            return dict(job, blocks=list(job['blocks'])) if job is not None else None
+
+    def status(self):
+        with self.__condition:
+            current = self.__jobs.get(self.__current)
+            return {
+                'running': dict(current, blocks=list(current['blocks'])) if current is not None else None,
+                'queued': len(self.__queue)
+            }
+
+    # Cancels a queued or running job, returns False for unknown or finished jobs
+    def cancel(self, job_id):
+        with self.__condition:
+            job = self.__jobs.get(job_id)
+            if job is None or job['status'] not in ('queued', 'running'):
+                return False
+            if job['status'] == 'queued':
+                self.__queue.remove(job_id)
+                self.__finish(job, 'cancelled')
+                return True
+            job['status'] = 'cancelling'
+        self.get_blockchain().cancel_mining()
+        return True
+
+    def __finish(self, job, status, error=None):
+        job['status'] = status
+        job['error'] = error
+        job['finished'] = time()
+
+    def __forget_finished_jobs(self):
+        finished = [job_id for job_id, job in self.__jobs.items() if job['finished'] is not None]
+        for job_id in finished[:max(0, len(finished) - MINING_JOBS_KEPT)]:
+            del self.__jobs[job_id]
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__queue:
+                    self.__condition.wait()
+                job_id = self.__queue.popleft()
+                job = self.__jobs[job_id]
+                job['status'] = 'running'
+                job['started'] = time()
+                self.__current = job_id
+            try:
+                self.__mine(job)
+            except Exception as e:
+                with self.__condition:
+                    self.__finish(job, 'failed', str(e))
+            with self.__condition:
+                self.__current = None
+
+    def __mine(self, job):
+        restarts = 0
+        while True:
+            blockchain = self.get_blockchain()
+            with self.__condition:
+                if job['status'] == 'cancelling':
+                    self.__finish(job, 'cancelled')
+                    return
+                job['attempts'] += 1
+            if not blockchain.wallet:
+                error = 'You have no wallet'
+            elif blockchain.resolve_conflicts:
+                error = 'Resolve conflicts first, block not added'
+            else:
+                error = None
+            if error is not None:
+                with self.__condition:
+                    self.__finish(job, 'failed', error)
+                return
+            block = blockchain.mine_block()
+            with self.__condition:
+                if block is not None:
+                    job['blocks'].append(block.to_dict())
+                    restarts = 0
+                    if not job['continuous']:
+                        self.__finish(job, 'done')
+                        return
+                    continue
+                if job['status'] == 'cancelling':
+                    self.__finish(job, 'cancelled')
+                    return
+                restarts += 1
+                if restarts > MINING_RESTARTS:
+                    self.__finish(job, 'failed', 'Adding a block failed')
+                    return
@@ -1,13 +1,57 @@
-from flask import Flask, jsonify, request, send_from_directory
+from flask import Flask, Response, g, jsonify, request, send_from_directory
 from flask_cors import CORS
 
+import chain_stream
+import codec
+import metrics
+import transaction_batch
 from wallet import Wallet
 from blockchain import Blockchain
+from mining_scheduler import MiningScheduler
+from blockchain_settings import SYNC_HEADERS_PAGE, SYNC_BLOCKS_PAGE, HISTORY_PAGE
 
 app = Flask(__name__)
 
 CORS(app)
 
+# Mines on the blockchain created when the node starts
+mining_scheduler = MiningScheduler(lambda: blockchain)
+
+
+# Profile sampled requests while the profiler is enabled
+@app.before_request
+def start_profile():
+    g.profile = metrics.PROFILER.start()
+
+
+@app.teardown_request
+def stop_profile(exception=None):
+    profile = g.pop('profile', None)
+    if profile is not None:
+        metrics.PROFILER.stop(profile)
+
+
+# Advertise that peers may post blocks and transactions in the binary codec format
+@app.after_request
+def add_accept_post(response):
+    response.headers['Accept-Post'] = 'application/json, {}'.format(codec.MIMETYPE)
+    return response
+
+
+# Decodes request body sent as json or in the binary codec format
+def get_request_values(decode_binary):
+    if request.mimetype == codec.MIMETYPE:
+        try:
+            return decode_binary(request.get_data())
+        except (codec.CodecError, UnicodeDecodeError):
+            return None
+    return request.get_json(silent=True)
+
+
+# True if the client prefers the binary codec format over json
+def wants_binary():
+    return request.accept_mimetypes.best_match(['application/json', codec.MIMETYPE]) == codec.MIMETYPE
+
 
 # Get web app UI
 
@@ -26,8 +70,8 @@ def get_network_ui():
 def create_keys():
     wallet.create_keys()
     if wallet.save_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        # Keep the running blockchain, only the wallet receiving rewards changes
+        blockchain.wallet = wallet.public_key
         response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
@@ -42,8 +86,8 @@ def create_keys():
 @app.route('/wallet', methods=['GET'])
 def load_keys():
     if wallet.load_keys():
-        global blockchain
-        blockchain = Blockchain(wallet.public_key, port)
+        # Keep the running blockchain, only the wallet receiving rewards changes
+        blockchain.wallet = wallet.public_key
         response = {
             'public_key': wallet.public_key,
             'private_key': wallet.private_key,
@@ -73,15 +117,15 @@ def get_balance():
 # Broadcast transaction
 @app.route('/broadcast-transaction', methods=['POST'])
 def broadcast_transaction():
-    values = request.get_json()
+    values = get_request_values(codec.decode_transaction)
     if not values:
         response = {'message': 'No data found.'}
-        print('1')
+        metrics.REJECTED_TRANSACTIONS.inc(reason='no_data')
         return jsonify(response), 400
     required_fields = ['sender', 'recipient', 'amount', 'signature']
     if not all(field in values for field in required_fields):
         response = {'message': 'Required data is missing'}
-        print('2')
+        metrics.REJECTED_TRANSACTIONS.inc(reason='missing_fields')
         return jsonify(response), 400
     success = blockchain.add_new_transaction(values['sender'], values['recipient'], values['signature'], values['amount'], True)
     if success:
@@ -97,13 +141,27 @@ def broadcast_transaction():
         return jsonify(response), 201
     else:
         response = {'message': 'Failed add transaction'}
-        print('4')
+        metrics.REJECTED_TRANSACTIONS.inc(reason='invalid')
+        return jsonify(response), 400
+
+# Inventory announced by a peer, answers with the ids this node wants to be sent
+@app.route('/inv', methods=['POST'])
+def receive_inventory():
+    values = request.get_json(silent=True)
+    if not isinstance(values, dict):
+        response = {'message': 'No data found.'}
+        return jsonify(response), 400
+    try:
+        wanted = blockchain.get_wanted(values.get('transactions', []), values.get('blocks', []))
+    except (KeyError, TypeError):
+        response = {'message': 'Invalid inventory'}
         return jsonify(response), 400
+    return jsonify(wanted), 200
 
 # Broadcast block
 @app.route('/broadcast-block', methods=['POST'])
 def broadcast_block():
-    values = request.get_json()
+    values = get_request_values(lambda data: {'block': codec.decode_block(data)})
     if not values:
         response = {'Message': 'No data found'}
         return jsonify(response), 400
@@ -111,14 +169,18 @@ def broadcast_block():
         response = {'Message': 'No Block in values'}
         return jsonify(response), 400
     block = values['block']
-    if block['index'] == blockchain.chain[-1].index + 1:
+    if not isinstance(block, dict) or not isinstance(block.get('index'), int):
+        response = {'message': 'Block seems invalid.'}
+        return jsonify(response), 400
+    tip_height = blockchain.get_tip()['height']
+    if block['index'] == tip_height + 1:
         if blockchain.add_block(block):
             response = {'message': 'Block added'}
             return jsonify(response), 201
         else:
             response = {'message': 'Block seems invalid.'}
             return jsonify(response), 409
-    elif block['index'] > blockchain.chain[-1].index + 1:
+    elif block['index'] > tip_height + 1:
         response = {'message': 'Block seems to differ from local blockchain.'}
         blockchain.resolve_conflicts = True
         return jsonify(response), 200
@@ -161,6 +223,35 @@ def add_transaction():
             response = {'message': 'Failed add transaction'}
             return jsonify(response), 400
 
+# Add many transactions from this wallet: [{'recipient': ..., 'amount': ...}, ...]
+@app.route('/transactions/batch', methods=['POST'])
+def add_transactions():
+    if wallet.public_key is None:
+        response = {'message': 'You have no wallet'}
+        return jsonify(response), 400
+    values = request.get_json(silent=True)
+    error = transaction_batch.check_batch(values)
+    if error is not None:
+        return jsonify(error[0]), error[1]
+    transactions = transaction_batch.sign_batch(wallet, values)
+    results = transaction_batch.add_batch(blockchain, values, transactions, False)
+    response, status = transaction_batch.batch_response(results)
+    response['funds'] = blockchain.get_balance()
+    return jsonify(response), status
+
+
+# Broadcast many transactions, sent by peers as one message
+@app.route('/broadcast-transactions', methods=['POST'])
+def broadcast_transactions():
+    values = get_request_values(codec.decode_transactions)
+    error = transaction_batch.check_batch(values)
+    if error is not None:
+        return jsonify(error[0]), error[1]
+    results = transaction_batch.add_batch(blockchain, values, transaction_batch.get_relayed(values), True)
+    response, status = transaction_batch.batch_response(results)
+    return jsonify(response), status
+
+
 # Resolve miner conflicts
 @app.route('/resolve-conflicts', methods=['POST'])
 def resolve_conflicts():
@@ -171,43 +262,206 @@ def resolve_conflicts():
         response = {'message': 'Local chain saved'}
     return jsonify(response), 200
 
-# Mine for reward
+# Fresh node only: starts the chain at a balance snapshot served by a quorum of peers, then syncs the
+# blocks after it, without a quorum the full chain is synced
+@app.route('/bootstrap', methods=['POST'])
+def bootstrap():
+    if not blockchain.bootstrap():
+        response = {'message': 'Bootstrap failed'}
+        return jsonify(response), 409
+    response = {
+        'message': 'Bootstrapped from peers',
+        'tip': blockchain.get_tip()
+    }
+    return jsonify(response), 200
+
+
+# Mine for reward, mining runs in the background and the job can be polled
 @app.route('/mine', methods=['POST'])
 def mine():
+    if wallet.public_key is None:
+        response = {'message': 'Adding a block failed', 'wallet': False}
+        return jsonify(response), 400
     if blockchain.resolve_conflicts:
         response = {'message': 'Resolve conflicts first, block not added'}
         return jsonify(response), 409
-    block = blockchain.mine_block()
-    if block != None:
-        dict_block = block.__dict__.copy()
-        dict_block['transactions'] = [tx.__dict__ for tx in dict_block['transactions']]
-        response = {
-            'message': 'Block added successfully',
-            'block': dict_block,
-            'funds': blockchain.get_balance()
-        }
-    else:
-        response = {
-            'message': 'Adding a block failed',
-            'wallet': wallet.public_key != None
-        }
-    return jsonify(response)
+    values = request.get_json(silent=True) or {}
+    job = mining_scheduler.submit(bool(values.get('continuous', False)))
+    response = {
+        'message': 'Mining started',
+        'job': job
+    }
+    return jsonify(response), 202
+
+
+@app.route('/mine/status', methods=['GET'])
+def get_mining_status():
+    return jsonify(mining_scheduler.status()), 200
+
+
+@app.route('/mine/<job_id>', methods=['GET'])
+def get_mining_job(job_id):
+    job = mining_scheduler.get_job(job_id)
+    if job is None:
+        response = {'message': 'No mining job found'}
+        return jsonify(response), 404
+    response = {
+        'job': job,
+        'funds': blockchain.get_balance()
+    }
+    if job['status'] == 'done':
+        response['message'] = 'Block added successfully'
+        response['block'] = job['blocks'][-1]
+    elif job['status'] == 'failed':
+        response['message'] = job['error']
+    return jsonify(response), 200
+
+
+@app.route('/mine/<job_id>', methods=['DELETE'])
+def cancel_mining_job(job_id):
+    if not mining_scheduler.cancel(job_id):
+        response = {'message': 'No running mining job found'}
+        return jsonify(response), 404
+    response = {'message': 'Mining cancelled'}
+    return jsonify(response), 200
 
 
 @app.route('/transactions', methods=['GET'])
 def get_transactions():
     transactions = blockchain.get_open_transactions()
-    transactions = [tx.__dict__ for tx in transactions]
+    transactions = [tx.to_ordered_dict() for tx in transactions]
     return jsonify(transactions)
 
 
+# Blocks start..end-1, the whole chain by default, streamed one block at a time
+'''
+    Sent as a json array, as ndjson or in the binary codec format, whichever the client prefers
+'''
+
+
 @app.route('/chain', methods=['GET'])
 def get_chain():
-    chain_snapshot = blockchain.chain
-    dict_chain = [block.__dict__.copy() for block in chain_snapshot]
-    for dict_block in dict_chain:
-        dict_block['transactions'] = [tx.__dict__ for tx in dict_block['transactions']]
-    return jsonify(dict_chain), 200
+    start = max(0, request.args.get('start', 0, type=int))
+    end = request.args.get('end', None, type=int)
+    count, blocks = blockchain.stream_blocks(start, end)
+    mimetype = request.accept_mimetypes.best_match(chain_stream.MIMETYPES, chain_stream.JSON_MIMETYPE)
+    return Response(chain_stream.encode_blocks(mimetype, count, blocks), mimetype=mimetype), 200
+
+
+@app.route('/chain/tip', methods=['GET'])
+def get_chain_tip():
+    return jsonify(blockchain.get_tip()), 200
+
+
+# Headers of blocks start..end-1, pages are capped at SYNC_HEADERS_PAGE
+@app.route('/chain/headers', methods=['GET'])
+def get_chain_headers():
+    start = max(0, request.args.get('start', 0, type=int))
+    end = request.args.get('end', start + SYNC_HEADERS_PAGE, type=int)
+    return jsonify(blockchain.get_headers(start, end)), 200
+
+
+# Blocks start..end-1, pages are capped at SYNC_BLOCKS_PAGE
+@app.route('/chain/blocks', methods=['GET'])
+def get_chain_blocks():
+    start = max(0, request.args.get('start', 0, type=int))
+    end = request.args.get('end', start + SYNC_BLOCKS_PAGE, type=int)
+    blocks = blockchain.get_blocks(start, end)
+    if wants_binary():
+        return Response(codec.encode_blocks(blocks), mimetype=codec.MIMETYPE), 200
+    return jsonify(blocks), 200
+
+
+# Confirmed transactions of an address start..end-1 in chain order, pages are capped at HISTORY_PAGE
+@app.route('/address/<address>/transactions', methods=['GET'])
+def get_address_transactions(address):
+    start = max(0, request.args.get('start', 0, type=int))
+    end = request.args.get('end', start + HISTORY_PAGE, type=int)
+    return jsonify(blockchain.get_address_history(address, start, end)), 200
+
+
+@app.route('/transaction/<tx_id>', methods=['GET'])
+def get_transaction(tx_id):
+    transaction = blockchain.get_transaction(tx_id)
+    if transaction is None:
+        response = {'message': 'No confirmed transaction found'}
+        return jsonify(response), 404
+    return jsonify(transaction), 200
+
+
+# Merkle inclusion proof of a confirmed transaction, checked by light clients against /chain/headers
+@app.route('/transaction/<tx_id>/proof', methods=['GET'])
+def get_transaction_proof(tx_id):
+    proof = blockchain.get_merkle_proof(tx_id, request.args.get('height', type=int))
+    if proof is None:
+        response = {'message': 'No Merkle proof found'}
+        return jsonify(response), 404
+    return jsonify(proof), 200
+
+
+@app.route('/block/<block_hash>', methods=['GET'])
+def get_block(block_hash):
+    block = blockchain.get_block(block_hash)
+    if block is None:
+        response = {'message': 'No block found'}
+        return jsonify(response), 404
+    if wants_binary():
+        return Response(codec.encode_block(block), mimetype=codec.MIMETYPE), 200
+    return jsonify(block), 200
+
+
+# Balance snapshots on the current chain: height, block hash and digest, newest first
+@app.route('/snapshots', methods=['GET'])
+def get_snapshots():
+    return jsonify(blockchain.get_snapshots()), 200
+
+
+# Balances at a snapshot height with the block it was taken at, the newest snapshot without height
+@app.route('/snapshot', methods=['GET'])
+@app.route('/snapshot/<int:height>', methods=['GET'])
+def get_snapshot(height=None):
+    snapshot = blockchain.get_snapshot(height)
+    if snapshot is None:
+        response = {'message': 'No snapshot found'}
+        return jsonify(response), 404
+    return jsonify(snapshot), 200
+
+
+# Metrics in the Prometheus text format
+@app.route('/metrics', methods=['GET'])
+def get_metrics():
+    metrics.MEMPOOL_SIZE.set(blockchain.get_open_transaction_count())
+    metrics.CHAIN_HEIGHT.set(blockchain.get_tip()['height'])
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4'), 200
+
+
+# Aggregated profile of sampled requests
+@app.route('/metrics/profile', methods=['GET'])
+def get_profile():
+    limit = request.args.get('limit', 30, type=int)
+    sort = request.args.get('sort', 'cumulative')
+    return Response(metrics.PROFILER.report(limit, sort), mimetype='text/plain'), 200
+
+
+# Toggle profiler: enabled, sample_rate between 0 and 1, reset to drop collected samples
+@app.route('/metrics/profile', methods=['POST'])
+def configure_profile():
+    values = request.get_json(silent=True)
+    if not values or 'enabled' not in values:
+        response = {'message': 'Required data is missing'}
+        return jsonify(response), 400
+    try:
+        metrics.PROFILER.configure(bool(values['enabled']), values.get('sample_rate'))
+    except ValueError as e:
+        response = {'message': str(e)}
+        return jsonify(response), 400
+    if values.get('reset'):
+        metrics.PROFILER.reset()
+    response = {
+        'enabled': metrics.PROFILER.enabled,
+        'sample_rate': metrics.PROFILER.sample_rate
+    }
+    return jsonify(response), 200
 
 
 @app.route('/node', methods=['POST'])
@@ -263,3 +517,5 @@ if __name__ == '__main__':
     wallet = Wallet(port)
     blockchain = Blockchain(wallet.public_key, port)
     app.run(host='0.0.0.0', port=port)
+    # Mempool and nodes are saved in the background, save what changed since
+    blockchain.save_data()
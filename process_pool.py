@@ -0,0 +1,18 @@
+from concurrent.futures import ProcessPoolExecutor
+
+from blockchain_settings import VERIFY_WORKERS
+
+# Shared pool for CPU heavy verification work, created on first use
+_pool = None
+
+
+def get_pool():
+    global _pool
+    if _pool is None:
+        _pool = ProcessPoolExecutor(max_workers=VERIFY_WORKERS)
+    return _pool
+
+
+# Splits work into one chunk per worker to keep pickling overhead low
+def chunk_size(items):
+    return max(1, len(items) // (VERIFY_WORKERS * 4))
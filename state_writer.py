@@ -0,0 +1,59 @@
+import threading
+from time import sleep
+
+from blockchain_settings import STATE_SAVE_DELAY
+
+
+# Saves node state on a background thread, changes close together are saved once
+'''
+    save: called without arguments, writes the current state
+    A change marks the state dirty, the writer waits STATE_SAVE_DELAY seconds for more changes and
+    then saves once, outside the writer lock of the blockchain. save writes right away, e.g. on
+    shutdown. A crash loses at most the changes of the last STATE_SAVE_DELAY seconds.
+'''
+
+
+class StateWriter:
+    def __init__(self, save, delay=STATE_SAVE_DELAY):
+        self.__save = save
+        self.delay = delay
+        self.__dirty = False
+        self.__condition = threading.Condition()
+        # One save at a time, so an older state never overwrites a newer one
+        self.__save_lock = threading.Lock()
+        self.__thread = None
+
+    def mark_dirty(self):
+        with self.__condition:
+            self.__dirty = True
+            if self.__thread is None:
+                self.__thread = threading.Thread(target=self.__run, daemon=True)
+                self.__thread.start()
+            self.__condition.notify()
+
+    # Saves now, whether or not anything changed
+    def save(self):
+        with self.__save_lock:
+            with self.__condition:
+                self.__dirty = False
+            self.__save()
+
+    # Saves pending changes now
+    def flush(self):
+        with self.__condition:
+            if not self.__dirty:
+                return
+        self.save()
+
+    def __run(self):
+        while True:
+            with self.__condition:
+                while not self.__dirty:
+                    self.__condition.wait()
+            sleep(self.delay)
+            try:
+                self.flush()
+            except (IOError, ValueError) as e:
+                print('Saving state failed: {}'.format(e))
+                # Retried after the next delay
+                self.mark_dirty()
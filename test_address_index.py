@@ -0,0 +1,78 @@
+import pytest
+
+from address_index import AddressIndex
+from benchmark import load_node, start_node
+from blockchain import Blockchain
+
+RECIPIENT = 'ab' * 32
+
+
+def history(client, address):
+    response = client.get('/address/{}/transactions'.format(address))
+    assert response.status_code == 200
+    return response.get_json()
+
+
+# Node with a local fork holding a transfer to RECIPIENT and a longer competing chain served by a peer
+@pytest.fixture
+def forked(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    peer, server = start_node()
+    node = load_node('local')
+    client = node.app.test_client()
+    client.post('/wallet')
+    blockchain = node.blockchain
+    blockchain.mine_block()
+    signature = node.wallet.sign_transaction(node.wallet.public_key, RECIPIENT, 0.5)
+    assert blockchain.add_new_transaction(node.wallet.public_key, RECIPIENT, signature, 0.5)
+    blockchain.mine_block()
+    for _ in range(4):
+        peer.blockchain.mine_block()
+    blockchain.add_node('127.0.0.1:{}'.format(peer.port))
+    yield node, client, peer
+    server.shutdown()
+
+
+def test_resolve_drops_orphaned_history(forked):
+    node, client, peer = forked
+    assert history(client, RECIPIENT)['total'] == 1
+    assert history(client, node.wallet.public_key)['total'] == 3
+    assert node.blockchain.resolve()
+    assert history(client, RECIPIENT) == {'address': RECIPIENT, 'total': 0, 'transactions': []}
+    assert history(client, node.wallet.public_key)['total'] == 0
+    peer_history = history(client, peer.wallet.public_key)
+    assert peer_history['total'] == 4
+    assert [entry['height'] for entry in peer_history['transactions']] == [1, 2, 3, 4]
+
+
+# The saved journal replays the rollback instead of the orphaned blocks
+def test_journal_replays_rollback(forked):
+    node, client, peer = forked
+    assert node.blockchain.resolve()
+    node.blockchain.save_data()
+    reloaded = Blockchain(None, 'local')
+    assert reloaded.get_address_history(RECIPIENT, 0, 10)['total'] == 0
+    assert reloaded.get_address_history(peer.wallet.public_key, 0, 10)['total'] == 4
+
+
+# A journal rewritten from the whole index replays to the same index as the journal of its changes
+def test_full_journal_matches_changes(forked):
+    node, client, peer = forked
+    index = AddressIndex()
+    orphaned = list(node.blockchain.chain)
+    for block in orphaned:
+        index.add_block(block, block.hash)
+    assert node.blockchain.resolve()
+    for block in reversed(orphaned[1:]):
+        index.remove_block(block, block.hash)
+    for block in node.blockchain.chain[1:]:
+        index.add_block(block, block.hash)
+    changes, full = AddressIndex(), AddressIndex()
+    for record in AddressIndex.replay_journal(index.take_journal()):
+        changes.add_entries(*record)
+    for record in AddressIndex.replay_journal(index.take_journal(True)):
+        full.add_entries(*record)
+    for address in (RECIPIENT, node.wallet.public_key, peer.wallet.public_key, 'REWARD'):
+        assert full.get_history(address, 0, 10) == changes.get_history(address, 0, 10) \
+            == index.get_history(address, 0, 10)
+    assert (full.height, full.hash) == (changes.height, changes.hash) == (index.height, index.hash)
@@ -0,0 +1,38 @@
+import asyncio
+
+from aiohttp.test_utils import TestClient, TestServer
+
+import async_node
+
+
+async def request(method, path, headers):
+    async with TestClient(TestServer(async_node.create_app(5999))) as client:
+        response = await client.request(method, path, headers=headers)
+        return response.status, response.headers
+
+
+# Browsers send a preflight before cross-origin posts with a json body
+def test_answers_cors_preflight(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    status, headers = asyncio.run(request('OPTIONS', '/transaction', {
+        'Origin': 'http://localhost:8080',
+        'Access-Control-Request-Method': 'POST',
+        'Access-Control-Request-Headers': 'content-type'
+    }))
+    assert status == 200
+    assert headers['Access-Control-Allow-Origin'] == '*'
+    assert 'POST' in headers['Access-Control-Allow-Methods'].split(', ')
+    assert headers['Access-Control-Allow-Headers'] == 'content-type'
+
+
+def test_preflight_of_unknown_path_is_not_found(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    status, _ = asyncio.run(request('OPTIONS', '/missing', {'Access-Control-Request-Method': 'GET'}))
+    assert status == 404
+
+
+def test_answers_have_cors_origin(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    status, headers = asyncio.run(request('GET', '/chain/tip', {'Origin': 'http://localhost:8080'}))
+    assert status == 200
+    assert headers['Access-Control-Allow-Origin'] == '*'
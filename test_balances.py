@@ -0,0 +1,52 @@
+from benchmark import load_node, start_node
+from blockchain_settings import MINING_REWARD
+from test_verification import forge_block, reward, transfer, mined
+
+RECIPIENT = 'ab'
+
+
+def test_balances_after_add_block(mined):
+    wallet, blockchain = mined
+    assert blockchain.add_block(forge_block(blockchain, [transfer(wallet, 0.5), reward(wallet)]).to_dict())
+    assert blockchain.get_balance() == 2 * MINING_REWARD - 0.5
+    assert blockchain.get_balance(RECIPIENT) == 0.5
+
+
+# Outstanding transfers count against the sender only, the recipient is credited once they are mined
+def test_balances_after_mining_open_transactions(mined):
+    wallet, blockchain = mined
+    for amount in (0.25, 0.125):
+        signature = wallet.sign_transaction(wallet.public_key, RECIPIENT, amount)
+        assert blockchain.add_new_transaction(wallet.public_key, RECIPIENT, signature, amount)
+    assert blockchain.get_balance() == MINING_REWARD - 0.375
+    assert blockchain.get_balance(RECIPIENT) == 0
+    assert blockchain.mine_block() is not None
+    assert blockchain.get_open_transactions() == []
+    assert blockchain.get_balance() == 2 * MINING_REWARD - 0.375
+    assert blockchain.get_balance(RECIPIENT) == 0.375
+
+
+# Blocks of the local fork are reverted when a longer chain of a peer wins
+def test_balances_after_resolve_rolls_back_fork(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    peer, server = start_node()
+    try:
+        node = load_node('local')
+        node.app.test_client().post('/wallet')
+        blockchain = node.blockchain
+        blockchain.mine_block()
+        signature = node.wallet.sign_transaction(node.wallet.public_key, RECIPIENT, 0.5)
+        assert blockchain.add_new_transaction(node.wallet.public_key, RECIPIENT, signature, 0.5)
+        blockchain.mine_block()
+        assert blockchain.get_balance() == 2 * MINING_REWARD - 0.5
+        assert blockchain.get_balance(RECIPIENT) == 0.5
+        for _ in range(3):
+            peer.blockchain.mine_block()
+        blockchain.add_node('127.0.0.1:{}'.format(peer.port))
+        assert blockchain.resolve()
+        assert blockchain.get_balance() == 0
+        assert blockchain.get_balance(RECIPIENT) == 0
+        assert blockchain.get_balance(peer.wallet.public_key) == 3 * MINING_REWARD
+        assert blockchain.get_state().balances.get(peer.wallet.public_key) == 3 * MINING_REWARD
+    finally:
+        server.shutdown()
@@ -0,0 +1,93 @@
+import json
+import os
+import time
+
+import block_store
+from blockchain import Blockchain
+from wallet import Wallet
+
+
+def make_block(index, tag='aa'):
+    return {'index': index, 'previous_hash': tag * 32, 'transactions': [], 'proof_number': index,
+            'timestamp': 1546300800.0 + index}
+
+
+def load_store():
+    store = block_store.BlockStore('store')
+    store.load()
+    return store
+
+
+def hashes(store):
+    return [store.get_hash(height) for height in range(store.base, len(store))]
+
+
+# Index appended, truncated and forked across checkpoints is rebuilt from the journal
+def test_index_survives_reload(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    monkeypatch.setattr(block_store, 'CHECKPOINT_INTERVAL', 3)
+    store = load_store()
+    for index in range(7):
+        store.append(make_block(index), '{:064x}'.format(index))
+    store.truncate(5)
+    store.append(make_block(5, 'bb'), 'bb' * 32)
+    store.append(make_block(3, 'cc'), 'cc' * 32)
+    store.append(make_block(4, 'cc'), 'dd' * 32)
+    store.sync()
+    expected = hashes(store)
+    assert hashes(load_store()) == expected
+    store.close()
+    assert hashes(load_store()) == expected
+
+
+# A checkpoint writes the lines since the previous one, not the whole index
+def test_checkpoint_appends_to_journal(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = load_store()
+    for index in range(50):
+        store.append(make_block(index), '{:064x}'.format(index))
+    store.checkpoint()
+    with open(os.path.join(store.directory, 'checkpoint.json')) as file:
+        checkpoint = json.load(file)
+    assert 'index' not in checkpoint
+    journal = os.path.join(store.directory, 'index-{:05d}.log'.format(checkpoint['journal_generation']))
+    size = os.path.getsize(journal)
+    store.truncate(48)
+    with open(journal) as file:
+        assert file.read()[size:] == '[48]\n'
+    assert hashes(load_store()) == ['{:064x}'.format(index) for index in range(48)]
+
+
+# Checkpoints written before the journal held the whole index
+def test_loads_checkpoint_with_index(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = load_store()
+    for index in range(4):
+        store.append(make_block(index), '{:064x}'.format(index))
+    store.sync()
+    index, base, _ = store.index_snapshot()
+    with open(os.path.join(store.directory, 'checkpoint.json'), mode='w') as file:
+        json.dump({'segment': 0, 'position': index[2][1], 'base': base, 'index': index[:2]}, file)
+    reloaded = load_store()
+    assert hashes(reloaded) == hashes(store)
+    reloaded.checkpoint()
+    assert hashes(load_store()) == hashes(store)
+
+
+# Mempool changes are saved by the state writer, save_data saves at once
+def test_state_is_saved_in_background(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wallet = Wallet('store')
+    wallet.create_keys()
+    blockchain = Blockchain(wallet.public_key, 'store')
+    blockchain.mine_block()
+    signature = wallet.sign_transaction(wallet.public_key, 'bb', 0.5)
+    assert blockchain.add_new_transaction(wallet.public_key, 'bb', signature, 0.5)
+    store = load_store()
+    deadline = time.time() + 10
+    while not store.load_state()[0] and time.time() < deadline:
+        time.sleep(0.05)
+    assert [tx['signature'] for tx in store.load_state()[0]] == [signature]
+    blockchain.add_node('localhost:5001')
+    blockchain.save_data()
+    assert store.load_state()[1] == ['localhost:5001']
@@ -0,0 +1,74 @@
+import pytest
+
+from blockchain import Blockchain
+from blockchain_settings import SNAPSHOT_QUORUM
+from broadcaster import Broadcaster
+
+LISTING = [{'height': 1000, 'hash': 'ab' * 32, 'digest': 'cd' * 32}]
+
+
+# Peers agreeing on the snapshot listing, the snapshot itself is never served so a download fails loudly
+@pytest.fixture
+def peers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    fetched = []
+    resolved = []
+
+    def fetch(self, node, path, decode_binary=None):
+        fetched.append((node, path))
+        return None
+
+    monkeypatch.setattr(Broadcaster, 'fetch_all',
+                        lambda self, nodes, path: {node: LISTING for node in nodes} if path == '/snapshots' else {})
+    monkeypatch.setattr(Broadcaster, 'fetch', fetch)
+    monkeypatch.setattr(Blockchain, 'resolve', lambda self: resolved.append(True) or True)
+    return fetched, resolved
+
+
+# A single peer could hand a fresh node any balances, without a quorum the full chain is synced
+def test_bootstrap_without_quorum_syncs_full_chain(peers):
+    fetched, resolved = peers
+    blockchain = Blockchain(None, 'bootstrap')
+    for port in range(SNAPSHOT_QUORUM - 1):
+        blockchain.add_node('localhost:{}'.format(5000 + port))
+    assert blockchain.bootstrap()
+    assert fetched == []
+    assert resolved == [True]
+    assert blockchain.chain.base == 0
+
+
+def test_bootstrap_with_quorum_fetches_snapshot(peers):
+    fetched, resolved = peers
+    blockchain = Blockchain(None, 'bootstrap')
+    for port in range(SNAPSHOT_QUORUM):
+        blockchain.add_node('localhost:{}'.format(5000 + port))
+    blockchain.bootstrap()
+    assert len(fetched) == SNAPSHOT_QUORUM
+    assert all(path == '/snapshot/1000' for node, path in fetched)
+
+
+# Tips without a usable height are skipped instead of failing the whole resolve
+def test_resolve_skips_malformed_tips(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    tips = {'a': {'height': '9'}, 'b': {}, 'c': None, 'd': {'height': True}, 'e': {'height': -2}, 'f': {'height': 0}}
+    monkeypatch.setattr(Broadcaster, 'fetch_all', lambda self, nodes, path: tips)
+    blockchain = Blockchain(None, 'bootstrap')
+    assert not blockchain.resolve()
+
+
+# A peer answering /chain/headers with anything but a list of headers is skipped before any block is fetched
+@pytest.mark.parametrize('headers', [
+    None, {'index': 0, 'hash': 'ab'}, 'headers', [None], [['0', 'ab']], [{'hash': 'ab'}],
+    [{'index': '0', 'hash': 'ab'}], [{'index': True, 'hash': 'ab'}], [{'index': 0, 'hash': None}], [{'index': 0}]
+])
+def test_resolve_skips_malformed_headers(tmp_path, monkeypatch, headers):
+    monkeypatch.chdir(tmp_path)
+    fetched_blocks = []
+    monkeypatch.setattr(Broadcaster, 'fetch_all', lambda self, nodes, path: {node: {'height': 5} for node in nodes})
+    monkeypatch.setattr(Broadcaster, 'fetch', lambda self, node, path, decode_binary=None: headers)
+    monkeypatch.setattr(Broadcaster, 'fetch_blocks', lambda self, node, path: fetched_blocks.append(path) or iter([]))
+    blockchain = Blockchain(None, 'bootstrap')
+    blockchain.add_node('localhost:5000')
+    assert not blockchain.resolve()
+    assert fetched_blocks == []
+    assert len(blockchain.chain) == 1
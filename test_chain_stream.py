@@ -0,0 +1,110 @@
+import hashlib
+import json
+import random
+
+import pytest
+
+import block_store
+import chain_stream
+import codec
+from blockchain import Blockchain
+from test_codec import make_block, make_legacy_block
+from transaction import Transaction
+from verification import Verification
+from wallet import Wallet
+
+BLOCKS = [dict(make_legacy_block(), index=0), dict(make_block(), index=1), dict(make_block(), index=2, transactions=[]),
+          dict(make_block(), index=3, proof_number=10 ** 12)]
+
+
+def split(data, sizes):
+    chunks = []
+    position = 0
+    while position < len(data):
+        size = next(sizes)
+        chunks.append(data[position:position + size])
+        position += size
+    return chunks
+
+
+def one_byte():
+    while True:
+        yield 1
+
+
+def random_sizes(seed):
+    rng = random.Random(seed)
+    while True:
+        yield rng.randint(1, 64)
+
+
+CHUNKINGS = [('whole', lambda: iter([1 << 30])), ('one byte', one_byte)] + [
+    ('random {}'.format(seed), lambda seed=seed: random_sizes(seed)) for seed in range(5)]
+
+
+@pytest.mark.parametrize('mimetype', chain_stream.MIMETYPES)
+@pytest.mark.parametrize('name, sizes', CHUNKINGS, ids=[name for name, _ in CHUNKINGS])
+@pytest.mark.parametrize('blocks', [BLOCKS, BLOCKS[:1], []], ids=['blocks', 'one', 'empty'])
+def test_round_trip(mimetype, name, sizes, blocks):
+    data = b''.join(chain_stream.encode_blocks(mimetype, len(blocks), iter(blocks)))
+    if mimetype == chain_stream.JSON_MIMETYPE:
+        assert json.loads(data) == blocks
+    elif mimetype == codec.MIMETYPE:
+        assert codec.decode_blocks(data) == blocks
+    assert list(chain_stream.decode_blocks(mimetype, split(data, sizes()))) == blocks
+
+
+@pytest.mark.parametrize('data', [b'[{"a":1},]', b'[,]', b'[{"a":1},,{"a":2}]', b'[{"a":1}{"a":2}]', b'{"a":1}',
+                                  b'[{"a":1}', b'[{"a":1},', b''])
+@pytest.mark.parametrize('name, sizes', CHUNKINGS[:2], ids=[name for name, _ in CHUNKINGS[:2]])
+def test_malformed_array_is_rejected(data, name, sizes):
+    with pytest.raises(ValueError):
+        list(chain_stream.iter_decode_array(split(data, sizes())))
+
+
+def baseline_hash(block):
+    return hashlib.sha256(json.dumps(block, sort_keys=True).encode()).hexdigest()
+
+
+def baseline_proof(transactions, previous_hash):
+    prefix = str([Transaction(**tx).to_ordered_dict() for tx in transactions]) + str(previous_hash)
+    return next(proof for proof in range(10 ** 6)
+                if hashlib.sha256((prefix + str(proof)).encode()).hexdigest()[0:2] == '00')
+
+
+# blockchain-<id>.txt as the baseline saved it: chain, open transactions and nodes, one json line each
+def test_import_baseline_chain_file(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    # Reads the chain line a few bytes at a time
+    monkeypatch.setattr(block_store, 'STREAM_CHUNK_SIZE', 7)
+    wallet = Wallet('legacy')
+    wallet.create_keys()
+    chain = [{'index': 0, 'previous_hash': '', 'transactions': [], 'proof_number': 100, 'timestamp': 0}]
+    transfer = {'sender': wallet.public_key, 'recipient': 'ab', 'amount': 0.5,
+                'signature': wallet.sign_transaction(wallet.public_key, 'ab', 0.5)}
+    for transactions in ([], [transfer]):
+        reward = {'sender': 'REWARD', 'recipient': wallet.public_key, 'amount': 1, 'signature': ''}
+        previous_hash = baseline_hash(chain[-1])
+        chain.append({'index': len(chain), 'previous_hash': previous_hash, 'transactions': transactions + [reward],
+                      'proof_number': baseline_proof(transactions, previous_hash),
+                      'timestamp': 1546300800.5 + len(chain)})
+    open_transaction = {'sender': wallet.public_key, 'recipient': 'cd', 'amount': 0.25,
+                        'signature': wallet.sign_transaction(wallet.public_key, 'cd', 0.25)}
+    with open('blockchain-legacy.txt', mode='w') as file:
+        file.write(json.dumps(chain))
+        file.write('\n')
+        file.write(json.dumps([open_transaction]))
+        file.write('\n')
+        file.write(json.dumps(['localhost:5001']))
+    blockchain = Blockchain(wallet.public_key, 'legacy')
+    assert [block.to_dict() for block in blockchain.chain] == chain
+    assert [blockchain.chain.get_hash(height) for height in range(len(chain))] == [baseline_hash(block)
+                                                                                   for block in chain]
+    assert Verification.verify_chain(list(blockchain.chain), blockchain.get_hash)
+    assert blockchain.get_balance() == 2 - 0.5 - 0.25
+    assert blockchain.get_balance('ab') == 0.5
+    assert [tx.to_ordered_dict() for tx in blockchain.get_open_transactions()] == [open_transaction]
+    assert blockchain.get_nodes() == ['localhost:5001']
+    blockchain.save_data()
+    reloaded = Blockchain(wallet.public_key, 'legacy')
+    assert [block.to_dict() for block in reloaded.chain] == chain
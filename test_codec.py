@@ -0,0 +1,186 @@
+import hashlib
+import json
+from types import SimpleNamespace
+
+import pytest
+
+import block_store
+import codec
+import transaction
+from block import Block
+from blockchain import Blockchain
+from transaction import Transaction
+
+SENDER = '30819f300d06092a864886f70d010101050003818d0030818902818100c4'
+RECIPIENT = '30819f300d06092a864886f70d010101050003818d0030818902818100d5'
+SIGNATURE = 'a1b2c3d4e5f60718293a4b5c6d7e8f90'
+
+
+def make_transactions():
+    return [
+        {'sender': SENDER, 'recipient': RECIPIENT, 'amount': 2, 'signature': SIGNATURE},
+        {'sender': RECIPIENT, 'recipient': SENDER, 'amount': 0.1, 'signature': SIGNATURE[::-1]},
+        # Not hex, stored as utf8
+        {'sender': 'Alice', 'recipient': 'Bob é', 'amount': -3, 'signature': 'ABC'},
+        {'sender': 'REWARD', 'recipient': SENDER, 'amount': 1, 'signature': ''},
+    ]
+
+
+# Block as saved before targets and Merkle roots were stored per block
+def make_legacy_block():
+    return {'index': 3, 'previous_hash': 'ab' * 32, 'transactions': make_transactions(), 'proof_number': 421,
+            'timestamp': 1546300800.123456}
+
+
+def make_block():
+    block = make_legacy_block()
+    block['bits'] = 0x1f00ffff
+    block['merkle_root'] = 'cd' * 32
+    return block
+
+
+@pytest.mark.parametrize('block', [make_legacy_block(), make_block(), dict(make_block(), hash='ef' * 32),
+                                   dict(make_legacy_block(), transactions=[])])
+@pytest.mark.parametrize('address_table', [True, False])
+def test_block_round_trip(block, address_table):
+    assert codec.decode_block(codec.encode_block(block, address_table)) == block
+
+
+@pytest.mark.parametrize('block', [make_legacy_block(), make_block()])
+def test_block_hash_survives_round_trip(block):
+    decoded = codec.decode_block(codec.encode_block(block))
+    assert Block.from_dict(decoded).hash == Block.from_dict(block).hash
+    assert Block.from_dict(decoded).serialize() == Block.from_dict(block).serialize()
+
+
+def test_blocks_round_trip():
+    blocks = [make_legacy_block(), make_block(), dict(make_block(), index=4)]
+    assert codec.decode_blocks(codec.encode_blocks(blocks)) == blocks
+    assert list(codec.iter_decode_blocks(codec.iter_encode_blocks(blocks, len(blocks)))) == blocks
+
+
+def test_transaction_round_trip():
+    for tx in make_transactions():
+        decoded = codec.decode_transaction(codec.encode_transaction(tx))
+        assert decoded == tx
+        assert type(decoded['amount']) is type(tx['amount'])
+        assert Transaction(**decoded).tx_id == Transaction(**tx).tx_id
+
+
+# Transaction ids are hashed once per transaction, transactions cannot change under them
+def test_transaction_id_is_computed_once(monkeypatch):
+    hashed = []
+    sha256 = hashlib.sha256
+    counting = SimpleNamespace(sha256=lambda data: hashed.append(data) or sha256(data))
+    monkeypatch.setattr(transaction, 'hashlib', counting)
+    tx = Transaction(**make_transactions()[0])
+    tx_id = tx.tx_id
+    assert tx_id == sha256(json.dumps(tx.to_ordered_dict()).encode()).hexdigest()
+    assert [tx.tx_id for _ in range(3)] == [tx_id] * 3
+    assert len(hashed) == 1
+    with pytest.raises(AttributeError):
+        tx.amount = 5
+    assert tx.tx_id == tx_id
+
+
+@pytest.mark.parametrize('address_table', [True, False])
+def test_transactions_round_trip(address_table):
+    transactions = make_transactions()
+    assert codec.decode_transactions(codec.encode_transactions(transactions, address_table)) == transactions
+
+
+def test_float_keeps_exact_value():
+    tx = dict(make_transactions()[0], amount=0.1 + 0.2)
+    assert codec.decode_transaction(codec.encode_transaction(tx))['amount'] == 0.1 + 0.2
+
+
+@pytest.mark.parametrize('amount', [True, False, '1', None])
+def test_encode_rejects_non_number_amount(amount):
+    with pytest.raises(codec.CodecError):
+        codec.encode_transaction(dict(make_transactions()[0], amount=amount))
+
+
+@pytest.mark.parametrize('field', ['index', 'proof_number', 'bits'])
+@pytest.mark.parametrize('value', [-1, -11, 1.5, True, '7'])
+def test_encode_rejects_invalid_varint_field(field, value):
+    with pytest.raises(codec.CodecError):
+        codec.encode_block(dict(make_block(), **{field: value}))
+
+
+@pytest.mark.parametrize('field', ['index', 'proof_number', 'bits'])
+@pytest.mark.parametrize('value', [-1, 1.5, True, '7'])
+def test_from_dict_rejects_invalid_varint_field(field, value):
+    with pytest.raises(ValueError):
+        Block.from_dict(dict(make_block(), **{field: value}))
+
+
+def test_decode_rejects_truncated_data():
+    data = codec.encode_block(make_block())
+    with pytest.raises(codec.CodecError):
+        codec.decode_block(data[:-5])
+    with pytest.raises(codec.CodecError):
+        codec.decode_block(b'\x02' + data[1:])
+
+
+# Records written as json before the binary format stay readable next to binary ones
+def test_store_reads_json_and_binary_records(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    legacy, current = make_legacy_block(), dict(make_block(), index=4)
+    store = block_store.BlockStore('codec')
+    store.load()
+    monkeypatch.setattr(block_store, 'STORE_FORMAT', 'json')
+    store.append(dict(legacy, index=0), 'aa' * 32)
+    monkeypatch.setattr(block_store, 'STORE_FORMAT', 'binary')
+    store.append(dict(current, index=1), 'bb' * 32)
+    store.sync()
+    reloaded = block_store.BlockStore('codec')
+    reloaded.load()
+    index, _, _ = reloaded.index_snapshot()
+    assert reloaded.read_entry(index[0]) == json.loads(json.dumps(dict(legacy, index=0, hash='aa' * 32)))
+    assert reloaded.read_entry(index[1]) == dict(current, index=1, hash='bb' * 32)
+
+
+# A negative proof number used to make the encoder loop forever while add_block held the writer lock
+@pytest.mark.parametrize('field, value', [('proof_number', -11), ('index', -1), ('bits', True)])
+def test_add_block_rejects_invalid_fields(tmp_path, monkeypatch, field, value):
+    monkeypatch.chdir(tmp_path)
+    blockchain = Blockchain(None, 'codec')
+    block = {'index': 1, 'previous_hash': blockchain.chain.get_hash(0), 'transactions': [], 'proof_number': 5,
+             'timestamp': 1546300800.0, field: value}
+    assert not blockchain.add_block(block)
+    assert len(blockchain.chain) == 1
+
+
+@pytest.mark.parametrize('block', [make_legacy_block(), make_block()])
+def test_decode_block_header(block):
+    header = {field: value for field, value in block.items() if field != 'transactions'}
+    data = codec.encode_block(dict(block, hash='ef' * 32))
+    assert codec.decode_block_header(data) == header
+    assert codec.decode_block_header(data[:block_store.BLOCK_HEADER_READ]) == header
+
+
+# Headers read from json and binary records without decoding bodies match the headers of the decoded blocks
+def test_store_reads_headers(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    store = block_store.BlockStore('codec')
+    store.load()
+    blocks = [dict(make_legacy_block(), index=0), dict(make_block(), index=1)]
+    monkeypatch.setattr(block_store, 'STORE_FORMAT', 'json')
+    store.append(blocks[0], 'aa' * 32)
+    monkeypatch.setattr(block_store, 'STORE_FORMAT', 'binary')
+    store.append(blocks[1], 'bb' * 32)
+    index, _, _ = store.index_snapshot()
+    for entry, block in zip(index, blocks):
+        expected = Block.from_dict(block).header()
+        expected['hash'] = entry[3]
+        assert store.read_header_entry(entry) == expected
+
+
+def test_get_headers_matches_blocks(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    blockchain = Blockchain('ab' * 16, 'codec')
+    for _ in range(3):
+        blockchain.mine_block()
+    reloaded = Blockchain(None, 'codec')
+    assert reloaded.get_headers(1, 10) == [block.header() for block in blockchain.chain[1:]]
+    assert reloaded.get_headers(0, 2) == [block.header() for block in blockchain.chain[0:2]]
@@ -0,0 +1,87 @@
+import math
+import threading
+
+from blockchain import Blockchain
+from wallet import Wallet
+
+WRITERS = 3
+READERS = 3
+TRANSACTIONS = 150
+
+
+def close(first, second):
+    return math.isclose(first, second, abs_tol=1e-9)
+
+
+# Every published state must be one the writer could have left behind, whatever it is doing meanwhile
+def check_state(state, sender):
+    chain = state.chain
+    blocks = list(chain)
+    assert [block.index for block in blocks] == list(range(len(chain)))
+    for previous_block, block in zip(blocks, blocks[1:]):
+        assert block.previous_hash == previous_block.hash
+    confirmed = {tx.tx_id for block in blocks for tx in block.transactions}
+    open_transactions = list(state.open_transactions)
+    assert len(open_transactions) == len(state.open_transactions)
+    assert not confirmed & {tx.tx_id for tx in open_transactions}
+    assert close(state.pending_spent.get(sender), sum(tx.amount for tx in open_transactions if tx.sender == sender))
+    balance = sum(tx.amount for block in blocks for tx in block.transactions if tx.recipient == sender) - sum(
+        tx.amount for block in blocks for tx in block.transactions if tx.sender == sender)
+    assert close(state.balances.get(sender, 0), balance)
+
+
+def test_readers_see_consistent_states_while_writing(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wallet = Wallet('concurrency')
+    wallet.create_keys()
+    blockchain = Blockchain(wallet.public_key, 'concurrency')
+    for _ in range(3):
+        blockchain.mine_block()
+    payments = [(wallet.public_key, 'recipient{}'.format(number % 7), 0.01 + number / 10000)
+                for number in range(TRANSACTIONS)]
+    signatures = wallet.sign_transactions(payments)
+    accepted = []
+    errors = []
+    writing = threading.Event()
+    writing.set()
+
+    # Failed assertions in a thread do not fail the test on their own
+    def run(target):
+        def guarded(*args):
+            try:
+                target(*args)
+            except Exception as e:
+                errors.append(e)
+        return guarded
+
+    def write(batch):
+        for (sender, recipient, amount), signature in batch:
+            if blockchain.add_new_transaction(sender, recipient, signature, amount):
+                accepted.append(signature)
+
+    def mine():
+        while writing.is_set():
+            blockchain.mine_block()
+
+    def read():
+        while writing.is_set():
+            check_state(blockchain.get_state(), wallet.public_key)
+
+    items = list(zip(payments, signatures))
+    writers = [threading.Thread(target=run(write), args=(items[number::WRITERS],)) for number in range(WRITERS)]
+    others = [threading.Thread(target=run(mine))] + [threading.Thread(target=run(read)) for _ in range(READERS)]
+    for thread in writers + others:
+        thread.start()
+    for thread in writers:
+        thread.join()
+    writing.clear()
+    for thread in others:
+        thread.join()
+    assert errors == []
+    check_state(blockchain.get_state(), wallet.public_key)
+    # Every accepted transaction is either confirmed once or still outstanding
+    confirmed = [tx.signature for block in blockchain.chain for tx in block.transactions if tx.sender != 'REWARD']
+    outstanding = [tx.signature for tx in blockchain.get_open_transactions()]
+    assert len(confirmed) == len(set(confirmed))
+    assert sorted(confirmed + outstanding) == sorted(accepted)
+    assert len(accepted) == TRANSACTIONS
@@ -0,0 +1,47 @@
+import gossip
+from block import Block
+from gossip import Gossip
+from transaction import Transaction
+
+
+def no_block(block_hash, index):
+    return False
+
+
+def test_requested_ids_are_not_asked_again_while_in_flight():
+    node = Gossip(None)
+    assert node.get_wanted(['aa'], [{'hash': 'bb', 'index': 1}], no_block) == {'transactions': ['aa'],
+                                                                              'blocks': ['bb']}
+    assert node.get_wanted(['aa'], [{'hash': 'bb', 'index': 1}], no_block) == {'transactions': [], 'blocks': []}
+
+
+# A fetch that never delivers an accepted item is retried from the next announcer once it timed out
+def test_failed_fetch_is_retried_after_timeout(monkeypatch):
+    node = Gossip(None)
+    now = [1000.0]
+    monkeypatch.setattr(gossip, 'time', lambda: now[0])
+    assert node.get_wanted(['aa'], [], no_block)['transactions'] == ['aa']
+    now[0] += gossip.GOSSIP_FETCH_TIMEOUT - 1
+    assert node.get_wanted(['aa'], [], no_block)['transactions'] == []
+    now[0] += 1
+    assert node.get_wanted(['aa'], [], no_block)['transactions'] == ['aa']
+
+
+def test_accepted_items_are_not_wanted():
+    node = Gossip(None)
+    tx = Transaction('alice', 'bob', 1, 'aa')
+    block = Block(1, 'cc', [Transaction('REWARD', 'alice', 1, '')], 5, 1546300800.0)
+    node.get_wanted([tx.tx_id], [{'hash': block.hash, 'index': 1}], no_block)
+    node.announce([], transactions=[tx], blocks=[block])
+    assert node.get_wanted([tx.tx_id], [{'hash': block.hash, 'index': 1}], no_block) == {'transactions': [],
+                                                                                        'blocks': []}
+
+
+# An identical payment after the first one was confirmed has the same id and must still be fetched
+def test_confirmed_transaction_id_is_wanted_again():
+    node = Gossip(None)
+    tx = Transaction('alice', 'bob', 1, 'aa')
+    node.announce([], transactions=[tx])
+    assert node.get_wanted([tx.tx_id], [], no_block)['transactions'] == []
+    node.announce([], blocks=[Block(1, 'cc', [tx], 5, 1546300800.0)])
+    assert node.get_wanted([tx.tx_id], [], no_block)['transactions'] == [tx.tx_id]
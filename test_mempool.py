@@ -0,0 +1,80 @@
+import pytest
+
+from blockchain import Blockchain
+from mempool import Mempool
+from transaction import Transaction
+from verification import Verification
+from wallet import Wallet
+
+
+def test_bad_amount_leaves_pool_unchanged():
+    mempool = Mempool()
+    assert mempool.add(Transaction('alice', 'bob', 2, 'aa'))
+    with pytest.raises(TypeError):
+        mempool.add(Transaction('alice', 'bob', '3', 'bb'))
+    assert len(mempool) == 1
+    assert mempool.pending_spent('alice') == 2
+
+
+def test_full_pool_evicts_oldest():
+    mempool = Mempool(max_size=2)
+    for signature in ('aa', 'bb', 'cc'):
+        mempool.add(Transaction('alice', 'bob', 1, signature))
+    assert [tx.signature for tx in mempool] == ['bb', 'cc']
+    assert mempool.pending_spent('alice') == 2
+
+
+@pytest.mark.parametrize('amount', [1, 0.5])
+def test_valid_amount(amount):
+    assert Verification.valid_amount(amount)
+
+
+@pytest.mark.parametrize('amount', ['1', True, None, 0, -1, float('nan'), float('inf')])
+def test_invalid_amount(amount):
+    assert not Verification.valid_amount(amount)
+
+
+@pytest.mark.parametrize('amount', ['1', True, float('nan'), -1])
+def test_admission_rejects_invalid_amount(tmp_path, monkeypatch, amount):
+    monkeypatch.chdir(tmp_path)
+    blockchain = Blockchain(None, 'mempool')
+    assert not blockchain.add_new_transaction('aa', 'bb', 'cc', amount, is_receiving=True)
+    assert blockchain.get_open_transactions() == []
+
+
+# One malformed item of a batch is rejected on its own, the others are still admitted
+def test_batch_rejects_malformed_items_alone(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wallet = Wallet('mempool')
+    wallet.create_keys()
+    blockchain = Blockchain(wallet.public_key, 'mempool')
+    valid = (wallet.public_key, 'bb', wallet.sign_transaction(wallet.public_key, 'bb', 2), 2)
+    malformed = [
+        ('not hex', 'bb', valid[2], 2),
+        (wallet.public_key, 'bb', 'not hex', 2),
+        (wallet.public_key, 'bb', valid[2], '2'),
+        (wallet.public_key, 'bb', valid[2], True),
+        (12, 'bb', valid[2], 2),
+    ]
+    assert blockchain.add_new_transactions(malformed + [valid], is_receiving=True) == ['invalid'] * 5 + [None]
+    assert len(blockchain.get_open_transactions()) == 1
+    for sender, recipient, signature, amount in malformed:
+        assert not blockchain.add_new_transaction(sender, recipient, signature, amount, is_receiving=True)
+
+
+# Snapshots keep the pool as it was when they were taken, across evictions and restarted records
+def test_snapshot_is_not_affected_by_later_changes():
+    mempool = Mempool(max_size=3)
+    expected = []
+    for number in range(200):
+        tx = Transaction('alice' if number % 2 else 'bob', 'carol', number + 1, 'sig{}'.format(number))
+        mempool.add(tx)
+        if number % 7 == 0:
+            mempool.remove(tx.tx_id)
+        pool = list(mempool)
+        snapshot = mempool.snapshot()
+        expected.append((snapshot, pool, {address: mempool.pending_spent(address) for address in ('alice', 'bob')}))
+    for snapshot, pool, spent in expected:
+        assert list(snapshot) == pool
+        assert len(snapshot) == len(pool)
+        assert {address: snapshot.pending_spent.get(address) for address in spent} == spent
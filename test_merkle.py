@@ -0,0 +1,86 @@
+import hashlib
+
+import pytest
+
+import merkle
+from benchmark import load_node
+
+TX_IDS = [hashlib.sha256(str(position).encode()).hexdigest() for position in range(7)]
+
+
+def parent(left, right):
+    return hashlib.sha256(b'\x01' + bytes.fromhex(left) + bytes.fromhex(right)).hexdigest()
+
+
+def test_single_transaction_is_its_own_root():
+    assert merkle.merkle_root(TX_IDS[:1]) == TX_IDS[0]
+    assert merkle.merkle_proof(TX_IDS[:1], 0) == []
+    assert merkle.verify_proof(TX_IDS[0], [], TX_IDS[0])
+
+
+# The last leaf of an odd level has no sibling and moves up unpaired
+def test_odd_leaf_count():
+    a, b, c = TX_IDS[:3]
+    assert merkle.merkle_root([a, b, c]) == parent(parent(a, b), c)
+    assert merkle.merkle_proof([a, b, c], 2) == [{'side': 'left', 'hash': parent(a, b)}]
+    # Pairing the last leaf with itself would give the same root to a list with it repeated
+    assert merkle.merkle_root([a, b, c]) != merkle.merkle_root([a, b, c, c])
+    a, b, c, d, e = TX_IDS[:5]
+    assert merkle.merkle_root([a, b, c, d, e]) == parent(parent(parent(a, b), parent(c, d)), e)
+
+
+@pytest.mark.parametrize('count', range(1, len(TX_IDS) + 1))
+def test_every_proof_verifies(count):
+    tx_ids = TX_IDS[:count]
+    root = merkle.merkle_root(tx_ids)
+    for position, tx_id in enumerate(tx_ids):
+        proof = merkle.merkle_proof(tx_ids, position)
+        assert len(proof) <= (count - 1).bit_length()
+        assert merkle.verify_proof(tx_id, proof, root)
+
+
+@pytest.mark.parametrize('tamper', [
+    lambda tx_id, proof: (TX_IDS[0], proof),
+    lambda tx_id, proof: (tx_id, proof[:-1]),
+    lambda tx_id, proof: (tx_id, [dict(proof[0], hash=TX_IDS[0])] + proof[1:]),
+    lambda tx_id, proof: (tx_id, [dict(proof[0], side='left' if proof[0]['side'] == 'right' else 'right')] + proof[1:]),
+    lambda tx_id, proof: (tx_id, [{'side': 'left'}] + proof[1:]),
+    lambda tx_id, proof: (tx_id, [dict(proof[0], hash='not hex')] + proof[1:]),
+    lambda tx_id, proof: (tx_id, None),
+])
+def test_tampered_proof_fails(tamper):
+    root = merkle.merkle_root(TX_IDS)
+    tx_id, proof = tamper(TX_IDS[5], merkle.merkle_proof(TX_IDS, 5))
+    assert not merkle.verify_proof(tx_id, proof, root)
+
+
+# Proofs served by the node verify against the Merkle root of the block the transaction is in
+def test_node_serves_proofs(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    node = load_node('merkle')
+    client = node.app.test_client()
+    client.post('/wallet')
+    node.blockchain.mine_block()
+    for amount in (0.125, 0.25):
+        assert client.post('/transaction', json={'recipient': 'ab', 'amount': amount}).status_code == 201
+    block = node.blockchain.mine_block()
+    assert len(block.transactions) == 3
+    for position, tx in enumerate(block.transactions):
+        # Rewards of one miner are identical, the height picks the block
+        response = client.get('/transaction/{}/proof?height={}'.format(tx.tx_id, block.index))
+        assert response.status_code == 200
+        proof = response.get_json()
+        assert (proof['height'], proof['position'], proof['block_hash']) == (block.index, position, block.hash)
+        header = client.get('/chain/headers?start={}&end={}'.format(block.index, block.index + 1)).get_json()[0]
+        assert proof['merkle_root'] == header['merkle_root'] == block.merkle_root
+        assert merkle.verify_proof(tx.tx_id, proof['proof'], header['merkle_root'])
+
+
+def test_node_proof_of_unknown_transaction_is_not_found(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    node = load_node('merkle')
+    node.app.test_client().post('/wallet')
+    node.blockchain.mine_block()
+    response = node.app.test_client().get('/transaction/{}/proof'.format('ab' * 32))
+    assert response.status_code == 404
+    assert response.get_json() == {'message': 'No Merkle proof found'}
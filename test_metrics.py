@@ -0,0 +1,85 @@
+import asyncio
+
+import pytest
+from aiohttp.test_utils import TestClient, TestServer
+
+import async_node
+import metrics
+from benchmark import load_node
+
+INVALID_RATES = ['fast', '0.5', True, float('nan'), [0.5], {'rate': 0.5}]
+
+
+@pytest.fixture
+def profiler(monkeypatch):
+    profiler = metrics.Profiler()
+    monkeypatch.setattr(metrics, 'PROFILER', profiler)
+    return profiler
+
+
+@pytest.fixture
+def node(tmp_path, monkeypatch, profiler):
+    monkeypatch.chdir(tmp_path)
+    node = load_node('metrics')
+    node.app.test_client().post('/wallet')
+    return node
+
+
+@pytest.mark.parametrize('sample_rate', INVALID_RATES)
+def test_profiler_rejects_invalid_sample_rate(profiler, sample_rate):
+    profiler.configure(True, 0.25)
+    with pytest.raises(ValueError):
+        profiler.configure(False, sample_rate)
+    assert (profiler.enabled, profiler.sample_rate) == (True, 0.25)
+
+
+@pytest.mark.parametrize('sample_rate, expected', [(0.5, 0.5), (2, 1.0), (-1, 0.0)])
+def test_profiler_clamps_sample_rate(profiler, sample_rate, expected):
+    profiler.configure(True, sample_rate)
+    assert profiler.sample_rate == expected
+
+
+@pytest.mark.parametrize('sample_rate', INVALID_RATES)
+def test_configure_profile_rejects_invalid_sample_rate(node, profiler, sample_rate):
+    response = node.app.test_client().post('/metrics/profile', json={'enabled': True, 'sample_rate': sample_rate})
+    assert response.status_code == 400
+    assert 'sample_rate' in response.get_json()['message']
+    assert not profiler.enabled
+
+
+def test_configure_profile(node, profiler):
+    response = node.app.test_client().post('/metrics/profile', json={'enabled': False, 'sample_rate': 0.5})
+    assert response.status_code == 200
+    assert response.get_json() == {'enabled': False, 'sample_rate': 0.5}
+
+
+async def async_post(path, values):
+    async with TestClient(TestServer(async_node.create_app(5998))) as client:
+        response = await client.post(path, json=values)
+        return response.status, await response.json()
+
+
+@pytest.mark.parametrize('sample_rate', ['fast', True, [0.5]])
+def test_async_configure_profile_rejects_invalid_sample_rate(tmp_path, monkeypatch, profiler, sample_rate):
+    monkeypatch.chdir(tmp_path)
+    status, answer = asyncio.run(async_post('/metrics/profile', {'enabled': True, 'sample_rate': sample_rate}))
+    assert status == 400
+    assert 'sample_rate' in answer['message']
+    assert not profiler.enabled
+
+
+def test_async_configure_profile(tmp_path, monkeypatch, profiler):
+    monkeypatch.chdir(tmp_path)
+    status, answer = asyncio.run(async_post('/metrics/profile', {'enabled': False, 'sample_rate': 0.5}))
+    assert (status, answer) == (200, {'enabled': False, 'sample_rate': 0.5})
+
+
+def test_metrics_report_mempool_size(node):
+    client = node.app.test_client()
+    node.blockchain.mine_block()
+    assert node.blockchain.get_open_transaction_count() == 0
+    for amount in (0.125, 0.25):
+        assert client.post('/transaction', json={'recipient': 'ab', 'amount': amount}).status_code == 201
+    assert node.blockchain.get_open_transaction_count() == 2
+    lines = client.get('/metrics').get_data(as_text=True).splitlines()
+    assert 'mythcoin_mempool_size 2.0' in lines
@@ -0,0 +1,112 @@
+import threading
+import time
+
+import pytest
+
+import difficulty
+from benchmark import load_node
+from blockchain import Blockchain
+from miner import Miner
+from verification import ProofContext
+
+# Target of 1, no proof is found before mining is cancelled
+HARD_BITS = 0x03000001
+
+
+# Cancels until mining returns, a cancel landing before the workers start would be cleared by mine
+def cancel_until_finished(cancel, thread):
+    while thread.is_alive():
+        cancel()
+        thread.join(0.05)
+
+
+def wait_for(condition, timeout=30):
+    deadline = time.time() + timeout
+    while not condition():
+        assert time.time() < deadline
+        time.sleep(0.02)
+
+
+@pytest.mark.parametrize('workers', [1, 2])
+def test_cancel_stops_workers(workers):
+    miner = Miner(workers)
+    results = []
+    try:
+        thread = threading.Thread(target=lambda: results.append(miner.mine('prefix', 1)))
+        thread.start()
+        time.sleep(0.2)
+        cancel_until_finished(miner.cancel, thread)
+        assert results == [None]
+        assert miner.hashes > 0
+        # Every worker returned, the pool takes the next template
+        assert ProofContext('prefix').valid(miner.mine('prefix'))
+    finally:
+        miner.close()
+
+
+@pytest.fixture
+def hard(monkeypatch):
+    next_bits = difficulty.next_bits
+    hard = [True]
+    monkeypatch.setattr(difficulty, 'next_bits',
+                        lambda height, get_block: HARD_BITS if hard[0] else next_bits(height, get_block))
+    return hard
+
+
+def test_cancelled_mine_adds_no_block(tmp_path, monkeypatch, hard):
+    monkeypatch.chdir(tmp_path)
+    blockchain = Blockchain('ab' * 16, 'mining')
+    blocks = []
+    thread = threading.Thread(target=lambda: blocks.append(blockchain.mine_block()))
+    thread.start()
+    time.sleep(0.2)
+    cancel_until_finished(blockchain.cancel_mining, thread)
+    assert blocks == [None]
+    assert len(blockchain.chain) == 1
+    assert blockchain.get_balance() == 0
+    hard[0] = False
+    assert blockchain.mine_block() is not None
+    assert len(blockchain.chain) == 2
+
+
+def test_mining_job_lifecycle(tmp_path, monkeypatch, hard):
+    monkeypatch.chdir(tmp_path)
+    node = load_node('mining')
+    client = node.app.test_client()
+    client.post('/wallet')
+
+    def get_job(job_id):
+        response = client.get('/mine/{}'.format(job_id))
+        assert response.status_code == 200
+        return response.get_json()
+
+    response = client.post('/mine')
+    assert response.status_code == 202
+    running = response.get_json()['job']
+    assert running['status'] == 'queued'
+    wait_for(lambda: get_job(running['id'])['job']['status'] == 'running')
+    queued = client.post('/mine').get_json()['job']
+    status = client.get('/mine/status').get_json()
+    assert status['running']['id'] == running['id']
+    assert status['queued'] == 1
+    assert get_job(queued['id'])['job']['status'] == 'queued'
+
+    assert client.delete('/mine/{}'.format(queued['id'])).status_code == 200
+    assert get_job(queued['id'])['job']['status'] == 'cancelled'
+    assert client.get('/mine/status').get_json()['queued'] == 0
+    # Give the running job time to start its workers, then cancel it
+    time.sleep(0.3)
+    assert client.delete('/mine/{}'.format(running['id'])).status_code == 200
+    wait_for(lambda: get_job(running['id'])['job']['status'] == 'cancelled')
+    assert client.delete('/mine/{}'.format(running['id'])).status_code == 404
+    wait_for(lambda: client.get('/mine/status').get_json() == {'running': None, 'queued': 0})
+    assert len(node.blockchain.chain) == 1
+
+    hard[0] = False
+    done = client.post('/mine').get_json()['job']
+    wait_for(lambda: get_job(done['id'])['job']['status'] == 'done')
+    answer = get_job(done['id'])
+    assert answer['message'] == 'Block added successfully'
+    assert answer['block'] == node.blockchain.chain[-1].to_dict()
+    assert len(node.blockchain.chain) == 2
+    assert client.get('/mine/{}'.format('ab' * 16)).status_code == 404
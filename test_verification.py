@@ -0,0 +1,152 @@
+import hashlib
+import json
+import time
+
+import pytest
+
+import difficulty
+import merkle
+from block import Block
+from blockchain import Blockchain
+from blockchain_settings import MINING_REWARD
+from transaction import Transaction
+from verification import Verification, ProofContext
+from wallet import Wallet
+
+
+@pytest.fixture
+def mined(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wallet = Wallet('verification')
+    wallet.create_keys()
+    blockchain = Blockchain(wallet.public_key, 'verification')
+    blockchain.mine_block()
+    return wallet, blockchain
+
+
+# Block on top of the chain with a valid proof of work, Merkle root and bits, whatever its transactions
+def forge_block(blockchain, transactions, timestamp=None, index=None):
+    chain = blockchain.chain
+    previous = chain[-1]
+    index = len(chain) if index is None else index
+    merkle_root = merkle.merkle_root([tx.tx_id for tx in transactions])
+    timestamp = previous.timestamp + 1 if timestamp is None else timestamp
+    bits = difficulty.next_bits(index, lambda height: chain[height])
+    prefix = Verification.header_prefix(index, previous.hash, merkle_root, timestamp, bits)
+    context = ProofContext(prefix, difficulty.bits_to_target(bits))
+    proof_number = next(proof for proof in range(10 ** 7) if context.valid(proof))
+    return Block(index, previous.hash, transactions, proof_number, timestamp, bits, merkle_root)
+
+
+def reward(wallet):
+    return Transaction('REWARD', wallet.public_key, MINING_REWARD, '')
+
+
+def transfer(wallet, amount=0.5):
+    return Transaction(wallet.public_key, 'ab', amount, wallet.sign_transaction(wallet.public_key, 'ab', amount))
+
+
+def test_mined_chain_is_valid(mined):
+    wallet, blockchain = mined
+    blockchain.mine_block()
+    assert Verification.verify_chain(list(blockchain.chain), blockchain.get_hash)
+
+
+def test_valid_forged_block_passes(mined):
+    wallet, blockchain = mined
+    block = forge_block(blockchain, [transfer(wallet), reward(wallet)])
+    assert Verification.verify_chain([blockchain.chain[-1], block], blockchain.get_hash)
+    assert blockchain.add_block(block.to_dict())
+
+
+@pytest.mark.parametrize('make_transactions', [
+    # Unsigned transfer placed where the reward belongs
+    lambda wallet: [Transaction(wallet.public_key, 'ab', 0.5, '')],
+    lambda wallet: [Transaction('REWARD', wallet.public_key, MINING_REWARD * 100, '')],
+    lambda wallet: [Transaction('REWARD', wallet.public_key, MINING_REWARD, 'ab')],
+    lambda wallet: [reward(wallet), reward(wallet)],
+    lambda wallet: [],
+])
+def test_block_without_valid_reward_is_rejected(mined, make_transactions):
+    wallet, blockchain = mined
+    block = forge_block(blockchain, make_transactions(wallet))
+    assert not Verification.verify_chain([blockchain.chain[-1], block], blockchain.get_hash)
+    assert not blockchain.add_block(block.to_dict())
+
+
+def test_block_with_forged_signature_is_rejected(mined):
+    wallet, blockchain = mined
+    forged = Transaction(wallet.public_key, 'ab', 0.5, transfer(wallet, 0.25).signature)
+    block = forge_block(blockchain, [forged, reward(wallet)])
+    assert not Verification.verify_chain([blockchain.chain[-1], block], blockchain.get_hash)
+    assert not blockchain.add_block(block.to_dict())
+
+
+@pytest.mark.parametrize('make_timestamp', [
+    # Not after the median of the blocks below
+    lambda chain: difficulty.median_time(len(chain), lambda height: chain[height]),
+    lambda chain: chain[-1].timestamp - 1,
+    lambda chain: time.time() + difficulty.MAX_FUTURE_DRIFT + 60,
+])
+def test_block_with_invalid_timestamp_is_rejected(mined, make_timestamp):
+    wallet, blockchain = mined
+    blockchain.mine_block()
+    block = forge_block(blockchain, [reward(wallet)], make_timestamp(blockchain.chain))
+    assert not Verification.verify_chain([blockchain.chain[-2], blockchain.chain[-1], block], blockchain.get_hash)
+    assert not blockchain.add_block(block.to_dict())
+
+
+# Malformed bits and timestamps are rejected without computing a target from them
+@pytest.mark.parametrize('field, value', [('bits', 1 << 40), ('bits', 0xff7fffff), ('bits', '7'),
+                                          ('timestamp', '1546300800'), ('timestamp', float('nan')),
+                                          ('timestamp', True)])
+def test_block_with_malformed_header_is_rejected(mined, field, value):
+    wallet, blockchain = mined
+    block = dict(forge_block(blockchain, [reward(wallet)]).to_dict(), **{field: value})
+    assert not blockchain.add_block(block)
+    assert len(blockchain.chain) == 2
+
+
+# A block linking to the tip with a lower index used to replace the tip and leave balances counting it
+def test_block_with_wrong_index_is_rejected(mined):
+    wallet, blockchain = mined
+    blockchain.mine_block()
+    balance = blockchain.get_balance()
+    block = forge_block(blockchain, [reward(wallet)], index=len(blockchain.chain) - 1)
+    assert block.previous_hash == blockchain.chain.get_hash(-1)
+    assert not blockchain.add_block(block.to_dict())
+    assert len(blockchain.chain) == 3
+    assert blockchain.get_balance() == balance
+
+
+# Baseline formulas blocks without bits or Merkle root were mined and hashed with
+def baseline_hash(block):
+    hashed_block = {'index': block.index, 'previous_hash': block.previous_hash, 'proof_number': block.proof_number,
+                    'timestamp': block.timestamp,
+                    'transactions': [tx.to_ordered_dict() for tx in block.transactions]}
+    return hashlib.sha256(json.dumps(hashed_block, sort_keys=True).encode()).hexdigest()
+
+
+def baseline_valid_proof(transactions, previous_hash, proof_number):
+    guess = (str([tx.to_ordered_dict() for tx in transactions]) + str(previous_hash) + str(proof_number)).encode()
+    return hashlib.sha256(guess).hexdigest()[0:2] == '00'
+
+
+LEGACY_TRANSACTIONS = [Transaction('ab' * 8, 'cd' * 8, 0.25, 'ef' * 16),
+                       Transaction('REWARD', 'ab' * 8, MINING_REWARD, '')]
+LEGACY_PREVIOUS_HASH = '12' * 32
+
+
+# Blocks stored or served before bits and Merkle roots keep their hash and proof of work
+def test_legacy_block_matches_baseline():
+    transactions = LEGACY_TRANSACTIONS[:-1]
+    proofs = [proof for proof in range(2000) if baseline_valid_proof(transactions, LEGACY_PREVIOUS_HASH, proof)]
+    assert proofs
+    context = ProofContext(Verification.proof_prefix(transactions, LEGACY_PREVIOUS_HASH))
+    for proof in range(2000):
+        assert Verification.valid_proof(transactions, LEGACY_PREVIOUS_HASH, proof) == (proof in proofs)
+        assert context.valid(proof) == (proof in proofs)
+    block = Block(7, LEGACY_PREVIOUS_HASH, LEGACY_TRANSACTIONS, proofs[0], 1546300800.5)
+    assert Verification.valid_block_proof(block)
+    assert block.hash == baseline_hash(block)
+    assert Block.from_dict(json.loads(json.dumps(block.to_dict()))).hash == baseline_hash(block)
@@ -0,0 +1,76 @@
+from collections import OrderedDict
+
+import pytest
+
+import wallet as wallet_module
+from blockchain_settings import PARALLEL_SIGN_THRESHOLD
+from transaction import Transaction
+from wallet import Wallet
+
+
+@pytest.fixture
+def wallet(tmp_path, monkeypatch):
+    monkeypatch.chdir(tmp_path)
+    wallet = Wallet('signatures')
+    wallet.create_keys()
+    return wallet
+
+
+# Empty signature cache, counts the signatures actually checked
+@pytest.fixture
+def verified(monkeypatch):
+    verified = []
+    verify_signature = wallet_module._verify_signature
+    monkeypatch.setattr(wallet_module, '_verified_signatures', OrderedDict())
+    monkeypatch.setattr(wallet_module, '_verify_signature', lambda *tx: verified.append(tx) or verify_signature(*tx))
+    return verified
+
+
+def signed(wallet, recipient='ab', amount=0.5):
+    signature = wallet.sign_transaction(wallet.public_key, recipient, amount)
+    return Transaction(wallet.public_key, recipient, amount, signature)
+
+
+@pytest.mark.parametrize('make_transaction, valid', [
+    (signed, True),
+    (lambda wallet: Transaction(wallet.public_key, 'ab', 0.75, signed(wallet).signature), False),
+    (lambda wallet: Transaction(wallet.public_key, 'ab', 0.5, 'not hex'), False),
+])
+def test_cache_hit_matches_cold_verify(wallet, verified, make_transaction, valid):
+    transaction = make_transaction(wallet)
+    cold = Wallet.verify_transaction(transaction)
+    assert cold == valid
+    assert Wallet.verify_transaction(transaction) == cold
+    assert Wallet.verify_transactions([transaction, transaction]) == [cold, cold]
+    assert len(verified) == 1
+
+
+# Results are cached by transaction id, which covers the signature, a cached transfer vouches for no other
+def test_forged_signature_rejected_after_valid_one_is_cached(wallet, verified):
+    valid = signed(wallet)
+    assert Wallet.verify_transaction(valid)
+    forgeries = [
+        Transaction(valid.sender, valid.recipient, 5, valid.signature),
+        Transaction(valid.sender, 'cd', valid.amount, valid.signature),
+        Transaction(valid.sender, valid.recipient, valid.amount, signed(wallet, amount=0.25).signature),
+        Transaction(valid.sender, valid.recipient, valid.amount,
+                    valid.signature[:-2] + ('00' if valid.signature[-2:] != '00' else '01')),
+    ]
+    for forged in forgeries:
+        assert not Wallet.verify_transaction(forged)
+    assert Wallet.verify_transactions([valid] + forgeries) == [True] + [False] * len(forgeries)
+    assert len(verified) == 1 + len(forgeries)
+
+
+# Small batches are signed in process, large ones on the process pool
+@pytest.mark.parametrize('count', [3, PARALLEL_SIGN_THRESHOLD])
+def test_bulk_signed_transactions_verify(wallet, verified, count):
+    transfers = [(wallet.public_key, 'recipient-{}'.format(position), position / 1000) for position in range(count)]
+    signatures = wallet.sign_transactions(transfers)
+    assert len(signatures) == count
+    assert signatures[:3] == [wallet.sign_transaction(*transfer) for transfer in transfers[:3]]
+    for (sender, recipient, amount), signature in zip(transfers, signatures):
+        assert Wallet.verify_transaction(Transaction(sender, recipient, amount, signature))
+    assert len(verified) == count
+    # Signatures stay bound to their own transfer
+    assert not Wallet.verify_transaction(Transaction(wallet.public_key, 'recipient-1', 0.002, signatures[1]))
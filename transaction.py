@@ -1,12 +1,22 @@
+import hashlib
+import json
 from collections import OrderedDict
 
 
+# Transaction is immutable after construction, so its id is computed once
 class Transaction:
+    __slots__ = ('sender', 'recipient', 'amount', 'signature', '_tx_id')
+
     def __init__(self, sender, recipient, amount, signature):
-        self.sender = sender
-        self.recipient = recipient
-        self.amount = amount
-        self.signature = signature
+        set_field = super().__setattr__
+        set_field('sender', sender)
+        set_field('recipient', recipient)
+        set_field('amount', amount)
+        set_field('signature', signature)
+        set_field('_tx_id', None)
+
+    def __setattr__(self, name, value):
+        raise AttributeError('Transaction is immutable')
 
     def to_ordered_dict(self):
         return OrderedDict(
@@ -18,5 +28,12 @@ class Transaction:
             ]
         )
 
+    # Hash of sender, recipient, amount and signature identifying the transaction
+    @property
+    def tx_id(self):
+        if self._tx_id is None:
+            super().__setattr__('_tx_id', hashlib.sha256(json.dumps(self.to_ordered_dict()).encode()).hexdigest())
+        return self._tx_id
+
     def __repr__(self):
-        return str(self.__dict__)
+        return str(dict(self.to_ordered_dict()))
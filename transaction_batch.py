@@ -0,0 +1,76 @@
+import metrics
+from blockchain import REJECTION_MESSAGES
+from blockchain_settings import TRANSACTION_BATCH_MAX
+
+# Batched transaction submission shared by node.py and async_node.py
+'''
+    Takes parsed request items and returns plain dicts with a status code, each node turns them into
+    its own response type. Every function may block on signing or the writer lock, the async node
+    runs them on its executor.
+'''
+
+RELAYED_FIELDS = ['sender', 'recipient', 'amount', 'signature']
+
+
+# Checks a batch request body, returns an error response and status or None
+def check_batch(values):
+    if not values or not isinstance(values, list):
+        return {'message': 'No data found.'}, 400
+    if len(values) > TRANSACTION_BATCH_MAX:
+        return {'message': 'Too many transactions, at most {} per batch'.format(TRANSACTION_BATCH_MAX)}, 413
+    return None
+
+
+# Signs the complete items of a batch from wallet in one go, None for incomplete items
+def sign_batch(wallet, items):
+    complete = [isinstance(item, dict) and all(field in item for field in ['recipient', 'amount']) for item in items]
+    signatures = iter(wallet.sign_transactions(
+        [(wallet.public_key, item['recipient'], item['amount']) for item, ok in zip(items, complete) if ok]))
+    return [{
+        'sender': wallet.public_key,
+        'recipient': item['recipient'],
+        'amount': item['amount'],
+        'signature': next(signatures)
+    } if ok else None for item, ok in zip(items, complete)]
+
+
+# Transaction dicts of items relayed by a peer, None for items missing a field
+def get_relayed(items):
+    return [{field: item[field] for field in RELAYED_FIELDS}
+            if isinstance(item, dict) and all(field in item for field in RELAYED_FIELDS) else None
+            for item in items]
+
+
+# Adds the complete transactions of a batch, returns a result per item
+'''
+    items: request items, echoed back for incomplete ones
+    transactions: transaction dict per item, None if the item misses required data
+'''
+
+
+def add_batch(blockchain, items, transactions, is_receiving):
+    complete = [tx for tx in transactions if tx is not None]
+    reasons = iter(blockchain.add_new_transactions(
+        [(tx['sender'], tx['recipient'], tx['signature'], tx['amount']) for tx in complete], is_receiving))
+    results = []
+    for item, transaction in zip(items, transactions):
+        reason = next(reasons) if transaction is not None else 'missing_fields'
+        result = {
+            'accepted': reason is None,
+            'transaction': transaction if transaction is not None else item
+        }
+        if reason is not None:
+            result['message'] = REJECTION_MESSAGES[reason]
+            metrics.REJECTED_TRANSACTIONS.inc(reason=reason)
+        results.append(result)
+    return results
+
+
+# Response for the results of a batch and its status, 400 if nothing was accepted
+def batch_response(results):
+    accepted = sum(result['accepted'] for result in results)
+    response = {
+        'message': 'Added {} of {} transactions'.format(accepted, len(results)),
+        'results': results
+    }
+    return response, 201 if accepted else 400
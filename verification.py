@@ -1,10 +1,41 @@
 from wallet import Wallet
 
 import hashlib
-from blockchain_settings import POW_DIFFICULTY
+import json
+import math
+
+import difficulty
+import merkle
+from process_pool import get_pool, chunk_size
+from blockchain_settings import PARALLEL_VERIFY_THRESHOLD, MINING_REWARD
+
+
+def _valid_proofs(proofs):
+    return [ProofContext(prefix, target).valid(proof_number) for prefix, proof_number, target in proofs]
 
 
 class Verification:
+    # Amount must be a finite positive int or float, a bool would be stored as 1.0 and change hashes
+    @staticmethod
+    def valid_amount(amount):
+        return (isinstance(amount, (int, float)) and not isinstance(amount, bool) and math.isfinite(amount)
+                and amount > 0)
+
+    # Checks the last transaction of block is the mining reward and no other one claims to be
+    @staticmethod
+    def valid_reward(block):
+        if not block.transactions:
+            return False
+        reward = block.transactions[-1]
+        if reward.sender != 'REWARD' or reward.amount != MINING_REWARD or reward.signature != '':
+            return False
+        return all(tx.sender != 'REWARD' for tx in block.transactions[:-1])
+
+    # Checks the reward and the amounts of block, signatures are verified separately
+    @classmethod
+    def valid_transactions(cls, block):
+        return cls.valid_reward(block) and all(cls.valid_amount(tx.amount) for tx in block.transactions)
+
     # Verifies transaction validity
     @staticmethod
     def verify_transaction(transaction, get_balance, check_funds=True):
@@ -16,21 +47,119 @@ class Verification:
             return Wallet.verify_transaction(transaction)
 
     # Verifies chain validity
+    '''
+        start: first block to verify, blocks before it are already trusted (e.g. shared with the local chain)
+        get_ancestor: called with a height below the first block of blockchain, returns the block or None
+        if it is not stored. Needed to check the bits of blocks whose retarget window starts below
+        blockchain, without it such windows count as not stored.
+        Links, timestamps and bits are checked in order, proofs of work and signatures of the blocks are
+        independent and verified on the process pool for long suffixes
+    '''
     @classmethod
-    def verify_chain(cls, blockchain, get_hash):
-        for (index, el) in enumerate(blockchain):
-            if index == 0:
-                continue
+    def verify_chain(cls, blockchain, get_hash, start=1, get_ancestor=None):
+        start = max(start, 1)
+        first_height = blockchain[0].index
+
+        def get_block(height):
+            if height >= first_height:
+                return blockchain[height - first_height]
+            return get_ancestor(height) if get_ancestor is not None else None
+
+        proofs = []
+        transactions = []
+        for index in range(start, len(blockchain)):
+            el = blockchain[index]
             if el.previous_hash != get_hash(blockchain[index - 1]):
                 return False
-            if not cls.valid_proof(el.transactions[:-1], el.previous_hash, el.proof_number):
-                print("Proof of work is invalid")
+            if not difficulty.valid_timestamp(el, get_block):
+                print("Block timestamp is invalid")
+                return False
+            if not difficulty.valid_bits(el, get_block):
+                print("Proof of work target is invalid")
                 return False
+            if not cls.valid_merkle_root(el, blockchain[index - 1]):
+                print("Merkle root is invalid")
+                return False
+            if not cls.valid_transactions(el):
+                print("Block transactions are invalid")
+                return False
+            proofs.append((cls.block_proof_prefix(el), el.proof_number, difficulty.get_target(el)))
+            # Last transaction of a block is the mining reward, it has no signature
+            transactions.extend(el.transactions[:-1])
+        if len(proofs) >= PARALLEL_VERIFY_THRESHOLD:
+            size = chunk_size(proofs)
+            chunks = [proofs[position:position + size] for position in range(0, len(proofs), size)]
+            valid_proofs = [valid for chunk in get_pool().map(_valid_proofs, chunks) for valid in chunk]
+        else:
+            valid_proofs = _valid_proofs(proofs)
+        if not all(valid_proofs):
+            print("Proof of work is invalid")
+            return False
+        if not all(Wallet.verify_transactions(transactions)):
+            print("Transaction signature is invalid")
+            return False
         return True
 
-    # Verifies POW
+    # Verifies POW against target, blocks without bits use difficulty.LEGACY_TARGET
+    @classmethod
+    def valid_proof(cls, transactions, previous_hash, proof_number, target=difficulty.LEGACY_TARGET):
+        return ProofContext(cls.proof_prefix(transactions, previous_hash), target).valid(proof_number)
+
+    # Verifies POW of a block against its own target, False if the claimed bits are out of range
+    @classmethod
+    def valid_block_proof(cls, block):
+        if block.bits is not None and not difficulty.valid_compact(block.bits):
+            return False
+        return ProofContext(cls.block_proof_prefix(block), difficulty.get_target(block)).valid(block.proof_number)
+
+    # Part of the POW guess that does not depend on proof number, for blocks without a Merkle root
+    @staticmethod
+    def proof_prefix(transactions, previous_hash):
+        return str([tx.to_ordered_dict() for tx in transactions]) + str(previous_hash)
+
+    # Part of the POW guess of a block with a Merkle root: every header field except the proof number
     @staticmethod
-    def valid_proof(transactions, previous_hash, proof_number):
-        guess = (str([tx.to_ordered_dict() for tx in transactions]) + str(previous_hash) + str(proof_number)).encode()
-        guess_hash = hashlib.sha256(guess).hexdigest()
-        return guess_hash[0:2] == '0' * POW_DIFFICULTY
+    def header_prefix(index, previous_hash, merkle_root, timestamp, bits):
+        return json.dumps({
+            'index': index,
+            'previous_hash': previous_hash,
+            'merkle_root': merkle_root,
+            'timestamp': timestamp,
+            'bits': bits
+        }, sort_keys=True)
+
+    @classmethod
+    def block_proof_prefix(cls, block):
+        if block.merkle_root is None:
+            # Older blocks commit to their transactions except the mining reward
+            return cls.proof_prefix(block.transactions[:-1], block.previous_hash)
+        return cls.header_prefix(block.index, block.previous_hash, block.merkle_root, block.timestamp, block.bits)
+
+    # Checks the root matches the transactions, blocks without one are only valid on a chain that has none yet
+    @staticmethod
+    def valid_merkle_root(block, previous_block):
+        if block.merkle_root is None:
+            return previous_block.merkle_root is None
+        return block.merkle_root == merkle.merkle_root([tx.tx_id for tx in block.transactions])
+
+
+# Hashes POW guesses for one block template
+'''
+    The guess is prefix + proof number, so the sha256 state after the prefix is computed once and
+    copied for every proof number. A guess is valid if its digest as a big-endian integer is at
+    most the target, one integer conversion and comparison whatever the difficulty.
+'''
+
+
+class ProofContext:
+    def __init__(self, prefix, target=difficulty.LEGACY_TARGET):
+        self.__midstate = hashlib.sha256(prefix.encode())
+        self.target = target
+
+    def hash(self, proof_number):
+        guess = self.__midstate.copy()
+        guess.update(str(proof_number).encode())
+        return guess.digest()
+
+    def valid(self, proof_number):
+        return int.from_bytes(self.hash(proof_number), 'big') <= self.target
@@ -3,19 +3,151 @@ from Crypto.Signature import PKCS1_v1_5
 from Crypto.Hash import SHA256
 import Crypto.Random
 import binascii
+import functools
+import os
+import queue
+import threading
+from collections import OrderedDict
+
+import metrics
+from process_pool import get_pool, chunk_size
+from blockchain_settings import PUBLIC_KEY_CACHE_SIZE, SIGNATURE_CACHE_SIZE, PARALLEL_VERIFY_THRESHOLD, \
+    KEY_POOL_SIZE, PARALLEL_SIGN_THRESHOLD
+
+# Verification results by transaction id, least recently used first
+_verified_signatures = OrderedDict()
+_verified_signatures_lock = threading.Lock()
+
+
+# Parses sender public key once and keeps the verifier for later transactions
+@functools.lru_cache(maxsize=PUBLIC_KEY_CACHE_SIZE)
+def _get_verifier(public_key):
+    return PKCS1_v1_5.new(RSA.import_key(binascii.unhexlify(public_key)))
+
+
+# False for a malformed transaction too, e.g. a sender or signature that is not hex, so batches reject it alone
+def _verify_signature(sender, recipient, amount, signature):
+    h = SHA256.new((str(sender) + str(recipient) + str(amount)).encode('utf8'))
+    try:
+        return _get_verifier(sender).verify(h, binascii.unhexlify(signature))
+    except (TypeError, ValueError, IndexError):
+        return False
+
+
+def _verify_signatures(transactions):
+    return [_verify_signature(*tx) for tx in transactions]
+
+
+def _sign(signer, sender, recipient, amount):
+    h = SHA256.new((str(sender) + str(recipient) + str(amount)).encode('utf8'))
+    return binascii.hexlify(signer.sign(h)).decode('ascii')
+
+
+# Parses a private key once per process for batches signed on the process pool
+@functools.lru_cache(maxsize=4)
+def _get_signer(private_key):
+    return PKCS1_v1_5.new(RSA.import_key(binascii.unhexlify(private_key)))
+
+
+def _sign_transactions(args):
+    private_key, transactions = args
+    signer = _get_signer(private_key)
+    return [_sign(signer, *tx) for tx in transactions]
+
+
+def _generate_key():
+    return RSA.generate(1024, Crypto.Random.get_random_bytes)
+
+
+# Keys generated ahead on a background thread, so creating a wallet does not wait for RSA generation
+class KeyPool:
+    def __init__(self, size=KEY_POOL_SIZE):
+        self.size = size
+        self.__keys = queue.Queue(maxsize=max(1, size))
+        self.__thread = None
+        self.__lock = threading.Lock()
+
+    def start(self):
+        with self.__lock:
+            if self.__thread is None and self.size > 0:
+                self.__thread = threading.Thread(target=self.__fill, daemon=True)
+                self.__thread.start()
+
+    def __fill(self):
+        while True:
+            # Blocks while the pool is full
+            self.__keys.put(_generate_key())
+
+    # Pooled key, generated right away if the pool is empty
+    def get(self):
+        self.start()
+        try:
+            return self.__keys.get_nowait()
+        except queue.Empty:
+            return _generate_key()
+
+
+_key_pool = KeyPool()
+
+
+def _get_cached_result(tx_id):
+    with _verified_signatures_lock:
+        result = _verified_signatures.get(tx_id)
+        if result is not None:
+            _verified_signatures.move_to_end(tx_id)
+        return result
+
+
+def _cache_result(tx_id, result):
+    with _verified_signatures_lock:
+        _verified_signatures[tx_id] = result
+        _verified_signatures.move_to_end(tx_id)
+        while len(_verified_signatures) > SIGNATURE_CACHE_SIZE:
+            _verified_signatures.popitem(last=False)
+
+
+# Keys of a node
+'''
+    The private key is parsed once and the signer kept until the key changes. Key files are only
+    read again by load_keys when they changed on disk. Creating a wallet starts the key pool, so
+    a later create_keys takes a key generated in the background.
+'''
 
 
 class Wallet:
     def __init__(self, node_id):
-        self.private_key = None
+        self.__private_key = None
+        self.__signer = None
+        # Modification time and size of the key file when it was last read
+        self.__loaded_file = None
         self.public_key = None
         self.node_id = node_id
+        _key_pool.start()
+
+    @property
+    def private_key(self):
+        return self.__private_key
+
+    @private_key.setter
+    def private_key(self, private_key):
+        if private_key != self.__private_key:
+            self.__private_key = private_key
+            self.__signer = None
+
+    def __get_signer(self):
+        signer = self.__signer
+        if signer is None:
+            signer = PKCS1_v1_5.new(RSA.import_key(binascii.unhexlify(self.__private_key)))
+            self.__signer = signer
+        return signer
 
     # Function to create public and secret (private) key
     def create_keys(self):
-        private_key, public_key = self.generate_keys()
-        self.private_key = private_key
-        self.public_key = public_key
+        key = _key_pool.get()
+        self.private_key, self.public_key = self.__export_keys(key)
+        # Key object is at hand, no need to parse the exported key again
+        self.__signer = PKCS1_v1_5.new(key)
+        self.__loaded_file = None
 
     # Function to save generated kets in a wallet-host.txt file
     def save_keys(self):
@@ -25,26 +157,38 @@ class Wallet:
                     f.write(self.public_key)
                     f.write('\n')
                     f.write(self.private_key)
+                self.__loaded_file = self.__stat_keys()
                 return True
             except(IOError, IndexError):
                 print('Saving keys error')
                 return False
 
-    # Function to load wallet
+    # Function to load wallet, the file is only read again if it changed since the last load
     def load_keys(self):
             try:
+                loaded_file = self.__stat_keys()
+                if loaded_file == self.__loaded_file and self.private_key is not None:
+                    return True
                 with open('wallet-{}.txt'.format(self.node_id), mode='r') as f:
                     keys = f.readlines()
-                    self.public_key = keys[0][:-1]
-                    self.private_key = keys[1]
+                    self.public_key = keys[0].strip()
+                    self.private_key = keys[1].strip()
+                self.__loaded_file = loaded_file
                 return True
             except(IOError, IndexError):
                 print('Load keys error')
                 return False
 
+    def __stat_keys(self):
+        stat = os.stat('wallet-{}.txt'.format(self.node_id))
+        return stat.st_mtime_ns, stat.st_size
+
     # Function to generate public and secret(private) keys
     def generate_keys(self):
-        private_key = RSA.generate(1024, Crypto.Random.get_random_bytes)
+        return self.__export_keys(_key_pool.get())
+
+    @staticmethod
+    def __export_keys(private_key):
         public_key = private_key.publickey()
         private_key_str = binascii.hexlify(private_key.export_key(format='DER')).decode()
         public_key_str = binascii.hexlify(public_key.export_key(format='DER')).decode()
@@ -52,15 +196,57 @@ class Wallet:
 
     # Function to sign transaction
     def sign_transaction(self, sender, recipient, amount):
-        signer = PKCS1_v1_5.new(RSA.import_key(binascii.unhexlify(self.private_key)))
-        h = SHA256.new((str(sender) + str(recipient) + str(amount)).encode('utf8'))
-        signature = signer.sign(h)
-        return binascii.hexlify(signature).decode('ascii')
+        return _sign(self.__get_signer(), sender, recipient, amount)
+
+    # Function to sign many transactions, e.g. a payout batch
+    '''
+        transactions: list of (sender, recipient, amount)
+        Returns signatures in the same order. Large batches are spread over the process pool,
+        every worker parses the key once.
+    '''
+
+    def sign_transactions(self, transactions):
+        transactions = list(transactions)
+        if len(transactions) < PARALLEL_SIGN_THRESHOLD:
+            signer = self.__get_signer()
+            return [_sign(signer, *tx) for tx in transactions]
+        size = chunk_size(transactions)
+        chunks = [(self.private_key, transactions[start:start + size]) for start in range(0, len(transactions), size)]
+        return [signature for chunk in get_pool().map(_sign_transactions, chunks) for signature in chunk]
 
     # Function to verify wallet transaction
     @staticmethod
     def verify_transaction(transaction):
-        public_key = RSA.import_key(binascii.unhexlify(transaction.sender))
-        verifier = PKCS1_v1_5.new(public_key)
-        h = SHA256.new((str(transaction.sender) + str(transaction.recipient) + str(transaction.amount)).encode('utf8'))
-        return verifier.verify(h, binascii.unhexlify(transaction.signature))
+        tx_id = transaction.tx_id
+        result = _get_cached_result(tx_id)
+        if result is None:
+            with metrics.SIGNATURE_VERIFY_SECONDS.time():
+                result = _verify_signature(transaction.sender, transaction.recipient, transaction.amount,
+                                           transaction.signature)
+            metrics.SIGNATURE_VERIFICATIONS.inc()
+            _cache_result(tx_id, result)
+        else:
+            metrics.SIGNATURE_CACHE_HITS.inc()
+        return result
+
+    # Function to verify many transactions, large batches are spread over worker processes
+    @staticmethod
+    def verify_transactions(transactions):
+        tx_ids = [tx.tx_id for tx in transactions]
+        results = [_get_cached_result(tx_id) for tx_id in tx_ids]
+        pending = [position for position, result in enumerate(results) if result is None]
+        pending_fields = [(transactions[position].sender, transactions[position].recipient,
+                           transactions[position].amount, transactions[position].signature) for position in pending]
+        metrics.SIGNATURE_CACHE_HITS.inc(len(transactions) - len(pending))
+        with metrics.SIGNATURE_VERIFY_SECONDS.time():
+            if len(pending) >= PARALLEL_VERIFY_THRESHOLD:
+                size = chunk_size(pending_fields)
+                chunks = [pending_fields[start:start + size] for start in range(0, len(pending_fields), size)]
+                verified = [result for chunk in get_pool().map(_verify_signatures, chunks) for result in chunk]
+            else:
+                verified = _verify_signatures(pending_fields)
+        metrics.SIGNATURE_VERIFICATIONS.inc(len(pending))
+        for position, result in zip(pending, verified):
+            results[position] = result
+            _cache_result(tx_ids[position], result)
+        return results